@@ -0,0 +1,35 @@
+from .models import SharedImageRecipient
+
+
+def is_image_owner(user, image):
+    """Проверка владельца по owner_id, без загрузки объекта пользователя."""
+    return user.is_authenticated and image.owner_id == user.pk
+
+
+def is_image_recipient(user, image):
+    """Один EXISTS по индексу промежуточной таблицы вместо загрузки всех получателей."""
+    return SharedImageRecipient.objects.filter(
+        sharedimage_id=image.pk,
+        user_id=user.pk
+    ).exists()
+
+
+def can_view_image(request, image):
+    """
+    Может ли пользователь запроса просматривать изображение: владелец - сразу,
+    без запросов к БД; получатель - по EXISTS.
+    Результат запоминается на время запроса, чтобы проверка прав и
+    сериализация не выполняли ее повторно.
+    """
+    user = request.user
+    if not user.is_authenticated:
+        return False
+    if is_image_owner(user, image):
+        return True
+
+    cache = getattr(request, '_image_access_cache', None)
+    if cache is None:
+        cache = request._image_access_cache = {}
+    if image.pk not in cache:
+        cache[image.pk] = is_image_recipient(user, image)
+    return cache[image.pk]
@@ -1,8 +1,80 @@
 from django.contrib import admin
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils.html import format_html
 
-from .models import Profile
+from . import transform
+from .models import ProcessingStatus, Profile, SharedImage, SharedImageRecipient
+from .pagination import EstimatedCountPaginator
+
+# Сторона превью в списках админки, в пикселях
+THUMBNAIL_SIZE = 64
+
+
+def render_thumbnail(file, renditions, image_status):
+    """
+    Превью из готовых уменьшенных копий (наименьшая подходящая по размеру).
+    Исходники и основные файлы в списке не загружаются: пока копий нет,
+    превью не показывается.
+    """
+    if not file or not renditions or image_status != ProcessingStatus.READY:
+        return None
+    largest = renditions[str(max(int(key) for key in renditions))]
+    name = transform.pick_source(largest, renditions, THUMBNAIL_SIZE)
+    return format_html(
+        '<img src="{}" width="{}" height="{}" style="object-fit: cover" loading="lazy" alt="">',
+        file.storage.url(name), THUMBNAIL_SIZE, THUMBNAIL_SIZE
+    )
+
+
+class ScalableChangeListMixin:
+    """
+    Список без COUNT(*) по всей таблице: оценка числа строк на PostgreSQL
+    (EstimatedCountPaginator) и без второго подсчета "всего" при фильтрах.
+    Запросы к связанным записям выполняются одним JOIN (list_select_related),
+    поэтому число запросов не зависит от размера страницы.
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Profile)
-class ProfileAdmin(admin.ModelAdmin):
-    list_display = ('name', 'avatar')
+class ProfileAdmin(ScalableChangeListMixin, admin.ModelAdmin):
+    list_display = ('id', 'thumbnail', 'name', 'user', 'avatar_status', 'updated_at')
+    list_display_links = ('id', 'name')
+    list_select_related = ('user',)
+    list_filter = ('avatar_status',)
+    raw_id_fields = ('user', 'blob')
+
+    @admin.display(description='Аватар')
+    def thumbnail(self, obj):
+        return render_thumbnail(obj.avatar, obj.avatar_renditions, obj.avatar_status)
+
+
+@admin.register(SharedImage)
+class SharedImageAdmin(ScalableChangeListMixin, admin.ModelAdmin):
+    list_display = ('id', 'thumbnail', 'owner', 'caption', 'image_status', 'share_count', 'created_at')
+    list_display_links = ('id', 'caption')
+    list_select_related = ('owner',)
+    list_filter = ('image_status',)
+    ordering = ('-created_at', '-id')
+    raw_id_fields = ('owner', 'blob')
+
+    def get_queryset(self, request):
+        # Число получателей - подзапросом по индексу (sharedimage, user) для
+        # строк страницы, а не COUNT на каждую строку и не GROUP BY по всей таблице
+        recipients = (
+            SharedImageRecipient.objects.filter(sharedimage=OuterRef('pk'))
+            .order_by().values('sharedimage').annotate(count=Count('*')).values('count')
+        )
+        return super().get_queryset(request).annotate(
+            share_count=Coalesce(Subquery(recipients, output_field=IntegerField()), 0)
+        )
+
+    @admin.display(description='Получателей', ordering='share_count')
+    def share_count(self, obj):
+        return obj.share_count
+
+    @admin.display(description='Изображение')
+    def thumbnail(self, obj):
+        return render_thumbnail(obj.image, obj.image_renditions, obj.image_status)
@@ -6,5 +6,16 @@ class AvatarsConfig(AppConfig):
     name = 'avatars'
 
     def ready(self):
+        from django.conf import settings
+        from django.db.backends.signals import connection_created
+        from PIL import Image
+
         # Импортируем сигналы, чтобы они были зарегистрированы при запуске Django
-        import avatars.signals
+        import avatars.signals  # noqa: F401
+        from avatars.metrics import install_query_wrapper
+
+        # Ограничение Pillow действует и при декодировании в воркерах
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
+
+        # Подсчет запросов к БД для метрик (avatars.metrics.record_query)
+        connection_created.connect(install_query_wrapper)
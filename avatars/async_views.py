@@ -0,0 +1,279 @@
+"""
+Асинхронные (ASGI) представления для загрузки и чтения профилей и общих
+изображений.
+
+Под ASGI Django принимает тело запроса без потока, поэтому медленные
+клиенты не занимают потоки. Синхронные представления DRF под ASGI
+выполняются по одному в общем потоке, а здесь работа разделена:
+- запросы к БД идут через sync_to_async (поток для ORM);
+- разбор multipart, Pillow и обращения к хранилищу (S3) выполняются
+  в ограниченном пуле потоков ASYNC_IO_THREADS и не блокируют цикл
+  событий. Исходник загружается в хранилище до транзакции
+  (см. avatars.models.store_upload).
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.views import View
+from rest_framework import exceptions, status
+from rest_framework.authentication import get_authorization_header
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+from . import cache, transform
+from .access import can_view_image
+from .formats import FORMAT_MIME_TYPES, get_output_formats, negotiate_format
+from .models import ImageKind, ProcessingStatus, Profile, SharedImage, store_upload
+from .serializers import ProfileSerializer, SharedImageSerializer
+from .views import (
+    get_shared_image_validators,
+    get_timestamp,
+    get_transform_size,
+    get_transform_source,
+    render_transform,
+    set_transform_headers,
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                settings.ASYNC_IO_THREADS, thread_name_prefix='avatars-io'
+            )
+        return _executor
+
+
+async def run_io(func, *args, **kwargs):
+    """
+    Выполняет блокирующий вызов без обращений к БД (хранилище, Pillow,
+    разбор тела запроса) в пуле потоков и ждет результат, не занимая цикл событий.
+    Контекст (contextvars, например метка запроса для метрик) передается в поток.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(get_executor(), partial(context.run, func, *args, **kwargs))
+
+
+def json_response(data, status_code=status.HTTP_200_OK, **headers):
+    response = JsonResponse(
+        data,
+        status=status_code,
+        safe=False,
+        encoder=JSONEncoder,
+        json_dumps_params={'ensure_ascii': False}
+    )
+    for name, value in headers.items():
+        response[name] = value
+    return response
+
+
+def set_validators(response, etag, last_modified=None):
+    """Заголовки ETag и Last-Modified (как в views.conditional_response)."""
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+class AsyncAPIView(View):
+    """
+    Основа асинхронных представлений: аутентификация и разбор тела как в DRF
+    (те же классы из REST_FRAMEWORK), ошибки DRF превращаются в JSON-ответы.
+    """
+    parser_classes = (JSONParser, FormParser, MultiPartParser)
+    login_required = True
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # Аутентификация по токену, CSRF-токен не нужен (как в APIView)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.drf_request = Request(
+            request,
+            parsers=[parser() for parser in self.parser_classes],
+            authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+        )
+        try:
+            await self.authenticate()
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            headers = {}
+            if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+                authenticators = self.drf_request.authenticators
+                if authenticators:
+                    headers['WWW-Authenticate'] = authenticators[0].authenticate_header(request)
+            detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+            return json_response(detail, exc.status_code, **headers)
+
+    async def authenticate(self):
+        if get_authorization_header(self.request):
+            # Токен проверяется с загрузкой пользователя из БД
+            user = await sync_to_async(lambda: self.drf_request.user)()
+        else:
+            # Без заголовка проверять нечего - не переходим в поток ORM
+            user = AnonymousUser()
+        self.request.user = user
+        if self.login_required and not user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+
+    async def get_data(self):
+        """Разобранное тело запроса; multipart разбирается в пуле потоков."""
+        return await run_io(lambda: self.drf_request.data)
+
+    def get_serializer_context(self):
+        return {'request': self.drf_request}
+
+
+class ProfileDetailView(AsyncAPIView):
+    """
+    - GET   /api/async/profiles/{id}/ - профиль (из кэша, с ETag и Last-Modified)
+    - PATCH /api/async/profiles/{id}/ - изменение имени или загрузка аватара
+      (только владелец), при новом аватаре ответ 202
+    """
+    login_required = False
+
+    async def get(self, request, pk):
+        base_url = request.build_absolute_uri('/')
+        key = await run_io(cache.get_detail_key, pk)
+        entry = await run_io(cache.get_detail, key, base_url)
+        if entry is None:
+            entry = await sync_to_async(self.build_entry)(pk, key, base_url)
+        etag, last_modified = entry['etag'], entry['last_modified']
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = json_response(entry['data'])
+        return set_validators(response, etag, last_modified)
+
+    def build_entry(self, pk, key, base_url):
+        profile = Profile.objects.select_related('user').filter(pk=pk).first()
+        if profile is None:
+            raise exceptions.NotFound()
+        data = ProfileSerializer(profile, context=self.get_serializer_context()).data
+        return cache.set_detail(key, base_url, data, last_modified=get_timestamp(profile.updated_at))
+
+    async def patch(self, request, pk):
+        if not request.user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+        profile = await Profile.objects.select_related('user').filter(pk=pk).afirst()
+        if profile is None:
+            raise exceptions.NotFound()
+        if profile.user_id != request.user.pk:
+            raise exceptions.PermissionDenied()
+
+        serializer = ProfileSerializer(
+            profile, data=await self.get_data(), partial=True, context=self.get_serializer_context()
+        )
+        # Проверка заголовка изображения - работа Pillow, у профиля нет проверок в БД
+        await run_io(serializer.is_valid, raise_exception=True)
+        validated_data = dict(serializer.validated_data)
+        upload = validated_data.pop('avatar', None)
+        stored_name = None
+        if upload is not None:
+            stored_name = await run_io(store_upload, profile, 'avatar', upload)
+        for attr, value in validated_data.items():
+            setattr(profile, attr, value)
+        await sync_to_async(profile.save)()
+        if stored_name and profile.avatar.name != stored_name:
+            # Такой файл уже обрабатывали: запись ссылается на готовый, исходник не нужен
+            await run_io(profile.avatar.storage.delete, stored_name)
+
+        data = await sync_to_async(lambda: ProfileSerializer(
+            profile, context=self.get_serializer_context()
+        ).data)()
+        pending = data.get('avatar_status') == ProcessingStatus.PENDING
+        return json_response(data, status.HTTP_202_ACCEPTED if pending else status.HTTP_200_OK)
+
+
+class SharedImageCreateView(AsyncAPIView):
+    """POST /api/async/shared_images/ - загрузить изображение и поделиться им."""
+
+    async def post(self, request):
+        serializer = SharedImageSerializer(
+            data=await self.get_data(), context=self.get_serializer_context()
+        )
+        # Получатели проверяются запросом к БД
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
+        validated_data = dict(serializer.validated_data)
+        upload = validated_data.pop('image')
+        recipients = validated_data.pop('shared_with', [])
+
+        instance = SharedImage(owner=request.user, **validated_data)
+        stored_name = await run_io(store_upload, instance, 'image', upload)
+        await sync_to_async(self.save)(instance, recipients)
+        if instance.image.name != stored_name:
+            await run_io(instance.image.storage.delete, stored_name)
+
+        data = await sync_to_async(lambda: SharedImageSerializer(
+            instance, context=self.get_serializer_context()
+        ).data)()
+        return json_response(data, status.HTTP_201_CREATED)
+
+    def save(self, instance, recipients):
+        with transaction.atomic():
+            instance.save()
+            instance.shared_with.set(recipients)
+
+
+class SharedImageDetailView(AsyncAPIView):
+    """GET /api/async/shared_images/{id}/ - изображение (владельцу и получателям), с ETag."""
+
+    async def get(self, request, pk):
+        instance = await sync_to_async(self.get_object)(pk)
+        etag, last_modified = get_shared_image_validators(request, instance)
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            data = await sync_to_async(lambda: SharedImageSerializer(
+                instance, context=self.get_serializer_context()
+            ).data)()
+            response = json_response(data)
+        return set_validators(response, etag, last_modified)
+
+    def get_object(self, pk):
+        instance = SharedImage.objects.select_related('owner').filter(pk=pk).first()
+        if instance is None or not can_view_image(self.request, instance):
+            raise exceptions.NotFound()
+        return instance
+
+
+class ImageTransformView(AsyncAPIView):
+    """
+    GET /api/async/images/{avatar|shared_image}/{id}/?size=72 - то же, что
+    views.ImageTransformView, но декодирование и кодирование выполняются
+    в пуле потоков.
+    """
+    login_required = False
+
+    async def get(self, request, kind, pk):
+        if kind != ImageKind.AVATAR and not request.user.is_authenticated:
+            raise exceptions.NotAuthenticated()
+        size = get_transform_size(request.GET)
+        file, renditions = await sync_to_async(get_transform_source)(request, kind, pk)
+        image_format = negotiate_format(request.META.get('HTTP_ACCEPT'), get_output_formats())
+        key = transform.get_transform_key(kind, file.name, size, image_format)
+        etag = f'"{key}"'
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            data = await run_io(render_transform, key, kind, file, renditions, size, image_format)
+            response = HttpResponse(data, content_type=FORMAT_MIME_TYPES[image_format])
+        return set_transform_headers(response, kind, etag)
@@ -0,0 +1,102 @@
+"""
+Аутентификация по JWT с кэшем пользователей.
+
+JWTAuthentication на каждый запрос загружает пользователя из БД по ID из
+токена. Здесь поля пользователя (кроме хэша пароля) берутся из кэша
+AUTH_USER_CACHE_ALIAS на AUTH_USER_CACHE_TIMEOUT секунд, ключ - ID
+пользователя. Запись хранит версию токенов пользователя - хэш пароля, который
+simplejwt кладет в токен (CHECK_REVOKE_TOKEN): после смены пароля версия
+в старых токенах не совпадет ни с записью, ни с БД, и они отклоняются.
+
+Запись заполняется при входе (/api/token/) и при первом запросе после
+промаха, удаляется при любом сохранении или удалении пользователя
+(смена пароля, деактивация - см. avatars.signals). Изменение через
+QuerySet.update() сигналов не вызывает и видно не позже чем через
+AUTH_USER_CACHE_TIMEOUT секунд.
+"""
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt import serializers
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from . import metrics
+
+
+def get_cache():
+    return caches[settings.AUTH_USER_CACHE_ALIAS]
+
+
+def _user_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _get_field_names(model):
+    # Хэш пароля в кэш не попадает: поле остается отложенным и при
+    # обращении загружается из БД, а save() без update_fields его не запишет
+    return [field.attname for field in model._meta.concrete_fields if field.attname != 'password']
+
+
+def get_token_version(user):
+    """Версия токенов пользователя (значение REVOKE_TOKEN_CLAIM): меняется со сменой пароля."""
+    return get_md5_hash_password(user.password)
+
+
+def cache_user(user):
+    field_names = _get_field_names(type(user))
+    get_cache().set(_user_key(user.pk), {
+        'version': get_token_version(user),
+        'fields': field_names,
+        'values': [getattr(user, name) for name in field_names],
+    }, settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def get_cached_user(user_id, version):
+    """Пользователь из кэша или None, если записи нет или она другой версии."""
+    entry = get_cache().get(_user_key(user_id))
+    model = get_user_model()
+    field_names = _get_field_names(model)
+    if entry is None or entry['version'] != version or entry['fields'] != field_names:
+        return None
+    return model.from_db(DEFAULT_DB_ALIAS, field_names, entry['values'])
+
+
+def invalidate_user(user_id):
+    get_cache().delete(_user_key(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication, которая берет пользователя из кэша (см. описание модуля)."""
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Токен не содержит идентификатор пользователя.')
+        version = validated_token.get(api_settings.REVOKE_TOKEN_CLAIM)
+
+        # В кэше только активные пользователи с версией из записи
+        user = get_cached_user(user_id, version) if version is not None else None
+        if user is not None:
+            metrics.AUTH_USER_CACHE.labels(result='hit').inc()
+            return user
+        metrics.AUTH_USER_CACHE.labels(result='miss').inc()
+
+        # Проверки активности и версии (CHECK_REVOKE_TOKEN) - как без кэша
+        user = super().get_user(validated_token)
+        if version is not None:
+            cache_user(user)
+        return user
+
+
+class TokenObtainPairSerializer(serializers.TokenObtainPairSerializer):
+    """Выдача токенов (/api/token/), при которой пользователь сразу попадает в кэш."""
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        cache_user(self.user)
+        return data
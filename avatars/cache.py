@@ -0,0 +1,149 @@
+import hashlib
+import json
+import random
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.utils.encoders import JSONEncoder
+
+# Номер версии списков: меняется при любом изменении профиля, поэтому все
+# закэшированные страницы списка разом становятся недействительными
+LIST_VERSION_KEY = 'profiles:list-version'
+STATS_KEYS = {
+    'hits': 'profiles:stats:hits',
+    'misses': 'profiles:stats:misses',
+}
+
+
+def get_cache():
+    return caches[settings.PROFILE_CACHE_ALIAS]
+
+
+def make_etag(*parts):
+    """
+    Слабый ETag по частям представления: одно и то же представление
+    может отдаваться разными рендерерами (JSON, browsable API).
+    """
+    content = '\n'.join(str(part) for part in parts)
+    return f'W/"{hashlib.sha1(content.encode()).hexdigest()}"'
+
+
+def make_entry(data, last_modified=None):
+    """
+    Запись кэша: данные ответа, приведенные к JSON-типам, ETag по ним и
+    время изменения (Unix timestamp) для заголовка Last-Modified.
+    """
+    content = json.dumps(data, cls=JSONEncoder, sort_keys=True)
+    return {
+        'data': json.loads(content),
+        'etag': make_etag(content),
+        'last_modified': last_modified,
+    }
+
+
+def _detail_version_key(pk):
+    return f'profiles:detail-version:{pk}'
+
+
+def _incr(key, delta=1):
+    cache = get_cache()
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        # Ключа еще нет (или он вытеснен из кэша)
+        cache.add(key, 0, timeout=None)
+        return cache.incr(key, delta)
+
+
+def _record(hit):
+    # Счетчик в общем кэше - лишнее обращение к Redis на каждый запрос,
+    # поэтому учитывается только доля запросов (с соответствующим весом)
+    rate = settings.PROFILE_CACHE_STATS_SAMPLE_RATE
+    if rate and random.random() < rate:
+        _incr(STATS_KEYS['hits' if hit else 'misses'], round(1 / rate))
+
+
+def get_detail_key(pk):
+    """
+    Ключ записей профиля с его текущей версией. Как и для списка (см.
+    get_list_key), версию нужно получить до запроса к БД: запись, построенная
+    по данным до изменения профиля, запишется под старой версией и не будет
+    прочитана. Версии - случайные строки, поэтому их можно менять пачкой.
+    """
+    cache = get_cache()
+    version_key = _detail_version_key(pk)
+    version = cache.get(version_key)
+    if version is None:
+        cache.add(version_key, uuid.uuid4().hex, timeout=None)
+        version = cache.get(version_key)
+    return f'profiles:detail:{pk}:{version}'
+
+
+def get_detail(key, base_url):
+    """
+    Закэшированное представление профиля или None.
+    В ссылках на файлы может быть адрес сайта, поэтому записи одного профиля
+    хранятся в словаре {base_url: запись} под одним ключом.
+    """
+    entries = get_cache().get(key) or {}
+    entry = entries.get(base_url)
+    _record(entry is not None)
+    return entry
+
+
+def set_detail(key, base_url, data, last_modified=None):
+    cache = get_cache()
+    entries = cache.get(key) or {}
+    entry = entries[base_url] = make_entry(data, last_modified)
+    cache.set(key, entries, settings.PROFILE_CACHE_TIMEOUT)
+    return entry
+
+
+def get_list_key(full_url):
+    """
+    Ключ страницы списка с текущей версией. Версию нужно получить до запроса
+    к БД: если профиль изменится во время построения ответа, устаревшая
+    страница запишется под старой версией и не будет прочитана.
+    """
+    cache = get_cache()
+    version = cache.get(LIST_VERSION_KEY)
+    if version is None:
+        cache.add(LIST_VERSION_KEY, 1, timeout=None)
+        version = cache.get(LIST_VERSION_KEY, 1)
+    url_hash = hashlib.sha1(full_url.encode()).hexdigest()
+    return f'profiles:list:{version}:{url_hash}'
+
+
+def get_list(key):
+    entry = get_cache().get(key)
+    _record(entry is not None)
+    return entry
+
+
+def set_list(key, data):
+    entry = make_entry(data)
+    get_cache().set(key, entry, settings.PROFILE_CACHE_TIMEOUT)
+    return entry
+
+
+def invalidate_profiles(pks):
+    """Меняет версии записей профилей и делает недействительными все страницы списка."""
+    get_cache().set_many({_detail_version_key(pk): uuid.uuid4().hex for pk in pks}, timeout=None)
+    _incr(LIST_VERSION_KEY)
+
+
+def get_stats():
+    """
+    Счетчики попаданий и промахов кэша профилей (общие для всех процессов
+    при Redis). Оценка по выборке PROFILE_CACHE_STATS_SAMPLE_RATE запросов.
+    """
+    values = get_cache().get_many(STATS_KEYS.values())
+    hits = values.get(STATS_KEYS['hits'], 0)
+    misses = values.get(STATS_KEYS['misses'], 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
@@ -0,0 +1,85 @@
+import os
+
+from django.conf import settings
+from PIL import Image
+
+# Основной формат: есть у каждого обработанного изображения и понятен любому клиенту
+BASE_FORMAT = 'JPEG'
+
+FORMAT_EXTENSIONS = {
+    'JPEG': '.jpg',
+    'PNG': '.png',
+    'WEBP': '.webp',
+    'AVIF': '.avif',
+}
+FORMAT_MIME_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'WEBP': 'image/webp',
+    'AVIF': 'image/avif',
+}
+# Форматы, сохраняющие прозрачность
+ALPHA_FORMATS = {'PNG', 'WEBP', 'AVIF'}
+# Порядок выбора варианта для клиента: сначала самые компактные
+FORMAT_PREFERENCE = ('AVIF', 'WEBP', 'JPEG')
+
+
+def get_output_formats():
+    """
+    Дополнительные форматы из IMAGE_EXTRA_FORMATS, которые умеет
+    кодировать текущая сборка Pillow (AVIF есть не везде).
+    """
+    Image.init()
+    return [
+        image_format for image_format in settings.IMAGE_EXTRA_FORMATS
+        if image_format in Image.SAVE
+    ]
+
+
+def get_variant_path(name, image_format):
+    """
+    Путь варианта файла в другом формате рядом с основным.
+    Пример: avatars/user_1/f7b4c4ec-..._64.jpg -> avatars/user_1/f7b4c4ec-..._64.webp
+    """
+    root = os.path.splitext(name)[0]
+    return f'{root}{FORMAT_EXTENSIONS[image_format]}'
+
+
+def parse_accept(header):
+    """Разбирает заголовок Accept в словарь {MIME-тип: q}."""
+    accepted = {}
+    for item in header.split(','):
+        media_type, *params = [part.strip() for part in item.split(';')]
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[media_type.lower()] = quality
+    return accepted
+
+
+def negotiate_format(accept_header, formats):
+    """
+    Выбирает лучший из доступных форматов по заголовку Accept.
+
+    Современные форматы отдаются, только если клиент явно их перечислил:
+    браузеры присылают */* и для изображений, которые не умеют показывать.
+    Основной формат подходит всегда.
+
+    :param accept_header: Значение заголовка Accept.
+    :param formats: Доступные дополнительные форматы (поле *_formats модели).
+    :return: Название формата, например 'WEBP'.
+    """
+    accepted = parse_accept(accept_header or '')
+    for image_format in FORMAT_PREFERENCE:
+        if image_format == BASE_FORMAT:
+            return BASE_FORMAT
+        if image_format in formats and accepted.get(FORMAT_MIME_TYPES[image_format], 0) > 0:
+            return image_format
+    return BASE_FORMAT
@@ -0,0 +1,73 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from avatars.models import ImageKind
+from avatars.orphans import OrphanCollector
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из хранилища файлы изображений, на которые не ссылается ни одна запись '
+        '(замененные и удаленные аватары и общие изображения).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            choices=ImageKind.values,
+            action='append',
+            help='Вид изображений (можно указать несколько раз, по умолчанию все).'
+        )
+        parser.add_argument(
+            '--grace-hours',
+            type=float,
+            default=24,
+            help='Не удалять файлы моложе стольких часов (загрузки и обработка в процессе).'
+        )
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=1000,
+            help='Сколько файлов хранилища проверять за раз.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Сколько имен передавать в одном запросе к БД.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только найти файлы без ссылок, ничего не удаляя.'
+        )
+
+    def handle(self, *args, **options):
+        collector = OrphanCollector(
+            grace=timedelta(hours=options['grace_hours']),
+            page_size=options['page_size'],
+            chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'],
+            report=self.report
+        )
+        results = collector.run(options['kind'] or ImageKind.values)
+
+        for kind, stats in results.items():
+            size = stats['bytes'] / (1024 * 1024)
+            if options['dry_run']:
+                result = f'будет удалено {stats["orphaned"]} ({size:.1f} МБ)'
+            else:
+                result = f'удалено {stats["deleted"]} ({size:.1f} МБ), ошибок {stats["failed"]}'
+            self.stdout.write(self.style.SUCCESS(
+                f'{kind}: проверено {stats["listed"]} файлов, используется {stats["referenced"]}, '
+                f'новых {stats["recent"]}, {result} за {stats["elapsed"]:.1f} с'
+            ))
+
+    def report(self, kind, stats):
+        elapsed = time.monotonic() - stats['started']
+        rate = stats['listed'] / elapsed if elapsed else 0
+        self.stdout.write(
+            f'{kind}: проверено {stats["listed"]}, без ссылок {stats["orphaned"]} ({rate:.0f} файлов/с)'
+        )
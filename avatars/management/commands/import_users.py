@@ -0,0 +1,87 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from avatars.user_import import FORMATS, UserImporter, get_file_format, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        'Массово создает пользователей с профилями из CSV или JSONL '
+        '(поля username, email, password или password_hash, name, avatar).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл с пользователями, "-" - стандартный ввод.')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            default=None,
+            help='Формат файла (по умолчанию по расширению, для стандартного ввода - csv).'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько пользователей создавать за одну транзакцию.'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Процессов для хэширования паролей (по умолчанию число CPU, 0 - без пула).'
+        )
+        parser.add_argument(
+            '--avatar-dir',
+            help='Каталог с файлами аватаров; поле avatar - путь относительно него.'
+        )
+        parser.add_argument(
+            '--io-threads',
+            type=int,
+            default=8,
+            help='Потоков для загрузки аватаров (0 - без пула).'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только проверить файл, никого не создавая.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or get_file_format(path)
+        importer = UserImporter(
+            processes=options['processes'],
+            io_threads=options['io_threads'],
+            batch_size=options['batch_size'],
+            avatar_dir=options['avatar_dir'],
+            dry_run=options['dry_run'],
+            report=self.report
+        )
+        try:
+            if path == '-':
+                stats = importer.run(read_records(sys.stdin, file_format))
+            else:
+                with open(path, newline='', encoding='utf-8') as f:
+                    stats = importer.run(read_records(f, file_format))
+        except (OSError, UnicodeDecodeError) as exc:
+            raise CommandError(f'Не удалось прочитать {path}: {exc}')
+
+        for error in stats['errors']:
+            self.stderr.write(f'Строка {error["line"]}: {error["message"]}')
+        rate = stats['created'] / stats['elapsed'] if stats['elapsed'] else 0
+        verb = 'Будет создано' if options['dry_run'] else 'Создано'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {stats["created"]}, уже были {stats["skipped"]}, ошибок {stats["failed"]}, '
+            f'аватаров {stats["avatars"]} (ошибок {stats["avatar_errors"]}) '
+            f'за {stats["elapsed"]:.1f} с ({rate:.0f} польз./с)'
+        ))
+
+    def report(self, stats):
+        elapsed = time.monotonic() - stats['started']
+        rate = stats['created'] / elapsed if elapsed else 0
+        self.stdout.write(
+            f'Создано {stats["created"]}, уже были {stats["skipped"]}, '
+            f'ошибок {stats["failed"]} ({rate:.0f} польз./с)'
+        )
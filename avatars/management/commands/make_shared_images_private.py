@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from avatars.models import ImageKind
+from avatars.orphans import PREFIXES
+from avatars.storage import get_shared_image_storage, iter_file_pages, make_private
+
+
+class Command(BaseCommand):
+    help = (
+        'Устанавливает ACL private для всех файлов общих изображений в S3 (исходники, '
+        'превью, варианты форматов). Нужна один раз для файлов, загруженных '
+        'с ACL public-read до перехода на закрытое хранилище.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--page-size',
+            type=int,
+            default=1000,
+            help='Сколько файлов хранилища обрабатывать за раз.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать файлы, не меняя ACL.'
+        )
+
+    def handle(self, *args, **options):
+        storage = get_shared_image_storage()
+        if not isinstance(storage, S3Boto3Storage):
+            raise CommandError('Общие изображения хранятся не в S3: ACL не используются.')
+
+        started = time.monotonic()
+        listed = 0
+        failed = []
+        for page in iter_file_pages(storage, PREFIXES[ImageKind.SHARED_IMAGE], options['page_size']):
+            listed += len(page)
+            if not options['dry_run']:
+                failed.extend(make_private(storage, [name for name, modified, size in page]))
+            elapsed = time.monotonic() - started
+            rate = listed / elapsed if elapsed else 0
+            self.stdout.write(f'обработано {listed} ({rate:.0f} файлов/с)')
+
+        for name in failed:
+            self.stderr.write(f'{name}: не удалось изменить ACL')
+        result = f'найдено {listed}' if options['dry_run'] else f'закрыто {listed - len(failed)}'
+        self.stdout.write(self.style.SUCCESS(
+            f'{result} файлов, ошибок {len(failed)} за {time.monotonic() - started:.1f} с'
+        ))
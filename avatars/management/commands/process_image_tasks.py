@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from avatars import metrics
+from avatars.tasks import WorkerPool
+
+
+class Command(BaseCommand):
+    help = 'Запускает пул воркеров фоновой обработки изображений.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=None,
+            help='Количество параллельных воркеров (по умолчанию IMAGE_TASKS_CONCURRENCY).'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=1.0,
+            help='Пауза в секундах между опросами пустой очереди.'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать готовые задачи и завершиться.'
+        )
+        parser.add_argument(
+            '--metrics-port',
+            type=int,
+            default=None,
+            help='Порт, на котором отдавать метрики Prometheus (по умолчанию не отдаются).'
+        )
+
+    def handle(self, *args, **options):
+        pool = WorkerPool(concurrency=options['concurrency'])
+        if options['once']:
+            total = pool.drain()
+            self.stdout.write(self.style.SUCCESS(f'Обработано задач: {total}'))
+            return
+
+        if options['metrics_port']:
+            metrics.start_http_server(options['metrics_port'])
+            self.stdout.write(f'Метрики: http://0.0.0.0:{options["metrics_port"]}/metrics')
+        self.stdout.write(f'Воркеры запущены (concurrency={pool.concurrency}).')
+        try:
+            pool.run_forever(poll_interval=options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write('Остановка воркеров.')
@@ -0,0 +1,92 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from avatars.models import ImageKind
+from avatars.reprocess import Checkpoint, Reprocessor
+
+
+class Command(BaseCommand):
+    help = (
+        'Перегенерирует обработанные изображения (основной файл, копии и форматы) '
+        'по текущим настройкам.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            choices=ImageKind.values,
+            action='append',
+            help='Вид изображений (можно указать несколько раз, по умолчанию все).'
+        )
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=None,
+            help='Процессов для декодирования и кодирования (по умолчанию число CPU, 0 - без пула).'
+        )
+        parser.add_argument(
+            '--io-threads',
+            type=int,
+            default=8,
+            help='Потоков для скачивания и загрузки файлов (0 - без пула).'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Сколько записей читать из БД за раз.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Размер партии, после которой сохраняется контрольная точка.'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=0,
+            help='Не больше стольких изображений в секунду (0 - без ограничения).'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help=(
+                'JSON-файл контрольной точки: повторный запуск продолжит с места остановки '
+                'и повторит записи с ошибками.'
+            )
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать изображения, ничего не изменяя.'
+        )
+
+    def handle(self, *args, **options):
+        reprocessor = Reprocessor(
+            processes=options['processes'],
+            io_threads=options['io_threads'],
+            chunk_size=options['chunk_size'],
+            batch_size=options['batch_size'],
+            rate=options['rate'],
+            checkpoint=Checkpoint(options['checkpoint']),
+            dry_run=options['dry_run'],
+            report=self.report
+        )
+        results = reprocessor.run(options['kind'] or ImageKind.values)
+
+        for kind, stats in results.items():
+            rate = stats['processed'] / stats['elapsed'] if stats['elapsed'] else 0
+            verb = 'Будет перегенерировано' if options['dry_run'] else 'Перегенерировано'
+            self.stdout.write(self.style.SUCCESS(
+                f'{kind}: {verb} {stats["processed"]}, записей с общим файлом '
+                f'{stats["skipped"]}, без оригинала {stats["missing"]}, ошибок {stats["failed"]} '
+                f'({rate:.1f} изобр./с)'
+            ))
+
+    def report(self, kind, stats):
+        elapsed = time.monotonic() - stats['started']
+        rate = stats['processed'] / elapsed if elapsed else 0
+        self.stdout.write(
+            f'{kind}: {stats["processed"]} готово, {stats["failed"]} ошибок ({rate:.1f} изобр./с)'
+        )
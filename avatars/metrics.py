@@ -0,0 +1,263 @@
+"""
+Метрики Prometheus (prometheus_client): счетчики и гистограммы этапов
+обработки изображений, операций с хранилищем и запросов к БД.
+
+Замер стоит пару вызовов perf_counter и обновление значения метрики,
+поэтому метрики можно держать включенными в продакшене (METRICS_ENABLED).
+Веб-процессы отдают метрики на /api/metrics/, воркер очереди - на порту
+--metrics-port (см. process_image_tasks).
+
+Когда на хосте несколько процессов (gunicorn или uvicorn с --workers,
+несколько воркеров очереди), задайте переменную окружения
+PROMETHEUS_MULTIPROC_DIR - общий каталог до запуска процессов
+(multiprocess mode prometheus_client). Процессы пишут значения в файлы
+этого каталога, а ответ сборщику суммирует их (MultiProcessCollector).
+Без него сборщик видел бы значения того процесса, который случайно принял
+запрос. Каталог очищают при запуске сервера (до старта воркеров).
+
+Метка endpoint - имя маршрута текущего запроса (например, profile-detail)
+или задачи очереди (task:avatar); она берется из контекста (contextvars),
+поэтому доступна в потоках sync_to_async и avatars.async_views.run_io.
+"""
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+# Секунды: от миллисекунды (маленькая копия) до десятков секунд (большой PNG)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Корзины размера изображения по длинной стороне, в пикселях
+SIZE_BUCKETS = (256, 1024, 2048, 4096)
+
+# Отдельный реестр: без стандартных метрик процесса и платформы
+registry = CollectorRegistry()
+
+REQUEST_SECONDS = Histogram(
+    'avatars_http_request_duration_seconds', 'Время обработки HTTP-запроса.', ('endpoint', 'method'),
+    buckets=DEFAULT_BUCKETS, registry=registry
+)
+REQUESTS = Counter(
+    'avatars_http_requests', 'Количество HTTP-запросов.', ('endpoint', 'method', 'status'),
+    registry=registry
+)
+DB_QUERIES = Histogram(
+    'avatars_db_queries_per_request', 'Количество запросов к БД за HTTP-запрос.', ('endpoint',),
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100), registry=registry
+)
+DB_SECONDS = Histogram(
+    'avatars_db_duration_seconds', 'Суммарное время запросов к БД за HTTP-запрос.', ('endpoint',),
+    buckets=DEFAULT_BUCKETS, registry=registry
+)
+IMAGE_STAGE_SECONDS = Histogram(
+    'avatars_image_stage_duration_seconds',
+    'Время этапа обработки изображения (decode, resize, convert, encode).',
+    ('stage', 'format', 'size', 'endpoint'),
+    buckets=DEFAULT_BUCKETS, registry=registry
+)
+STORAGE_SECONDS = Histogram(
+    'avatars_storage_duration_seconds', 'Время операции с хранилищем файлов.', ('operation', 'endpoint'),
+    buckets=DEFAULT_BUCKETS, registry=registry
+)
+AUTH_USER_CACHE = Counter(
+    'avatars_auth_user_cache', 'Поиск пользователя по JWT в кэше (hit, miss).', ('result',),
+    registry=registry
+)
+IMAGE_TASK_SECONDS = Histogram(
+    'avatars_image_task_duration_seconds', 'Время выполнения задачи обработки изображения.',
+    ('kind', 'status'),
+    buckets=DEFAULT_BUCKETS, registry=registry
+)
+
+METRICS = (
+    REQUEST_SECONDS, REQUESTS, DB_QUERIES, DB_SECONDS,
+    IMAGE_STAGE_SECONDS, STORAGE_SECONDS, AUTH_USER_CACHE, IMAGE_TASK_SECONDS,
+)
+
+
+def clear():
+    """Сбрасывает значения всех метрик текущего процесса (тесты, бенчмарки)."""
+    for metric in METRICS:
+        metric.clear()
+
+
+def render():
+    """
+    Метрики для ответа сборщику. С PROMETHEUS_MULTIPROC_DIR - сумма по всем
+    процессам хоста, иначе значения текущего процесса.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        # Реестр создается на каждый ответ, как рекомендует prometheus_client
+        collector_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector_registry)
+        return generate_latest(collector_registry)
+    return generate_latest(registry)
+
+
+class Scope:
+    """Текущий HTTP-запрос или задача: метка endpoint и счетчики запросов к БД."""
+    __slots__ = ('label', 'request', 'queries', 'db_seconds')
+
+    def __init__(self, label=None, request=None):
+        self.label = label
+        self.request = request
+        self.queries = 0
+        self.db_seconds = 0.0
+
+    @property
+    def endpoint(self):
+        if self.label is not None:
+            return self.label
+        # Маршрут известен после разрешения URL; путь не используется, чтобы
+        # число рядов не росло вместе с id в адресах
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match is not None else 'unresolved'
+
+
+_scope = contextvars.ContextVar('metrics_scope', default=None)
+
+
+def get_endpoint():
+    scope = _scope.get()
+    return scope.endpoint if scope is not None else 'background'
+
+
+@contextmanager
+def request_scope(request):
+    scope = Scope(request=request)
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+
+
+@contextmanager
+def task_scope(label):
+    """
+    Метка для работы вне HTTP-запроса (задачи очереди). Если задача
+    выполняется внутри запроса (IMAGE_TASKS_EAGER), замеры относятся к запросу.
+    """
+    if _scope.get() is not None:
+        yield
+        return
+    token = _scope.set(Scope(label=label))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Обертка выполнения SQL (connection.execute_wrappers): считает запросы
+    и их время в текущем Scope. Вне запроса и задачи только вызывает execute.
+    """
+    scope = _scope.get()
+    if scope is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        scope.queries += 1
+        scope.db_seconds += time.perf_counter() - started
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """Обработчик сигнала connection_created: подключает record_query к соединению."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def get_size_bucket(size):
+    """Метка размера изображения: наименьшая граница SIZE_BUCKETS не меньше длинной стороны или +Inf."""
+    side = max(size)
+    for bound in SIZE_BUCKETS:
+        if side <= bound:
+            return str(bound)
+    return '+Inf'
+
+
+def observe_image_stage(stage, size, seconds, image_format=''):
+    if settings.METRICS_ENABLED:
+        IMAGE_STAGE_SECONDS.labels(
+            stage=stage, format=image_format or '', size=get_size_bucket(size), endpoint=get_endpoint()
+        ).observe(seconds)
+
+
+@contextmanager
+def image_stage(stage, size, image_format=''):
+    """Замер этапа обработки изображения размера `size` (ширина, высота)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_image_stage(stage, size, time.perf_counter() - started, image_format)
+
+
+@contextmanager
+def storage_operation(operation):
+    """Замер операции с хранилищем (open, save, delete, exists)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if settings.METRICS_ENABLED:
+            STORAGE_SECONDS.labels(operation=operation, endpoint=get_endpoint()).observe(
+                time.perf_counter() - started
+            )
+
+
+def is_authorized(authorization):
+    """
+    Проверяет заголовок Authorization запроса метрик: Bearer METRICS_TOKEN.
+    Без токена в настройках метрики открыты только при DEBUG.
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        return settings.DEBUG
+    return constant_time_compare(authorization or '', f'Bearer {token}')
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if not is_authorized(self.headers.get('Authorization')):
+            self.send_error(403)
+            return
+        body = render()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_http_server(port, address=''):
+    """
+    Отдает метрики процесса по HTTP из фонового потока - для процессов без
+    веб-сервера (воркер очереди).
+
+    :return: Запущенный сервер (server.shutdown() останавливает его).
+    """
+    server = ThreadingHTTPServer((address, port), MetricsRequestHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    return server
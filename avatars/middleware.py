@@ -0,0 +1,52 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+
+KNOWN_METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+
+class MetricsMiddleware:
+    """
+    Время ответа, количество и суммарное время запросов к БД для каждого
+    HTTP-запроса (см. avatars.metrics). Работает и под WSGI, и под ASGI
+    без лишнего перехода между потоками. Ставится первым в MIDDLEWARE,
+    чтобы замер включал остальные middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+        started = time.perf_counter()
+        with metrics.request_scope(request) as scope:
+            response = self.get_response(request)
+        self.record(request, response, scope, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.METRICS_ENABLED:
+            return await self.get_response(request)
+        started = time.perf_counter()
+        with metrics.request_scope(request) as scope:
+            response = await self.get_response(request)
+        self.record(request, response, scope, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, scope, seconds):
+        endpoint = scope.endpoint
+        method = request.method if request.method in KNOWN_METHODS else 'other'
+        metrics.REQUEST_SECONDS.labels(endpoint=endpoint, method=method).observe(seconds)
+        metrics.REQUESTS.labels(endpoint=endpoint, method=method, status=f'{response.status_code // 100}xx').inc()
+        metrics.DB_QUERIES.labels(endpoint=endpoint).observe(scope.queries)
+        metrics.DB_SECONDS.labels(endpoint=endpoint).observe(scope.db_seconds)
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avatars', '0002_image_processing_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
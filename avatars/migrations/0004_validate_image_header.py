@@ -0,0 +1,26 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:32
+
+from django.db import migrations, models
+
+import avatars.models
+import avatars.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avatars', '0003_profile_avatar_renditions'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, upload_to=avatars.models.get_avatar_upload_path, validators=[avatars.validators.validate_image_file_extension, avatars.validators.validate_image_size, avatars.validators.validate_image_header]),
+        ),
+        migrations.AlterField(
+            model_name='sharedimage',
+            name='image',
+            field=models.ImageField(upload_to=avatars.models.get_shared_image_upload_path, validators=[avatars.validators.validate_image_file_extension, avatars.validators.validate_image_size, avatars.validators.validate_image_header]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avatars', '0004_validate_image_header'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('avatar', 'Аватар профиля'), ('shared_image', 'Общее изображение')], max_length=32)),
+                ('source_sha256', models.CharField(max_length=64)),
+                ('name', models.CharField(max_length=255)),
+                ('renditions', models.JSONField(blank=True, default=dict)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='imagetask',
+            name='source_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='imagetask',
+            name='kind',
+            field=models.CharField(choices=[('avatar', 'Аватар профиля'), ('shared_image', 'Общее изображение')], max_length=32),
+        ),
+        migrations.AddConstraint(
+            model_name='imageblob',
+            constraint=models.UniqueConstraint(fields=('kind', 'source_sha256'), name='unique_blob_per_source'),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='avatars.imageblob'),
+        ),
+        migrations.AddField(
+            model_name='sharedimage',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='avatars.imageblob'),
+        ),
+    ]
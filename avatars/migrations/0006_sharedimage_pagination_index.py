@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avatars', '0005_image_blob_dedup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sharedimage',
+            index=models.Index(fields=['-created_at', '-id'], name='sharedimage_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('avatars', '0006_sharedimage_pagination_index'),
+    ]
+
+    operations = [
+        # Автоматическая промежуточная таблица M2M становится явной моделью.
+        # Таблица уже существует, поэтому меняется только состояние миграций.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='SharedImageRecipient',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                        ('sharedimage', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='avatars.sharedimage')),
+                        ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+                    ],
+                    options={
+                        'db_table': 'avatars_sharedimage_shared_with',
+                        'unique_together': {('sharedimage', 'user')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='sharedimage',
+                    name='shared_with',
+                    field=models.ManyToManyField(blank=True, related_name='received_images', through='avatars.SharedImageRecipient', to=settings.AUTH_USER_MODEL),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='sharedimagerecipient',
+            index=models.Index(fields=['user', 'sharedimage'], name='recipient_user_image_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sharedimage',
+            index=models.Index(fields=['owner', '-created_at'], name='sharedimage_owner_created_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avatars', '0007_sharedimage_recipient_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sharedimage',
+            name='image_renditions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='sharedimage',
+            name='image_status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('processing', 'Обрабатывается'), ('ready', 'Готово'), ('failed', 'Ошибка')], default='ready', max_length=16),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.11 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avatars', '0008_sharedimage_processing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageblob',
+            name='formats',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_formats',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='sharedimage',
+            name='image_formats',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
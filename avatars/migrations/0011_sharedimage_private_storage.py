@@ -0,0 +1,22 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+import avatars.models
+import avatars.storage
+import avatars.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avatars', '0010_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='sharedimage',
+            name='image',
+            field=models.ImageField(storage=avatars.storage.get_shared_image_storage, upload_to=avatars.models.get_shared_image_upload_path, validators=[avatars.validators.validate_image_file_extension, avatars.validators.validate_image_size, avatars.validators.validate_image_header]),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('avatars', '0011_sharedimage_private_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='avatar_status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('ready', 'Готово'), ('failed', 'Ошибка')], default='ready', max_length=16),
+        ),
+        migrations.AlterField(
+            model_name='sharedimage',
+            name='image_status',
+            field=models.CharField(choices=[('pending', 'В очереди'), ('ready', 'Готово'), ('failed', 'Ошибка')], default='ready', max_length=16),
+        ),
+    ]
@@ -0,0 +1,95 @@
+import copy
+
+from django.db import models
+
+
+class DirtyFieldsMixin:
+    """
+    Отслеживание измененных полей модели без дополнительных запросов к БД.
+
+    При загрузке из БД запоминаются значения полей; get_dirty_fields()
+    сравнивает с ними текущие значения. save() существующего объекта
+    сам передает update_fields, поэтому записываются только измененные колонки.
+    Объект, созданный в коде (а не загруженный), считается измененным целиком.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._snapshot_loaded_values()
+        return instance
+
+    def _get_tracked_value(self, field):
+        value = getattr(self, field.attname)
+        if isinstance(field, models.FileField):
+            # Для файлов важно только имя в хранилище
+            return value.name if value else None
+        return copy.deepcopy(value)
+
+    def _get_tracked_fields(self, names=None):
+        # Отложенные (defer/only) поля не загружены - их не отслеживаем
+        return [
+            field for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (names is None or field.name in names or field.attname in names)
+        ]
+
+    def _snapshot_loaded_values(self, names=None):
+        if names is None or getattr(self, '_loaded_values', None) is None:
+            self._loaded_values = {}
+        for field in self._get_tracked_fields(names):
+            self._loaded_values[field.attname] = self._get_tracked_value(field)
+
+    def get_dirty_fields(self):
+        """Имена полей, значения которых отличаются от загруженных из БД."""
+        loaded_values = getattr(self, '_loaded_values', None)
+        if loaded_values is None:
+            return {field.name for field in self._get_tracked_fields()}
+
+        dirty = set()
+        for field in self._get_tracked_fields():
+            if field.attname not in loaded_values:
+                continue
+            if isinstance(field, models.FileField):
+                file = getattr(self, field.attname)
+                if file and not file._committed:
+                    dirty.add(field.name)
+                    continue
+            if self._get_tracked_value(field) != loaded_values[field.attname]:
+                dirty.add(field.name)
+        return dirty
+
+    def is_field_dirty(self, name):
+        return name in self.get_dirty_fields()
+
+    def get_loaded_value(self, name):
+        """Значение поля при загрузке из БД (None для нового объекта и отложенного поля)."""
+        loaded_values = getattr(self, '_loaded_values', None) or {}
+        return loaded_values.get(self._meta.get_field(name).attname)
+
+    def save(self, *args, **kwargs):
+        loaded = getattr(self, '_loaded_values', None) is not None
+        if (
+            loaded
+            and not self._state.adding
+            and not args
+            and kwargs.get('update_fields') is None
+            and not kwargs.get('force_insert')
+        ):
+            dirty = self.get_dirty_fields()
+            if dirty:
+                # auto_now-поля обновляются при каждом сохранении с изменениями
+                dirty |= {
+                    field.name for field in self._meta.concrete_fields
+                    if getattr(field, 'auto_now', False)
+                }
+            kwargs['update_fields'] = dirty
+        super().save(*args, **kwargs)
+        # Записаны только update_fields: остальные поля остаются измененными
+        update_fields = kwargs.get('update_fields')
+        self._snapshot_loaded_values(names=None if update_fields is None else set(update_fields))
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self._snapshot_loaded_values(names=fields)
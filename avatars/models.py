@@ -1,35 +1,285 @@
+import hashlib
 import os
 import uuid
+from functools import partial
 
 from django.conf import settings
-from django.core.files.base import ContentFile
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
-from .utils import process_image
-from .validators import validate_image_file_extension, validate_image_size
+from .formats import BASE_FORMAT, get_variant_path
+from .mixins import DirtyFieldsMixin
+from .storage import get_shared_image_storage
+from .utils import get_file_sha256
+from .validators import (
+    validate_image_file_extension,
+    validate_image_header,
+    validate_image_size,
+)
 
+# Сколько символов hex SHA-256 входит в имя файла (128 бит)
+CONTENT_HASH_LENGTH = 32
+# Расширение сохраненного исходника (формат определяется по содержимому)
+SOURCE_EXTENSION = '.orig'
 
-def get_avatar_upload_path(instance, filename):
+
+def get_upload_filename(filename, content_hash=None):
+    """
+    Имя файла в хранилище. Обработанные файлы называются по хэшу содержимого:
+    имя меняется вместе с содержимым, поэтому файлы можно кэшировать навсегда
+    (Cache-Control: immutable). Исходники до обработки получают случайное имя.
+    """
+    ext = os.path.splitext(filename)[1]
+    if content_hash:
+        return f"{content_hash[:CONTENT_HASH_LENGTH]}{ext}"
+    return f"{uuid.uuid4()}{ext}"
+
+
+def get_avatar_upload_path(instance, filename, content_hash=None):
     """
     Генерирует уникальный путь для аватара пользователя.
     Пример: avatars/user_1/f7b4c4ec-9d6a-4c2s-8f0d-2b3a6a1c8b7e.jpg
     """
-    ext = os.path.splitext(filename)[1]
-    new_filename = f"{uuid.uuid4()}{ext}"
+    new_filename = get_upload_filename(filename, content_hash)
     return os.path.join('avatars', f'user_{instance.user.id}', new_filename)
 
 
-def get_shared_image_upload_path(instance, filename):
+def get_shared_image_upload_path(instance, filename, content_hash=None):
     """
     Генерирует путь для общих изображений.
     Пример: shared/owner_1/f7b4c4ec-9d6a-4c2s-8f0d-2b3a6a1c8b7e.jpg
     """
-    ext = os.path.splitext(filename)[1]
-    new_filename = f"{uuid.uuid4()}{ext}"
+    new_filename = get_upload_filename(filename, content_hash)
     return os.path.join('shared', f'owner_{instance.owner.id}', new_filename)
 
 
-class Profile(models.Model):
+def get_rendition_path(name, size):
+    """
+    Путь уменьшенной копии рядом с основным файлом.
+    Пример: avatars/user_1/f7b4c4ec-....jpg -> avatars/user_1/f7b4c4ec-..._64.jpg
+    """
+    root, ext = os.path.splitext(name)
+    return f'{root}_{size}{ext}'
+
+
+def get_source_path(name):
+    """
+    Путь исходника (оригинала загрузки) рядом с основным файлом. С него
+    перегенерируются копии (см. avatars.reprocess), а не с уже сжатого
+    основного файла.
+    Пример: avatars/user_1/f7b4c4ec-....jpg -> avatars/user_1/f7b4c4ec-....orig
+    """
+    return os.path.splitext(name)[0] + SOURCE_EXTENSION
+
+
+def get_output_path(name, size=None, image_format=BASE_FORMAT):
+    """Путь файла обработанного изображения: копии `size` (None - основной файл) в формате `image_format`."""
+    path = name if size is None else get_rendition_path(name, size)
+    if image_format != BASE_FORMAT:
+        path = get_variant_path(path, image_format)
+    return path
+
+
+def get_outputs_hash(digests):
+    """
+    Общий хэш набора файлов обработанного изображения
+    ({(размер, формат): SHA-256 файла}): меняется при изменении любого из них,
+    в том числе при смене настроек качества или размеров копий.
+    """
+    combined = hashlib.sha256()
+    for key in sorted(digests, key=str):
+        combined.update(f'{key}:{digests[key]}\n'.encode())
+    return combined.hexdigest()
+
+
+def get_image_files(name, renditions=None, formats=None):
+    """
+    Все файлы обработанного изображения: основной, копии, их варианты в
+    других форматах и исходник.
+    """
+    names = [name, *(renditions or {}).values()]
+    return names + [
+        get_variant_path(item, image_format)
+        for image_format in formats or []
+        for item in names
+    ] + [get_source_path(name)]
+
+
+def get_image_field(kind):
+    """Поле с файлом изображения вида `kind`: Profile.avatar или SharedImage.image."""
+    if kind == ImageKind.AVATAR:
+        return Profile._meta.get_field('avatar')
+    return SharedImage._meta.get_field('image')
+
+
+def delete_unreferenced_files(kind, name, renditions=None, formats=None):
+    """
+    Удаляет файлы изображения (основной, копии, форматы), если на основной
+    файл не ссылается ни одна запись и ни один ImageBlob.
+    """
+    field = get_image_field(kind)
+    if (
+        ImageBlob.objects.filter(kind=kind, name=name).exists()
+        or field.model.objects.filter(**{field.name: name}).exists()
+    ):
+        return
+    for file_name in get_image_files(name, renditions, formats):
+        field.storage.delete(file_name)
+
+
+def delete_files_on_commit(kind, name, renditions=None, formats=None):
+    """
+    Удаляет файлы замененного или удаленного изображения без ImageBlob
+    (исходник в очереди, ошибка обработки, файлы до дедупликации) после
+    фиксации транзакции: при откате запись продолжает на них ссылаться.
+    Файлы с ImageBlob удаляются по счетчику ссылок (ImageBlobManager.release).
+    """
+    if name:
+        transaction.on_commit(
+            partial(delete_unreferenced_files, kind, name, renditions, formats), robust=True
+        )
+
+
+def store_upload(instance, field_name, upload):
+    """
+    Загружает исходник в хранилище до сохранения записи. Асинхронные
+    представления (см. avatars.async_views) выполняют это в пуле потоков,
+    а save() затем только пишет в БД и ставит задачу, не держа транзакцию
+    на время загрузки. SHA-256 берется из обработчика загрузки.
+
+    :return: Имя файла в хранилище.
+    """
+    field = instance._meta.get_field(field_name)
+    name = field.generate_filename(instance, upload.name)
+    name = field.storage.save(name, upload, max_length=field.max_length)
+    setattr(instance, field_name, name)
+    field_file = getattr(instance, field_name)
+    field_file.file = upload
+    field_file.prestored = True
+    return name
+
+
+def is_new_upload(field_file):
+    """Новый исходник: файл из запроса или загруженный заранее через store_upload."""
+    return not field_file._committed or getattr(field_file, 'prestored', False)
+
+
+class ProcessingStatus(models.TextChoices):
+    """Статус фоновой обработки загруженного изображения."""
+    PENDING = 'pending', 'В очереди'
+    READY = 'ready', 'Готово'
+    FAILED = 'failed', 'Ошибка'
+
+
+class ImageKind(models.TextChoices):
+    """Вид изображения: определяет способ обработки и пространство дедупликации."""
+    AVATAR = 'avatar', 'Аватар профиля'
+    SHARED_IMAGE = 'shared_image', 'Общее изображение'
+
+
+class ImageBlobManager(models.Manager):
+    def acquire(self, kind, source_sha256):
+        """
+        Ищет готовый файл для исходника с таким хэшем и увеличивает счетчик ссылок.
+        Возвращает ImageBlob или None, если такой исходник еще не встречался.
+        """
+        with transaction.atomic():
+            blob = self.select_for_update().filter(
+                kind=kind,
+                source_sha256=source_sha256,
+                ref_count__gt=0
+            ).first()
+            if blob is not None:
+                blob.ref_count += 1
+                blob.save(update_fields=['ref_count'])
+        return blob
+
+    def register(self, kind, source_sha256, name, renditions=None, formats=None):
+        """
+        Регистрирует новый файл со счетчиком ссылок 1. Если параллельно уже
+        зарегистрирован файл для того же исходника, берется ссылка на него;
+        вызывающий код должен удалить свою копию, если blob.name != name.
+        """
+        blob = self.acquire(kind, source_sha256)
+        if blob is not None:
+            return blob
+        blob, created = self.get_or_create(
+            kind=kind,
+            source_sha256=source_sha256,
+            defaults={
+                'name': name,
+                'renditions': renditions or {},
+                'formats': formats or [],
+                'ref_count': 1
+            }
+        )
+        if not created:
+            return self.acquire(kind, source_sha256)
+        return blob
+
+    def release(self, blob_id):
+        """
+        Уменьшает счетчик ссылок. Когда ссылок не остается, запись удаляется,
+        а файлы удаляются из хранилища после фиксации транзакции.
+        """
+        if blob_id is None:
+            return
+        with transaction.atomic():
+            blob = self.select_for_update().filter(pk=blob_id).first()
+            if blob is None:
+                return
+            blob.ref_count -= 1
+            if blob.ref_count > 0:
+                blob.save(update_fields=['ref_count'])
+                return
+            blob.delete()
+            transaction.on_commit(blob.delete_files)
+
+
+class ImageBlob(models.Model):
+    """
+    Обработанный файл, адресуемый по SHA-256 исходника. Одинаковые загрузки
+    (например, один и тот же мем у сотни пользователей) хранятся и
+    обрабатываются один раз, а записи Profile/SharedImage ссылаются на blob.
+    """
+    kind = models.CharField(max_length=32, choices=ImageKind.choices)
+    source_sha256 = models.CharField(max_length=64)
+    # Путь основного файла и уменьшенных копий в хранилище
+    name = models.CharField(max_length=255)
+    renditions = models.JSONField(default=dict, blank=True)
+    # Дополнительные форматы, в которых сохранены файл и копии (см. avatars.formats)
+    formats = models.JSONField(default=list, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ImageBlobManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'source_sha256'],
+                name='unique_blob_per_source'
+            ),
+        ]
+
+    @property
+    def storage(self):
+        return get_image_field(self.kind).storage
+
+    def delete_files(self):
+        # Имена строятся по содержимому: разные исходники (например,
+        # отличающиеся только метаданными) могут дать те же файлы
+        if ImageBlob.objects.filter(kind=self.kind, name=self.name).exists():
+            return
+        storage = self.storage
+        for name in get_image_files(self.name, self.renditions, self.formats):
+            storage.delete(name)
+
+    def __str__(self):
+        return f'{self.get_kind_display()} {self.source_sha256[:12]} ({self.ref_count})'
+
+
+class Profile(DirtyFieldsMixin, models.Model):
     user = models.OneToOneField(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -39,41 +289,87 @@ class Profile(models.Model):
     name = models.CharField(max_length=100, blank=True)
     avatar = models.ImageField(
         upload_to=get_avatar_upload_path,
-        validators=[validate_image_file_extension, validate_image_size],
+        validators=[validate_image_file_extension, validate_image_size, validate_image_header],
+        blank=True,
+        null=True
+    )
+    avatar_status = models.CharField(
+        max_length=16,
+        choices=ProcessingStatus.choices,
+        default=ProcessingStatus.READY
+    )
+    # Уменьшенные копии аватара: {"64": "avatars/user_1/..._64.jpg", ...}
+    avatar_renditions = models.JSONField(default=dict, blank=True)
+    # Форматы, в которых аватар и копии есть помимо JPEG: ["WEBP", "AVIF"]
+    avatar_formats = models.JSONField(default=list, blank=True)
+    # Общий обработанный файл, на который ссылается аватар
+    blob = models.ForeignKey(
+        ImageBlob,
+        on_delete=models.SET_NULL,
+        related_name='+',
         blank=True,
         null=True
     )
+    # Время последнего изменения для заголовка Last-Modified
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
-        # Логика обработки аватара при изменении
-        if self._is_avatar_changed() and self.avatar:
-            processed_buffer = process_image(self.avatar)
-            if processed_buffer:
-                original_filename = os.path.basename(self.avatar.name)
-                self.avatar.file = ContentFile(
-                    processed_buffer.read(),
-                    name=original_filename
-                )
-
         # Если имя не задано, используем username пользователя
         if not self.name:
             self.name = self.user.username
 
-        super().save(*args, **kwargs)
+        # Новый профиль без аватара (создается сигналом) сохраняем как обычно
+        avatar_changed = self.is_field_dirty('avatar') and (self.avatar or not self._state.adding)
+        if not avatar_changed:
+            super().save(*args, **kwargs)
+            return
 
-    def _is_avatar_changed(self):
-        if not self.pk: return True
-        try:
-            old_avatar = Profile.objects.get(pk=self.pk).avatar
-        except Profile.DoesNotExist:
-            return True
-        return old_avatar != self.avatar
+        # Новый аватар сохраняется "как есть", а обработка (обрезка, сжатие)
+        # выполняется фоновым воркером, чтобы не занимать поток запроса.
+        # Если такой же файл уже загружали, используем готовый результат
+        with transaction.atomic():
+            old_blob_id = self.blob_id
+            old_files = (
+                self.get_loaded_value('avatar'),
+                self.get_loaded_value('avatar_renditions'),
+                self.get_loaded_value('avatar_formats'),
+            )
+            source_sha256 = ''
+            # Копии прежнего аватара больше не соответствуют новому файлу
+            self.avatar_renditions = {}
+            self.avatar_formats = []
+            self.blob = None
+            if not self.avatar:
+                # Аватар удален: обрабатывать нечего, прежний статус
+                # (в очереди, ошибка) к профилю без аватара не относится
+                self.avatar_status = ProcessingStatus.READY
+            else:
+                source_sha256 = get_file_sha256(self.avatar.file)
+                self.blob = ImageBlob.objects.acquire(ImageKind.AVATAR, source_sha256)
+                if self.blob is not None:
+                    # Файл уже обработан и лежит в хранилище: повторно не загружаем
+                    self.avatar = self.blob.name
+                    self.avatar_renditions = self.blob.renditions
+                    self.avatar_formats = self.blob.formats
+                    self.avatar_status = ProcessingStatus.READY
+                else:
+                    self.avatar_status = ProcessingStatus.PENDING
+
+            super().save(*args, **kwargs)
+
+            ImageBlob.objects.release(old_blob_id)
+            if old_blob_id is None and old_files[0] != self.avatar.name:
+                delete_files_on_commit(ImageKind.AVATAR, *old_files)
+            if self.avatar_status == ProcessingStatus.PENDING:
+                ImageTask.objects.enqueue(
+                    ImageKind.AVATAR, self.pk, self.avatar.name, source_sha256
+                )
 
     def __str__(self):
         return f'Profile for {self.user.username}'
 
 
-class SharedImage(models.Model):
+class SharedImage(DirtyFieldsMixin, models.Model):
     owner = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -81,15 +377,167 @@ class SharedImage(models.Model):
     )
     image = models.ImageField(
         upload_to=get_shared_image_upload_path,
-        validators=[validate_image_file_extension, validate_image_size]
+        storage=get_shared_image_storage,
+        validators=[validate_image_file_extension, validate_image_size, validate_image_header]
     )
+    image_status = models.CharField(
+        max_length=16,
+        choices=ProcessingStatus.choices,
+        default=ProcessingStatus.READY
+    )
+    # Превью изображения: {"320": "shared/owner_1/..._320.jpg", ...}
+    image_renditions = models.JSONField(default=dict, blank=True)
+    # Форматы, в которых изображение и превью есть помимо JPEG
+    image_formats = models.JSONField(default=list, blank=True)
     caption = models.CharField(max_length=255, blank=True)
     shared_with = models.ManyToManyField(
         settings.AUTH_USER_MODEL,
+        through='SharedImageRecipient',
         related_name='received_images',
         blank=True
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    # Время последнего изменения (файл, получатели) для заголовка Last-Modified
+    updated_at = models.DateTimeField(auto_now=True)
+    blob = models.ForeignKey(
+        ImageBlob,
+        on_delete=models.SET_NULL,
+        related_name='+',
+        blank=True,
+        null=True
+    )
+
+    class Meta:
+        indexes = [
+            # Курсорная пагинация списка: ORDER BY created_at DESC, id DESC
+            models.Index(fields=['-created_at', '-id'], name='sharedimage_created_id_idx'),
+            # Изображения владельца, новые сначала
+            models.Index(fields=['owner', '-created_at'], name='sharedimage_owner_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not (self.is_field_dirty('image') and is_new_upload(self.image)):
+            super().save(*args, **kwargs)
+            return
+
+        # Исходник сохраняется "как есть", а уменьшение и перекодирование
+        # выполняет фоновый воркер. Изображение, которое уже загружали,
+        # повторно не обрабатываем: запись ссылается на готовый файл
+        with transaction.atomic():
+            old_blob_id = self.blob_id
+            old_files = (
+                self.get_loaded_value('image'),
+                self.get_loaded_value('image_renditions'),
+                self.get_loaded_value('image_formats'),
+            )
+            source_sha256 = get_file_sha256(self.image.file)
+            self.image_renditions = {}
+            self.image_formats = []
+            self.blob = ImageBlob.objects.acquire(ImageKind.SHARED_IMAGE, source_sha256)
+            if self.blob is not None:
+                self.image = self.blob.name
+                self.image_renditions = self.blob.renditions
+                self.image_formats = self.blob.formats
+                self.image_status = ProcessingStatus.READY
+            else:
+                self.image_status = ProcessingStatus.PENDING
+
+            super().save(*args, **kwargs)
+
+            ImageBlob.objects.release(old_blob_id)
+            if old_blob_id is None and old_files[0] != self.image.name:
+                delete_files_on_commit(ImageKind.SHARED_IMAGE, *old_files)
+            if self.image_status == ProcessingStatus.PENDING:
+                ImageTask.objects.enqueue(
+                    ImageKind.SHARED_IMAGE, self.pk, self.image.name, source_sha256
+                )
+
+    def __str__(self):
+        # Без запросов к БД: строка выводится для каждой записи (админка, логи).
+        # Владелец - по имени, если он уже загружен (select_related)
+        owner = self.owner.username if SharedImage.owner.is_cached(self) else f'#{self.owner_id}'
+        return f'Image {self.pk} by {owner}'
+
+
+class SharedImageRecipient(models.Model):
+    """
+    Промежуточная таблица "изображение - получатель".
+    Явная модель нужна ради индекса (user, sharedimage): поиск изображений,
+    которыми поделились с пользователем, идет по нему без сканирования таблицы.
+    """
+    sharedimage = models.ForeignKey(SharedImage, on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+
+    class Meta:
+        # Таблица создана Django для автоматической M2M-связи, сохраняем ее
+        db_table = 'avatars_sharedimage_shared_with'
+        unique_together = [('sharedimage', 'user')]
+        indexes = [
+            models.Index(fields=['user', 'sharedimage'], name='recipient_user_image_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.sharedimage_id} -> {self.user_id}'
+
+
+class ImageTaskManager(models.Manager):
+    def enqueue(self, kind, object_id, source_name, source_sha256=''):
+        """
+        Ставит задачу на обработку файла в очередь.
+        Незавершенные задачи для того же объекта отменяются: обрабатывать
+        имеет смысл только последнюю загрузку.
+        """
+        self.filter(
+            kind=kind,
+            object_id=object_id,
+            status=ImageTask.Status.PENDING
+        ).update(status=ImageTask.Status.CANCELLED, updated_at=timezone.now())
+        return self.create(
+            kind=kind,
+            object_id=object_id,
+            source_name=source_name,
+            source_sha256=source_sha256,
+            max_attempts=settings.IMAGE_TASKS_MAX_ATTEMPTS
+        )
+
+
+class ImageTask(models.Model):
+    """
+    Задача очереди фоновой обработки изображений.
+    Очередь хранится в БД и разбирается командой process_image_tasks.
+    """
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'В очереди'
+        RUNNING = 'running', 'Выполняется'
+        DONE = 'done', 'Выполнена'
+        FAILED = 'failed', 'Ошибка'
+        CANCELLED = 'cancelled', 'Отменена'
+
+    kind = models.CharField(max_length=32, choices=ImageKind.choices)
+    object_id = models.BigIntegerField()
+    # Имя исходного (необработанного) файла в хранилище на момент постановки
+    source_name = models.CharField(max_length=255)
+    # Хэш исходника для дедупликации результата (см. ImageBlob)
+    source_sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(
+        max_length=16,
+        choices=Status.choices,
+        default=Status.PENDING
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ImageTaskManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after']),
+            models.Index(fields=['kind', 'object_id']),
+        ]
 
     def __str__(self):
-        return f"Image by {self.owner.username} shared with {self.shared_with.count()} user(s)"
\ No newline at end of file
+        return f'{self.get_kind_display()} #{self.object_id} ({self.status})'
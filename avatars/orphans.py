@@ -0,0 +1,129 @@
+"""
+Удаление "осиротевших" файлов: объектов в хранилище, на которые не ссылается
+ни одна запись.
+
+Новые замены и удаления убирают файлы сами (ImageBlobManager.release и
+models.delete_files_on_commit), а сборка нужна для файлов, накопленных
+раньше, и для файлов после сбоев (воркер упал между загрузкой и записью в БД).
+
+Список файлов читается постранично (в S3 - ListObjectsV2 по 1000 ключей) и
+не собирается в памяти. Для каждой страницы из БД частями загружаются только
+записи, которые могут ссылаться на файлы страницы: копии и варианты в других
+форматах называются по основному файлу (см. get_rendition_path,
+get_variant_path), поэтому по имени файла известно имя основного. Файл
+считается используемым, если он входит в набор файлов (get_image_files)
+записи, ImageBlob или незавершенной задачи обработки. Файлы моложе `grace`
+не трогаются: исходник мог быть загружен до фиксации транзакции
+(store_upload), а результат обработки - до обновления записи.
+"""
+import logging
+import os
+import re
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .formats import BASE_FORMAT, FORMAT_EXTENSIONS
+from .models import ImageBlob, ImageKind, ImageTask, get_image_field, get_image_files
+from .storage import delete_many, iter_file_pages
+
+logger = logging.getLogger(__name__)
+
+# Каталог файлов каждого вида (см. get_avatar_upload_path, get_shared_image_upload_path)
+PREFIXES = {
+    ImageKind.AVATAR: 'avatars/',
+    ImageKind.SHARED_IMAGE: 'shared/',
+}
+
+# Суффикс размера уменьшенной копии: f7b4..._64.jpg
+RENDITION_SUFFIX = re.compile(r'_\d+$')
+
+
+def get_main_candidates(name):
+    """
+    Возможные имена основного файла для файла из хранилища: сам файл
+    (основной или исходник) и основной JPEG, копией или вариантом в другом
+    формате которого он может быть.
+    """
+    root = os.path.splitext(name)[0]
+    return {name, RENDITION_SUFFIX.sub('', root) + FORMAT_EXTENSIONS[BASE_FORMAT]}
+
+
+class OrphanCollector:
+    """
+    Находит и удаляет файлы изображений без ссылок (см. описание модуля).
+
+    :param grace: Файлы, измененные позже чем `grace` назад, не удаляются.
+    :param page_size: Сколько файлов хранилища проверять за раз.
+    :param chunk_size: Сколько имен передавать в одном запросе к БД.
+    """
+
+    def __init__(self, grace=timedelta(hours=24), page_size=1000, chunk_size=500,
+                 dry_run=False, report=None):
+        self.grace = grace
+        self.page_size = page_size
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.report = report or (lambda kind, stats: None)
+
+    def run(self, kinds):
+        """Проверяет файлы указанных видов и возвращает статистику по каждому."""
+        return {kind: self.collect(kind) for kind in kinds}
+
+    def collect(self, kind):
+        """
+        :return: Статистика: listed (файлов в хранилище), recent (моложе grace),
+                 referenced, orphaned и bytes (их размер), deleted, failed и elapsed.
+        """
+        stats = {
+            'listed': 0, 'recent': 0, 'referenced': 0, 'orphaned': 0, 'bytes': 0,
+            'deleted': 0, 'failed': 0, 'started': time.monotonic(),
+        }
+        storage = get_image_field(kind).storage
+        cutoff = timezone.now() - self.grace
+        for page in iter_file_pages(storage, PREFIXES[kind], self.page_size):
+            stats['listed'] += len(page)
+            candidates = {name: size for name, modified, size in page if modified < cutoff}
+            stats['recent'] += len(page) - len(candidates)
+
+            referenced = self.get_referenced(kind, candidates)
+            orphans = [name for name in candidates if name not in referenced]
+            stats['referenced'] += len(candidates) - len(orphans)
+            stats['orphaned'] += len(orphans)
+            stats['bytes'] += sum(candidates[name] for name in orphans)
+
+            if orphans and not self.dry_run:
+                failed = delete_many(storage, orphans)
+                if failed:
+                    logger.warning('Не удалось удалить %s файлов, например %s', len(failed), failed[0])
+                stats['failed'] += len(failed)
+                stats['deleted'] += len(orphans) - len(failed)
+            self.report(kind, stats)
+        stats['elapsed'] = time.monotonic() - stats.pop('started')
+        return stats
+
+    def get_referenced(self, kind, names):
+        """Файлы из `names`, на которые ссылаются записи, ImageBlob или задачи обработки."""
+        field = get_image_field(kind)
+        main_names = sorted({main for name in names for main in get_main_candidates(name)})
+        referenced = set()
+        for start in range(0, len(main_names), self.chunk_size):
+            chunk = main_names[start:start + self.chunk_size]
+            rows = [
+                *field.model.objects.filter(**{f'{field.name}__in': chunk}).values_list(
+                    field.name, f'{field.name}_renditions', f'{field.name}_formats'
+                ),
+                *ImageBlob.objects.filter(kind=kind, name__in=chunk).values_list(
+                    'name', 'renditions', 'formats'
+                ),
+            ]
+            for name, renditions, formats in rows:
+                referenced.update(get_image_files(name, renditions, formats))
+            # Исходник, который еще обрабатывается
+            referenced.update(ImageTask.objects.filter(
+                kind=kind,
+                source_name__in=chunk,
+                status__in=[ImageTask.Status.PENDING, ImageTask.Status.RUNNING]
+            ).values_list('source_name', flat=True))
+        return referenced
@@ -0,0 +1,60 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination
+
+
+class ProfileCursorPagination(CursorPagination):
+    """
+    Курсорная (keyset) пагинация профилей по первичному ключу.
+    В отличие от OFFSET, стоимость страницы не растет с номером страницы.
+    """
+    ordering = 'id'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class SharedImageCursorPagination(CursorPagination):
+    """Курсорная пагинация изображений: сначала новые."""
+    ordering = ('-created_at', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор админки, который на PostgreSQL для неотфильтрованного списка
+    берет число строк из статистики планировщика (pg_class.reltuples) вместо
+    COUNT(*) по всей таблице. Для небольших таблиц, с фильтрами и на других
+    СУБД число строк считается как обычно.
+    """
+    # Ниже этого числа строк COUNT(*) дешевый, а точное число полезнее
+    estimate_threshold = 10_000
+
+    @cached_property
+    def count(self):
+        estimate = self.get_estimate()
+        if estimate is not None and estimate >= self.estimate_threshold:
+            return estimate
+        return super().count
+
+    def get_estimate(self):
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is None or query.where or query.distinct or query.low_mark or query.high_mark is not None:
+            return None
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        # -1 - таблицу еще не анализировали (PostgreSQL 14+)
+        if row is None or row[0] < 0:
+            return None
+        return int(row[0])
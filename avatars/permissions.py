@@ -1,5 +1,8 @@
 from rest_framework import permissions
 
+from . import metrics
+from .access import can_view_image, is_image_owner
+
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
     """
@@ -30,16 +33,24 @@ class CanViewOrOwnerCanModify(permissions.BasePermission):
         return request.user and request.user.is_authenticated
 
     def has_object_permission(self, request, view, obj):
-        # Проверяем, есть ли пользователь в списке получателей
-        is_recipient = request.user in obj.shared_with.all()
-
-        # Разрешаем GET-запросы владельцу ИЛИ получателю
+        # Разрешаем GET-запросы владельцу ИЛИ получателю.
+        # Получатель проверяется одним EXISTS, без загрузки списка shared_with
         if request.method in permissions.SAFE_METHODS:
-            return obj.owner == request.user or is_recipient
+            return can_view_image(request, obj)
 
         # Разрешаем DELETE-запросы только владельцу
         if request.method == 'DELETE':
-            return obj.owner == request.user
+            return is_image_owner(request.user, obj)
 
         # Запрещаем все остальные методы (PUT, PATCH)
         return False
+
+
+class HasMetricsToken(permissions.BasePermission):
+    """
+    Доступ к метрикам: заголовок Authorization: Bearer METRICS_TOKEN
+    (без токена в настройках - только при DEBUG).
+    """
+
+    def has_permission(self, request, view):
+        return metrics.is_authorized(request.headers.get('Authorization'))
@@ -0,0 +1,340 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .formats import BASE_FORMAT, get_output_formats
+from .models import (
+    ImageBlob,
+    ImageKind,
+    ProcessingStatus,
+    Profile,
+    SharedImage,
+    get_image_files,
+    get_outputs_hash,
+    get_rendition_path,
+    get_source_path,
+    get_upload_filename,
+)
+from .signals import rows_updated
+from .tasks import save_outputs
+from .utils import encode_image, prepare_image
+
+logger = logging.getLogger(__name__)
+
+# Вид изображения -> (модель, поле с файлом, обрезать ли до квадрата)
+TARGETS = {
+    ImageKind.AVATAR: (Profile, 'avatar', True),
+    ImageKind.SHARED_IMAGE: (SharedImage, 'image', False),
+}
+
+
+def render_image(data, sizes, max_size, square, formats):
+    """
+    Декодирует файл и кодирует основное изображение, копии и варианты
+    в других форматах. Выполняется в дочернем процессе, поэтому принимает
+    и возвращает только байты.
+
+    :return: Словарь {(размер или None для основного файла, формат): байты}
+             или None, если Pillow не смог открыть файл.
+    """
+    prepared = prepare_image(BytesIO(data), sizes, max_size, square=square)
+    if prepared is None:
+        return None
+    pil_img, renditions = prepared
+    images = {None: pil_img, **renditions}
+    return {
+        (size, image_format): encode_image(image, target_format=image_format).getvalue()
+        for size, image in images.items()
+        for image_format in (BASE_FORMAT, *formats)
+    }
+
+
+class RateLimiter:
+    """Ограничивает частоту вызовов wait() значением `rate` в секунду (0 - без ограничения)."""
+
+    def __init__(self, rate=0):
+        self.interval = 1 / rate if rate else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Checkpoint:
+    """
+    Последний обработанный ID для каждого вида изображений и ID записей,
+    которые не удалось обработать, в JSON-файле. Позволяет продолжить
+    прерванную перегенерацию с места остановки и повторить ошибочные записи.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.positions = {}
+        self.failed = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            self.positions = data['positions']
+            self.failed = data['failed']
+
+    def get(self, kind):
+        return self.positions.get(kind, 0)
+
+    def get_failed(self, kind):
+        return self.failed.get(kind, [])
+
+    def set(self, kind, last_pk, failed=()):
+        self.positions[kind] = last_pk
+        self.failed[kind] = sorted(failed)
+        if not self.path:
+            return
+        # Запись через временный файл: прерывание не оставит битый JSON
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'positions': self.positions, 'failed': self.failed}, f)
+        os.replace(tmp_path, self.path)
+
+
+class Reprocessor:
+    """
+    Перегенерирует уже обработанные изображения по текущим настройкам
+    (IMAGE_RENDITION_SIZES, IMAGE_MAX_DIMENSIONS, IMAGE_ENCODER_PRESETS,
+    IMAGE_EXTRA_FORMATS).
+
+    Исходником служит оригинал загрузки, сохраненный при обработке рядом с
+    основным файлом (get_source_path), а не сам сжатый основной файл.
+    Записи, обработанные до появления оригиналов, пропускаются и
+    учитываются в статистике как missing. Записи с ошибкой запоминаются
+    в контрольной точке и повторяются при следующем запуске.
+
+    Записи читаются потоком через iterator(chunk_size), файлы
+    скачиваются и загружаются в пуле потоков, а декодирование и кодирование
+    выполняется в пуле процессов. Файл ImageBlob обрабатывается один раз
+    для всех ссылающихся на него записей.
+
+    :param processes: Размер пула процессов; 0 - кодировать в текущем процессе.
+    :param io_threads: Размер пула потоков для хранилища; 0 - без потоков.
+    """
+
+    def __init__(self, processes=None, io_threads=8, chunk_size=500, batch_size=100,
+                 rate=0, checkpoint=None, dry_run=False, report=None):
+        self.processes = os.cpu_count() if processes is None else processes
+        self.io_threads = io_threads
+        self.chunk_size = chunk_size
+        self.batch_size = batch_size
+        self.rate_limiter = RateLimiter(rate)
+        self.checkpoint = checkpoint or Checkpoint()
+        self.dry_run = dry_run
+        self.report = report or (lambda kind, stats: None)
+        self.process_pool = None
+        self.io_pool = None
+
+    def run(self, kinds):
+        """Перегенерирует изображения указанных видов и возвращает статистику по каждому."""
+        if self.processes:
+            # spawn: fork многопоточного процесса (пул потоков ввода-вывода) небезопасен.
+            # В дочернем процессе нужны настройки Django (при spawn они не наследуются)
+            self.process_pool = ProcessPoolExecutor(
+                self.processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup
+            )
+        if self.io_threads:
+            self.io_pool = ThreadPoolExecutor(self.io_threads)
+        try:
+            return {kind: self.run_kind(kind) for kind in kinds}
+        finally:
+            if self.process_pool:
+                self.process_pool.shutdown()
+            if self.io_pool:
+                self.io_pool.shutdown()
+
+    def get_queryset(self, kind):
+        model, field_name, _ = TARGETS[kind]
+        return (
+            model.objects
+            .filter(Q(pk__gt=self.checkpoint.get(kind)) | Q(pk__in=self.checkpoint.get_failed(kind)))
+            .filter(**{f'{field_name}_status': ProcessingStatus.READY})
+            .exclude(**{field_name: ''})
+            .exclude(**{f'{field_name}__isnull': True})
+            .order_by('pk')
+            .values_list(
+                'pk', field_name, f'{field_name}_renditions', f'{field_name}_formats', 'blob_id'
+            )
+        )
+
+    def run_kind(self, kind):
+        stats = {'processed': 0, 'skipped': 0, 'missing': 0, 'failed': 0, 'started': time.monotonic()}
+        seen_blobs = set()
+        batch = []
+        for item in self.get_queryset(kind).iterator(chunk_size=self.chunk_size):
+            blob_id = item[4]
+            if blob_id is not None:
+                if blob_id in seen_blobs:
+                    stats['skipped'] += 1
+                    continue
+                seen_blobs.add(blob_id)
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.run_batch(kind, batch, stats)
+                batch = []
+        if batch:
+            self.run_batch(kind, batch, stats)
+        stats['elapsed'] = time.monotonic() - stats.pop('started')
+        return stats
+
+    def run_batch(self, kind, batch, stats):
+        if self.dry_run:
+            stats['processed'] += len(batch)
+        else:
+            if self.io_pool:
+                futures = [self.io_pool.submit(self._run_item_in_thread, kind, item) for item in batch]
+                results = [future.result() for future in futures]
+            else:
+                results = [self.run_item(kind, item) for item in batch]
+            failed = set(self.checkpoint.get_failed(kind))
+            for item, result in zip(batch, results):
+                stats[result] += 1
+                if result == 'failed':
+                    failed.add(item[0])
+                else:
+                    failed.discard(item[0])
+            # Партия завершена: следующий запуск начнет после нее и повторит ошибочные записи.
+            # В партии могут быть повторяемые записи с ID меньше контрольной точки
+            self.checkpoint.set(kind, max(batch[-1][0], self.checkpoint.get(kind)), failed)
+        self.report(kind, stats)
+
+    def _run_item_in_thread(self, kind, item):
+        try:
+            return self.run_item(kind, item)
+        finally:
+            # У каждого потока свое соединение с БД, закрываем его сами
+            connections.close_all()
+
+    def run_item(self, kind, item):
+        """
+        Перегенерирует одно изображение.
+
+        :return: Ключ статистики: processed, missing (нет оригинала) или failed.
+        """
+        self.rate_limiter.wait()
+        pk, name, renditions, formats_before, blob_id = item
+        model, field_name, square = TARGETS[kind]
+        storage = model._meta.get_field(field_name).storage
+        try:
+            source_name = get_source_path(name)
+            if not storage.exists(source_name):
+                logger.warning('Нет оригинала %s #%s (%s), пропускаем', kind, pk, name)
+                return 'missing'
+            with storage.open(source_name) as f:
+                data = f.read()
+            formats = get_output_formats()
+            args = (
+                data,
+                settings.IMAGE_RENDITION_SIZES[kind],
+                settings.IMAGE_MAX_DIMENSIONS[kind],
+                square,
+                formats,
+            )
+            if self.process_pool:
+                encoded = self.process_pool.submit(render_image, *args).result()
+            else:
+                encoded = render_image(*args)
+            if encoded is None:
+                logger.error('Не удалось открыть %s #%s (%s)', kind, pk, source_name)
+                return 'failed'
+
+            # Имя по хэшу содержимого в той же папке
+            content_hash = get_outputs_hash({
+                key: hashlib.sha256(content).hexdigest() for key, content in encoded.items()
+            })
+            new_name = os.path.join(
+                os.path.dirname(name), get_upload_filename('image.jpg', content_hash)
+            )
+            if new_name == name:
+                # Настройки не изменились: получились те же файлы
+                return 'processed'
+            written = save_outputs(
+                storage,
+                new_name,
+                {key: ContentFile(content) for key, content in encoded.items()},
+                ContentFile(data)
+            )
+            new_renditions = {
+                str(size): get_rendition_path(new_name, size)
+                for size, _ in encoded if size is not None
+            }
+
+            with transaction.atomic():
+                updated = self._swap(
+                    model, field_name, pk, name, blob_id, new_name, new_renditions, formats
+                )
+                if updated:
+                    old_files = get_image_files(name, renditions, formats_before)
+                    transaction.on_commit(
+                        lambda: _delete_unreferenced(storage, kind, name, old_files)
+                    )
+            if not updated:
+                # Файл заменили, пока шла перегенерация
+                _delete_files(storage, written)
+            return 'processed'
+        except Exception:
+            logger.exception('Ошибка перегенерации %s #%s', kind, pk)
+            return 'failed'
+
+    def _swap(self, model, field_name, pk, name, blob_id, new_name, renditions, formats):
+        values = {
+            field_name: new_name,
+            f'{field_name}_renditions': renditions,
+            f'{field_name}_formats': formats,
+            'updated_at': timezone.now(),
+        }
+        if blob_id is None:
+            # Условное обновление защищает от гонки с новой загрузкой файла
+            updated = model.objects.filter(pk=pk, **{field_name: name}).update(**values)
+            if updated:
+                rows_updated.send(sender=model, pks=[pk])
+            return updated
+
+        blob = ImageBlob.objects.select_for_update().filter(pk=blob_id, name=name).first()
+        if blob is None:
+            return 0
+        blob.name, blob.renditions, blob.formats = new_name, renditions, formats
+        blob.save(update_fields=['name', 'renditions', 'formats'])
+        rows = model.objects.filter(blob_id=blob_id)
+        pks = list(rows.values_list('pk', flat=True))
+        updated = rows.update(**values)
+        rows_updated.send(sender=model, pks=pks)
+        return updated
+
+
+def _delete_files(storage, names):
+    for name in names:
+        storage.delete(name)
+
+
+def _delete_unreferenced(storage, kind, name, files):
+    # Те же файлы могут принадлежать другому ImageBlob (см. ImageBlob.delete_files)
+    if not ImageBlob.objects.filter(kind=kind, name=name).exists():
+        _delete_files(storage, files)
@@ -1,7 +1,19 @@
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.db import models
+from django.utils import timezone
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.settings import api_settings
 
-from .models import Profile, SharedImage
+from .access import is_image_owner
+from .models import Profile, SharedImage, SharedImageRecipient
+from .storage import prefetch_urls
+from .validators import (
+    validate_image_file_extension,
+    validate_image_header,
+    validate_image_size,
+)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -11,15 +23,84 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email']
 
 
+class RenditionsField(serializers.ReadOnlyField):
+    """
+    Словарь {размер: URL} уменьшенных копий изображения.
+    `file_field` - поле модели, в хранилище которого лежат копии.
+    """
+
+    def __init__(self, file_field, **kwargs):
+        self.file_field = file_field
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        request = self.context.get('request')
+        storage = self.get_storage()
+        prefetch_urls(storage, value.values())
+        urls = {}
+        for size, name in value.items():
+            url = storage.url(name)
+            urls[size] = request.build_absolute_uri(url) if request else url
+        return urls
+
+    def get_storage(self):
+        return self.parent.Meta.model._meta.get_field(self.file_field).storage
+
+
+class PrefetchURLsListSerializer(serializers.ListSerializer):
+    """
+    Список объектов с файлами: ссылки на файлы и копии всей страницы
+    запрашиваются разом (для закрытого хранилища - одним обращением
+    к кэшу подписей), а не по одной на каждое поле.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        for field in self.child.fields.values():
+            if isinstance(field, RenditionsField):
+                names = []
+                for item in items:
+                    names.append(getattr(item, field.file_field).name)
+                    names.extend(field.get_attribute(item).values())
+                prefetch_urls(field.get_storage(), names)
+        return super().to_representation(items)
+
+
 class ProfileSerializer(serializers.ModelSerializer):
     """Сериализатор для модели Profile."""
     user = UserSerializer(read_only=True)
-    avatar = serializers.ImageField(required=False)
+    avatar = serializers.ImageField(
+        required=False,
+        validators=[validate_image_file_extension, validate_image_size, validate_image_header]
+    )
+    avatar_renditions = RenditionsField('avatar')
 
     class Meta:
         model = Profile
-        fields = ['id', 'user', 'name', 'avatar']
-        read_only_fields = ['user']
+        fields = [
+            'id',
+            'user',
+            'name',
+            'avatar',
+            'avatar_status',
+            'avatar_renditions',
+            'avatar_formats'
+        ]
+        read_only_fields = ['user', 'avatar_status', 'avatar_formats']
+
+
+class ProfileListSerializer(ProfileSerializer):
+    """
+    Облегченное представление профиля для списка: вместо вложенного
+    пользователя отдается его ID. Полный объект - по параметру ?expand=user.
+    """
+    user = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if 'user' in self.context.get('expand', ()):
+            fields['user'] = UserSerializer(read_only=True)
+        return fields
 
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -39,14 +120,61 @@ class UserCreateSerializer(serializers.ModelSerializer):
         return user
 
 
+class BulkPrimaryKeyRelatedField(serializers.ManyRelatedField):
+    """
+    Список ID объектов, проверяемый одним запросом IN вместо отдельного
+    SELECT на каждый ID (как делает PrimaryKeyRelatedField(many=True)).
+    Объекты загружаются без полей, кроме первичного ключа.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        pks = []
+        for item in data:
+            try:
+                if isinstance(item, bool):
+                    raise TypeError
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                self.child_relation.fail('incorrect_type', data_type=type(item).__name__)
+        # Повторы убираем, сохраняя порядок
+        pks = list(dict.fromkeys(pks))
+
+        objects = self.child_relation.get_queryset().only('pk').in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                self.child_relation.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
+
+
+class SharedWithField(BulkPrimaryKeyRelatedField):
+    """
+    Список ID получателей. Раскрывается только владельцу изображения:
+    получателю не нужно загружать (возможно, многотысячный) список остальных.
+    """
+
+    def get_attribute(self, instance):
+        request = self.context.get('request')
+        if request is not None and not is_image_owner(request.user, instance):
+            raise SkipField()
+        if 'shared_with' in getattr(instance, '_prefetched_objects_cache', {}):
+            return super().get_attribute(instance)
+        # Для вывода нужны только ID
+        return instance.shared_with.only('id')
+
+
 class SharedImageSerializer(serializers.ModelSerializer):
     owner = UserSerializer(read_only=True)
     # Используем PrimaryKeyRelatedField для получения списка ID пользователей при создании/обновлении
-    shared_with = serializers.PrimaryKeyRelatedField(
-        many=True,
-        queryset=User.objects.all(),
+    shared_with = SharedWithField(
+        child_relation=serializers.PrimaryKeyRelatedField(queryset=User.objects.all()),
         required=False  # Делаем поле необязательным
     )
+    image_renditions = RenditionsField('image')
 
     class Meta:
         model = SharedImage
@@ -54,13 +182,113 @@ class SharedImageSerializer(serializers.ModelSerializer):
             'id',
             'owner',
             'image',
+            'image_status',
+            'image_renditions',
+            'image_formats',
             'caption',
             'shared_with',
             'created_at'
         ]
-        read_only_fields = ['owner', 'created_at']
+        read_only_fields = ['owner', 'image_status', 'image_formats', 'created_at']
+        list_serializer_class = PrefetchURLsListSerializer
 
     def create(self, validated_data):
         # Устанавливаем текущего пользователя как владельца изображения
         validated_data['owner'] = self.context['request'].user
         return super().create(validated_data)
+
+
+class SharedImageListSerializer(SharedImageSerializer):
+    """
+    Облегченное представление изображения для списка: владелец отдается
+    по ID, список получателей не загружается. Вложенные объекты -
+    по параметру ?expand=owner,shared_with.
+    """
+    owner = serializers.PrimaryKeyRelatedField(read_only=True)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        expand = self.context.get('expand', ())
+        if 'owner' in expand:
+            fields['owner'] = UserSerializer(read_only=True)
+        if 'shared_with' not in expand:
+            fields.pop('shared_with')
+        return fields
+
+
+class BulkShareSerializer(serializers.Serializer):
+    """
+    Массовое предоставление или отзыв доступа: все изображения из `images`
+    для всех пользователей из `users`. Каждый список проверяется одним
+    запросом, строки промежуточной таблицы пишутся пачкой.
+    """
+    images = BulkPrimaryKeyRelatedField(
+        child_relation=serializers.PrimaryKeyRelatedField(queryset=SharedImage.objects.all()),
+        allow_empty=False
+    )
+    users = BulkPrimaryKeyRelatedField(
+        child_relation=serializers.PrimaryKeyRelatedField(queryset=User.objects.all()),
+        allow_empty=False
+    )
+
+    def get_fields(self):
+        fields = super().get_fields()
+        # Управлять доступом можно только к своим изображениям: чужие ID не найдутся
+        fields['images'].child_relation.queryset = SharedImage.objects.filter(
+            owner=self.context['request'].user
+        )
+        return fields
+
+    def to_internal_value(self, data):
+        # Лимит проверяем до запросов к БД
+        images = self.fields['images'].get_value(data)
+        users = self.fields['users'].get_value(data)
+        if isinstance(images, (list, tuple)) and isinstance(users, (list, tuple)):
+            pairs = len(images) * len(users)
+            if pairs > settings.SHARED_IMAGE_BULK_MAX_PAIRS:
+                raise serializers.ValidationError({
+                    api_settings.NON_FIELD_ERRORS_KEY: [
+                        f'Слишком много пар "изображение - получатель": {pairs}, '
+                        f'допустимо не больше {settings.SHARED_IMAGE_BULK_MAX_PAIRS}.'
+                    ]
+                })
+        return super().to_internal_value(data)
+
+    def share(self):
+        """
+        Открывает доступ; уже существующие пары пропускаются. Возвращает
+        число новых пар.
+        """
+        images = [image.pk for image in self.validated_data['images']]
+        users = [user.pk for user in self.validated_data['users']]
+        existing = set(SharedImageRecipient.objects.filter(
+            sharedimage__in=images, user__in=users
+        ).values_list('sharedimage_id', 'user_id'))
+        recipients = [
+            SharedImageRecipient(sharedimage_id=image, user_id=user)
+            for image in images
+            for user in users
+            if (image, user) not in existing
+        ]
+        SharedImageRecipient.objects.bulk_create(
+            recipients,
+            batch_size=settings.SHARED_IMAGE_BULK_BATCH_SIZE,
+            ignore_conflicts=True
+        )
+        self._touch_images()
+        return len(recipients)
+
+    def unshare(self):
+        """Отзывает доступ одним DELETE и возвращает число удаленных пар."""
+        deleted, _ = SharedImageRecipient.objects.filter(
+            sharedimage__in=[image.pk for image in self.validated_data['images']],
+            user__in=[user.pk for user in self.validated_data['users']]
+        ).delete()
+        self._touch_images()
+        return deleted
+
+    def _touch_images(self):
+        # Список получателей входит в представление изображения (Last-Modified)
+        SharedImage.objects.filter(
+            pk__in=[image.pk for image in self.validated_data['images']]
+        ).update(updated_at=timezone.now())
@@ -1,8 +1,25 @@
+from functools import partial
+
 from django.conf import settings
-from django.db.models.signals import post_save
-from django.dispatch import receiver
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from . import authentication, cache
+from .models import (
+    ImageBlob,
+    ImageKind,
+    ImageTask,
+    Profile,
+    SharedImage,
+    delete_files_on_commit,
+    get_image_field,
+)
 
-from .models import Profile
+# Отправляется после изменения записей через QuerySet.update(), которое
+# не вызывает post_save. Аргументы: sender - модель, pks - список ID
+rows_updated = Signal()
 
 
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
@@ -13,3 +30,73 @@ def create_profile_for_new_user(sender, instance, created, **kwargs):
     """
     if created:
         Profile.objects.create(user=instance)
+
+
+@receiver(post_save, sender=ImageTask)
+def run_image_task_eagerly(sender, instance, created, **kwargs):
+    """
+    В режиме IMAGE_TASKS_EAGER задача выполняется сразу в текущем процессе,
+    без отдельного воркера (используется в тестах и при локальной отладке).
+    """
+    if created and settings.IMAGE_TASKS_EAGER:
+        from .tasks import run_task
+
+        instance.status = ImageTask.Status.RUNNING
+        instance.attempts += 1
+        run_task(instance)
+
+
+@receiver(post_delete, sender=Profile)
+@receiver(post_delete, sender=SharedImage)
+def release_image_blob(sender, instance, **kwargs):
+    """
+    При удалении записи освобождает ссылку на общий файл.
+    Файл удаляется из хранилища, когда ссылок на него не остается.
+    Файлы без общего ImageBlob удаляются после фиксации транзакции.
+    """
+    if instance.blob_id is not None:
+        ImageBlob.objects.release(instance.blob_id)
+        return
+    kind = ImageKind.AVATAR if sender is Profile else ImageKind.SHARED_IMAGE
+    field = get_image_field(kind)
+    file = getattr(instance, field.attname)
+    delete_files_on_commit(
+        kind,
+        file.name if file else None,
+        getattr(instance, f'{field.name}_renditions'),
+        getattr(instance, f'{field.name}_formats')
+    )
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile_cache(sender, instance, **kwargs):
+    cache.invalidate_profiles([instance.pk])
+
+
+@receiver(rows_updated, sender=Profile)
+def invalidate_updated_profiles(sender, pks, **kwargs):
+    cache.invalidate_profiles(pks)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_user_profile_cache(sender, instance, created, update_fields=None, **kwargs):
+    """Данные пользователя (username, email) входят в представление профиля."""
+    if created or (update_fields is not None and not {'username', 'email'} & set(update_fields)):
+        return
+    profiles = Profile.objects.filter(user_id=instance.pk)
+    pks = list(profiles.values_list('pk', flat=True))
+    # Для заголовка Last-Modified профиль тоже считается измененным
+    profiles.update(updated_at=timezone.now())
+    cache.invalidate_profiles(pks)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Смена пароля, деактивация или другие изменения пользователя видны в
+    следующем запросе. Запись удаляется после фиксации транзакции: иначе
+    параллельный запрос успел бы снова закэшировать старые данные.
+    """
+    transaction.on_commit(partial(authentication.invalidate_user, instance.pk), robust=True)
@@ -0,0 +1,83 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class SignedURLCache:
+    """
+    Кэш подписанных ссылок на закрытые файлы: в памяти процесса (LRU)
+    и в общем кэше Django (Redis), чтобы все процессы выдавали одну ссылку.
+
+    Время делится на окна длиной SIGNED_URL_CACHE_WINDOW секунд. Ссылка
+    подписывается один раз на окно и действует до конца окна плюс
+    `expire` секунд, поэтому у выданной ссылки всегда остается не меньше
+    `expire` секунд. Ссылка не меняется в пределах окна, и браузер
+    берет файл из своего кэша.
+    """
+
+    def __init__(self, namespace, max_size=None):
+        self.namespace = namespace
+        self.max_size = max_size or settings.SIGNED_URL_LOCAL_CACHE_SIZE
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'local_hits': 0, 'shared_hits': 0, 'signed': 0}
+
+    def get_window(self, now=None):
+        """Номер текущего окна и число секунд до его конца."""
+        now = time.time() if now is None else now
+        length = settings.SIGNED_URL_CACHE_WINDOW
+        window = int(now // length)
+        return window, (window + 1) * length - now
+
+    def make_key(self, window, name):
+        name_hash = hashlib.sha1(name.encode()).hexdigest()
+        return f'signed-url:{self.namespace}:{window}:{name_hash}'
+
+    def get_many(self, names, sign, expire):
+        """
+        Ссылки на файлы `names`: из памяти процесса, затем одним запросом
+        из общего кэша, недостающие подписываются через sign(name, expire).
+
+        :return: Словарь {имя: ссылка}.
+        """
+        window, remaining = self.get_window()
+        keys = {name: self.make_key(window, name) for name in set(names)}
+        urls = {}
+        with self.lock:
+            for name, key in keys.items():
+                url = self.local.get(key)
+                if url is not None:
+                    self.local.move_to_end(key)
+                    urls[name] = url
+            self.stats['local_hits'] += len(urls)
+
+        missing = {key: name for name, key in keys.items() if name not in urls}
+        if not missing:
+            return urls
+        shared = caches[settings.SIGNED_URL_CACHE_ALIAS]
+        found = shared.get_many(missing)
+        signed = {}
+        for key, name in missing.items():
+            if key in found:
+                urls[name] = found[key]
+            else:
+                urls[name] = signed[key] = sign(name, int(remaining) + 1 + expire)
+        if signed:
+            shared.set_many(signed, timeout=int(remaining) + 1)
+
+        with self.lock:
+            self.stats['shared_hits'] += len(found)
+            self.stats['signed'] += len(signed)
+            for key, name in missing.items():
+                self.local[key] = urls[name]
+            while len(self.local) > self.max_size:
+                self.local.popitem(last=False)
+        return urls
+
+    def clear(self):
+        with self.lock:
+            self.local.clear()
@@ -0,0 +1,353 @@
+import hashlib
+import io
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage, storages
+from storages.backends.s3boto3 import S3Boto3Storage
+from storages.utils import clean_name
+
+from . import metrics
+from .signing import SignedURLCache
+
+# Минимальный размер части multipart-загрузки в S3 (кроме последней)
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+# Максимум ключей в одном запросе DeleteObjects
+S3_MAX_DELETE_KEYS = 1000
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    Файлоподобный объект для записи прямо в S3 через multipart upload.
+
+    Данные копятся в буфере размером с одну часть и отправляются по мере
+    заполнения, поэтому память на запись ограничена `part_size` независимо
+    от размера файла. По умолчанию это IMAGE_UPLOAD_PART_SIZE, но не меньше
+    S3_MIN_PART_SIZE. Если весь файл поместился в одну часть, он
+    отправляется одним PutObject без накладных расходов multipart.
+    """
+
+    def __init__(self, client, bucket, key, extra_args=None, part_size=None):
+        super().__init__()
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.extra_args = extra_args or {}
+        # S3 не принимает части меньше S3_MIN_PART_SIZE (кроме последней)
+        self.part_size = part_size or max(settings.IMAGE_UPLOAD_PART_SIZE, S3_MIN_PART_SIZE)
+        self.upload_id = None
+        self.parts = []
+        self.buffer = bytearray()
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer.extend(data)
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            response = self.client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.extra_args
+            )
+            self.upload_id = response['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=body
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self):
+        """Отправляет остаток буфера и завершает загрузку."""
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.client.put_object(
+                    Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), **self.extra_args
+                )
+            else:
+                if self.buffer:
+                    self._upload_part(bytes(self.buffer))
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket,
+                    Key=self.key,
+                    UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.parts}
+                )
+        finally:
+            self.buffer = bytearray()
+            super().close()
+
+    def abort(self):
+        """Отменяет загрузку: S3 удаляет уже принятые части."""
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+        self.buffer = bytearray()
+        super().close()
+
+
+class MetricsStorageMixin:
+    """
+    Замеряет операции хранилища (avatars.metrics.STORAGE_SECONDS), в том числе
+    сохранение загрузки, которое Django выполняет при save() модели.
+    """
+
+    def _open(self, name, mode='rb'):
+        with metrics.storage_operation('open'):
+            file = super()._open(name, mode)
+            if 'r' in mode:
+                self.preload(file)
+        return file
+
+    def preload(self, file):
+        """Получает содержимое файла, если хранилище откладывает это до первого чтения."""
+
+    def _save(self, name, content):
+        with metrics.storage_operation('save'):
+            return super()._save(name, content)
+
+    def delete(self, name):
+        with metrics.storage_operation('delete'):
+            return super().delete(name)
+
+    def exists(self, name):
+        with metrics.storage_operation('exists'):
+            return super().exists(name)
+
+
+class LocalStorage(MetricsStorageMixin, FileSystemStorage):
+    """Файлы на локальном диске (разработка без S3) с замером операций."""
+
+
+class S3Storage(MetricsStorageMixin, S3Boto3Storage):
+    """Хранилище S3 с замером операций."""
+
+    def preload(self, file):
+        # S3 отдает объект при первом чтении: скачиваем его сразу, чтобы
+        # время загрузки из S3 попало в метрику open, а не в этап decode
+        file.file  # noqa: B018
+
+
+class PrivateS3Storage(S3Storage):
+    """
+    Хранилище закрытых файлов: объекты загружаются с ACL private и доступны
+    только по подписанным ссылкам. Подписи кэшируются (см. SignedURLCache),
+    поэтому страница списка не подписывает каждую ссылку заново.
+    """
+    default_acl = 'private'
+    querystring_auth = True
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.signed_urls = SignedURLCache(f'{self.bucket_name}/{self.location}')
+
+    def url(self, name, parameters=None, expire=None, http_method=None):
+        if parameters or expire is not None or http_method:
+            # Нестандартные ссылки (другой метод, свои параметры) не кэшируются
+            return super().url(name, parameters, expire, http_method)
+        return self.url_many([name])[name]
+
+    def url_many(self, names):
+        """Подписанные ссылки на несколько файлов: {имя: ссылка}."""
+        return self.signed_urls.get_many(names, self._sign, self.querystring_expire)
+
+    def _sign(self, name, expire):
+        return super().url(name, expire=expire)
+
+
+def get_shared_image_storage():
+    """
+    Хранилище общих изображений: закрытое (STORAGES['private']), если оно
+    настроено, иначе хранилище по умолчанию.
+    """
+    if 'private' in settings.STORAGES:
+        return storages['private']
+    return default_storage
+
+
+def prefetch_urls(storage, names):
+    """
+    Заранее получает ссылки на файлы одним обращением к кэшу подписей,
+    чтобы последующие storage.url() брали их из памяти процесса.
+    Для хранилищ без подписанных ссылок ничего не делает.
+    """
+    if isinstance(storage, PrivateS3Storage):
+        storage.url_many([name for name in names if name])
+
+
+def save_file(storage, name, fp):
+    """
+    Сохраняет содержимое файлового объекта `fp`; в S3 - частями через
+    multipart upload (S3MultipartWriter), не держа файл целиком в памяти.
+    Результат кодировщика сначала пишется во временный файл (spool_output):
+    имя строится по хэшу содержимого.
+
+    :return: Имя сохраненного файла в хранилище.
+    """
+    if not isinstance(storage, S3Boto3Storage):
+        return storage.save(name, File(fp, name=name))
+
+    name = storage.get_available_name(name)
+    with metrics.storage_operation('save'):
+        writer = _open_s3_writer(storage, name)
+        try:
+            shutil.copyfileobj(fp, writer, writer.part_size)
+            # Ошибка при завершении тоже отменяет загрузку: иначе принятые
+            # части остались бы в S3 незавершенной загрузкой
+            writer.close()
+        except BaseException:
+            writer.abort()
+            raise
+    return clean_name(name)
+
+
+def iter_file_pages(storage, prefix, page_size=1000):
+    """
+    Перечисляет файлы хранилища с префиксом `prefix` постранично, не собирая
+    весь список в памяти. В S3 страница - один запрос ListObjectsV2
+    (не больше `page_size` ключей), в остальных хранилищах - обход каталогов.
+
+    :return: Итератор страниц: списков кортежей (имя, время изменения, размер).
+    """
+    if isinstance(storage, S3Boto3Storage):
+        yield from _iter_s3_pages(storage, prefix, page_size)
+        return
+    page = []
+    for name in _walk(storage, prefix.rstrip('/')):
+        page.append((name, storage.get_modified_time(name), storage.size(name)))
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def _iter_s3_pages(storage, prefix, page_size):
+    client = storage.bucket.meta.client
+    root = f'{storage.location}/' if storage.location else ''
+    params = {
+        'Bucket': storage.bucket.name,
+        'Prefix': storage._normalize_name(clean_name(prefix)),
+        'MaxKeys': page_size,
+    }
+    while True:
+        with metrics.storage_operation('list'):
+            response = client.list_objects_v2(**params)
+        page = [
+            (item['Key'][len(root):], item['LastModified'], item['Size'])
+            for item in response.get('Contents', [])
+        ]
+        if page:
+            yield page
+        if not response.get('IsTruncated'):
+            return
+        params['ContinuationToken'] = response['NextContinuationToken']
+
+
+def _walk(storage, path):
+    if not storage.exists(path):
+        return
+    directories, files = storage.listdir(path)
+    for name in sorted(files):
+        yield f'{path}/{name}'
+    for directory in sorted(directories):
+        yield from _walk(storage, f'{path}/{directory}')
+
+
+def delete_many(storage, names):
+    """
+    Удаляет несколько файлов; в S3 - одним запросом DeleteObjects на каждые
+    S3_MAX_DELETE_KEYS ключей вместо запроса на каждый файл.
+
+    :return: Имена файлов, которые S3 удалить не смог.
+    """
+    if not isinstance(storage, S3Boto3Storage):
+        for name in names:
+            storage.delete(name)
+        return []
+
+    client = storage.bucket.meta.client
+    failed = []
+    for start in range(0, len(names), S3_MAX_DELETE_KEYS):
+        keys = {
+            storage._normalize_name(clean_name(name)): name
+            for name in names[start:start + S3_MAX_DELETE_KEYS]
+        }
+        with metrics.storage_operation('delete_many'):
+            response = client.delete_objects(
+                Bucket=storage.bucket.name,
+                Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+            )
+        failed.extend(keys[error['Key']] for error in response.get('Errors', []))
+    return failed
+
+
+def make_private(storage, names):
+    """
+    Закрывает уже загруженные объекты S3: ACL private для каждого файла
+    (PutObjectAcl принимает один ключ). Нужен для файлов, загруженных
+    до перехода на закрытое хранилище.
+
+    :return: Имена файлов, ACL которых изменить не удалось.
+    """
+    client = storage.bucket.meta.client
+    failed = []
+    for name in names:
+        try:
+            with metrics.storage_operation('put_acl'):
+                client.put_object_acl(
+                    Bucket=storage.bucket.name,
+                    Key=storage._normalize_name(clean_name(name)),
+                    ACL='private'
+                )
+        except Exception:
+            failed.append(name)
+    return failed
+
+
+@contextmanager
+def spool_output(write):
+    """
+    Пишет результат `write(fp)` во временный файл (в памяти до
+    IMAGE_STREAM_SPOOL_SIZE байт) и считает его SHA-256, чтобы имя файла
+    можно было построить по содержимому до загрузки в хранилище.
+
+    :return: Контекстный менеджер, возвращающий (файл, hex SHA-256).
+    """
+    with tempfile.SpooledTemporaryFile(max_size=settings.IMAGE_STREAM_SPOOL_SIZE) as spool:
+        write(spool)
+        spool.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: spool.read(64 * 1024), b''):
+            digest.update(chunk)
+        spool.seek(0)
+        yield spool, digest.hexdigest()
+
+
+def _open_s3_writer(storage, name):
+    key = storage._normalize_name(clean_name(name))
+    return S3MultipartWriter(
+        storage.bucket.meta.client,
+        storage.bucket.name,
+        key,
+        extra_args=storage._get_write_parameters(key)
+    )
@@ -0,0 +1,311 @@
+import logging
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import metrics
+from .formats import BASE_FORMAT, get_output_formats
+from .models import (
+    ImageBlob,
+    ImageKind,
+    ImageTask,
+    ProcessingStatus,
+    Profile,
+    SharedImage,
+    get_output_path,
+    get_outputs_hash,
+    get_rendition_path,
+    get_source_path,
+)
+from .signals import rows_updated
+from .storage import save_file, spool_output
+from .utils import prepare_avatar, prepare_shared_image, write_image
+
+logger = logging.getLogger(__name__)
+
+
+class ImageProcessingError(Exception):
+    """Файл не удалось обработать (повторная попытка не поможет)."""
+
+
+def _process_upload(task, queryset, field_name, prepare):
+    """
+    Обрабатывает загруженный файл поля `field_name` и подменяет исходник
+    обработанным. Основной файл и все уменьшенные копии строятся за одно
+    декодирование функцией `prepare`. Если пока задача ждала в очереди
+    файл заменили, результат отбрасывается.
+
+    Статус, копии и доступные форматы хранятся в полях `<field_name>_status`,
+    `<field_name>_renditions` и `<field_name>_formats`.
+    """
+    instance = queryset.get(pk=task.object_id)
+    if getattr(instance, field_name).name != task.source_name:
+        return
+
+    field = queryset.model._meta.get_field(field_name)
+    storage = field.storage
+    with ExitStack() as stack:
+        # Исходник открывается один раз: он же сохраняется рядом с результатом
+        # для перегенерации (см. get_source_path)
+        source = stack.enter_context(storage.open(task.source_name))
+        prepared = prepare(source)
+        if prepared is None:
+            raise ImageProcessingError('Pillow не смог открыть загруженный файл.')
+        pil_img, rendition_images = prepared
+        source.seek(0)
+
+        # Имя строится по хэшу содержимого всех файлов, поэтому сначала все
+        # кодируется во временные файлы (в памяти - не больше IMAGE_STREAM_SPOOL_SIZE каждый)
+        images = {None: pil_img, **rendition_images}
+        formats = get_output_formats()
+        files = {}
+        digests = {}
+        for size, image in images.items():
+            for image_format in (BASE_FORMAT, *formats):
+                files[size, image_format], digests[size, image_format] = stack.enter_context(
+                    spool_output(partial(write_image, image, target_format=image_format))
+                )
+        processed_name = field.upload_to(
+            instance, 'image.jpg', content_hash=get_outputs_hash(digests)
+        )
+        outputs = save_outputs(storage, processed_name, files, source)
+    renditions = {str(size): get_rendition_path(processed_name, size) for size in rendition_images}
+
+    blob = None
+    if task.source_sha256:
+        blob = ImageBlob.objects.register(
+            task.kind, task.source_sha256, processed_name, renditions, formats
+        )
+        if blob.name != processed_name:
+            # Тот же исходник параллельно обработал другой воркер
+            _delete_files(storage, outputs)
+            processed_name, renditions, formats = blob.name, blob.renditions, blob.formats
+
+    # Условное обновление защищает от гонки с новой загрузкой файла
+    updated = queryset.model.objects.filter(
+        pk=instance.pk,
+        **{field_name: task.source_name}
+    ).update(**{
+        field_name: processed_name,
+        f'{field_name}_renditions': renditions,
+        f'{field_name}_formats': formats,
+        f'{field_name}_status': ProcessingStatus.READY,
+        'blob': blob,
+        'updated_at': timezone.now(),
+    })
+
+    if updated:
+        rows_updated.send(sender=queryset.model, pks=[instance.pk])
+        storage.delete(task.source_name)
+    elif blob is not None:
+        ImageBlob.objects.release(blob.pk)
+    else:
+        _delete_files(storage, outputs)
+
+
+def save_outputs(storage, name, files, source=None):
+    """
+    Загружает файлы обработанного изображения ({(размер, формат): файл})
+    и файл исходника `source` под именами, производными от основного `name`.
+    Имена строятся по хэшу содержимого, поэтому уже существующий файл
+    повторно не загружается. Основной файл пишется последним: если он есть,
+    набор загружен целиком.
+
+    :return: Список загруженных файлов (их можно удалить при отмене).
+    """
+    written = []
+    # Исходник дописывается и к уже загруженному набору (например, сохраненному без него)
+    source_path = get_source_path(name)
+    if source is not None and not storage.exists(source_path):
+        written.append(save_file(storage, source_path, source))
+    if storage.exists(name):
+        return written
+    main_key = (None, BASE_FORMAT)
+    for key in sorted(files, key=lambda key: key == main_key):
+        path = get_output_path(name, *key)
+        if key == main_key or not storage.exists(path):
+            written.append(save_file(storage, path, files[key]))
+    return written
+
+
+def _delete_files(storage, names):
+    for name in names:
+        storage.delete(name)
+
+
+def _mark_failed(model, field_name, task):
+    updated = model.objects.filter(
+        pk=task.object_id,
+        **{field_name: task.source_name}
+    ).update(**{f'{field_name}_status': ProcessingStatus.FAILED, 'updated_at': timezone.now()})
+    if updated:
+        rows_updated.send(sender=model, pks=[task.object_id])
+
+
+def _process_avatar(task):
+    """Аватар: квадрат по центру и набор копий (IMAGE_RENDITION_SIZES['avatar'])."""
+    _process_upload(task, Profile.objects.select_related('user'), 'avatar', prepare_avatar)
+
+
+def _process_shared_image(task):
+    """
+    Общее изображение: без обрезки, длинная сторона ограничена, метаданные
+    (EXIF, ICC) при перекодировании отбрасываются.
+    """
+    _process_upload(
+        task, SharedImage.objects.select_related('owner'), 'image', prepare_shared_image
+    )
+
+
+# Обработчики задач: kind -> (обработка, действие при окончательной ошибке)
+HANDLERS = {
+    ImageKind.AVATAR: (_process_avatar, partial(_mark_failed, Profile, 'avatar')),
+    ImageKind.SHARED_IMAGE: (_process_shared_image, partial(_mark_failed, SharedImage, 'image')),
+}
+
+
+def release_expired_tasks():
+    """
+    Возвращает в очередь задачи, которые числятся выполняемыми дольше
+    IMAGE_TASKS_LEASE_TIMEOUT (воркер, забравший их, завершился аварийно).
+    Задачи с исчерпанными попытками помечаются ошибочными.
+    """
+    now = timezone.now()
+    expired = ImageTask.objects.filter(
+        status=ImageTask.Status.RUNNING,
+        updated_at__lt=now - timedelta(seconds=settings.IMAGE_TASKS_LEASE_TIMEOUT)
+    )
+    released = expired.filter(attempts__lt=F('max_attempts')).update(
+        status=ImageTask.Status.PENDING, run_after=now, updated_at=now
+    )
+    for task in expired.filter(attempts__gte=F('max_attempts')):
+        task.status = ImageTask.Status.FAILED
+        task.last_error = 'Истек срок выполнения задачи.'
+        task.save(update_fields=['status', 'last_error', 'updated_at'])
+        HANDLERS[task.kind][1](task)
+        logger.error('Задача %s не завершилась за отведенное время', task.pk)
+    if released:
+        logger.warning('Возвращено в очередь задач с истекшим сроком: %s', released)
+    return released
+
+
+def claim_tasks(limit):
+    """
+    Забирает из очереди до `limit` готовых к выполнению задач.
+    SKIP LOCKED позволяет нескольким воркерам разбирать очередь параллельно.
+    """
+    release_expired_tasks()
+    with transaction.atomic():
+        tasks = list(
+            ImageTask.objects.select_for_update(skip_locked=True)
+            .filter(status=ImageTask.Status.PENDING, run_after__lte=timezone.now())
+            .order_by('run_after', 'id')[:limit]
+        )
+        for task in tasks:
+            task.status = ImageTask.Status.RUNNING
+            task.attempts += 1
+            task.save(update_fields=['status', 'attempts', 'updated_at'])
+    return tasks
+
+
+def run_task(task):
+    """Выполняет одну задачу, при ошибке планирует повтор с экспоненциальной задержкой."""
+    process, on_failure = HANDLERS[task.kind]
+    started = time.perf_counter()
+    try:
+        with metrics.task_scope(f'task:{task.kind}'):
+            process(task)
+    except ObjectDoesNotExist:
+        # Объект удален, пока задача ждала в очереди
+        task.status = ImageTask.Status.CANCELLED
+    except Exception as exc:
+        task.last_error = ''.join(traceback.format_exception_only(type(exc), exc))
+        retryable = not isinstance(exc, ImageProcessingError)
+        if retryable and task.attempts < task.max_attempts:
+            delay = settings.IMAGE_TASKS_RETRY_DELAY * 2 ** (task.attempts - 1)
+            task.status = ImageTask.Status.PENDING
+            task.run_after = timezone.now() + timedelta(seconds=delay)
+            logger.warning('Задача %s завершилась ошибкой, повтор через %s с', task.pk, delay)
+        else:
+            task.status = ImageTask.Status.FAILED
+            on_failure(task)
+            logger.exception('Задача %s окончательно завершилась ошибкой', task.pk)
+    else:
+        task.status = ImageTask.Status.DONE
+    if settings.METRICS_ENABLED:
+        metrics.IMAGE_TASK_SECONDS.labels(kind=task.kind, status=task.status).observe(
+            time.perf_counter() - started
+        )
+    task.save(update_fields=['status', 'attempts', 'run_after', 'last_error', 'updated_at'])
+    return task
+
+
+class WorkerPool:
+    """
+    Локальный пул воркеров, разбирающий очередь ImageTask.
+    При concurrency=1 задачи выполняются в текущем потоке, что удобно в тестах.
+    """
+
+    def __init__(self, concurrency=None):
+        self.concurrency = concurrency or settings.IMAGE_TASKS_CONCURRENCY
+        self.stopping = threading.Event()
+
+    def _run_in_thread(self, task):
+        try:
+            return run_task(task)
+        finally:
+            # У каждого потока свое соединение с БД, закрываем его сами
+            connections.close_all()
+
+    def run_once(self):
+        """Выполняет одну партию задач и возвращает количество обработанных."""
+        tasks = claim_tasks(self.concurrency)
+        if self.concurrency == 1:
+            for task in tasks:
+                run_task(task)
+        elif tasks:
+            with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+                list(executor.map(self._run_in_thread, tasks))
+        return len(tasks)
+
+    def drain(self):
+        """Выполняет задачи, пока в очереди есть готовые, и возвращает их количество."""
+        total = 0
+        while True:
+            processed = self.run_once()
+            if not processed:
+                return total
+            total += processed
+
+    def stop(self, *args):
+        """Просит остановиться: текущая партия задач будет доведена до конца."""
+        self.stopping.set()
+
+    def run_forever(self, poll_interval=1.0):
+        """
+        Разбирает очередь до SIGTERM (или вызова stop). Сигнал не прерывает
+        задачи: уже взятая партия выполняется до конца, новые не забираются.
+        """
+        previous = signal.signal(signal.SIGTERM, self.stop)
+        try:
+            while not self.stopping.is_set():
+                if not self.run_once():
+                    self.stopping.wait(poll_interval)
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+
+def run_pending_tasks():
+    """Синхронно выполняет все готовые задачи в текущем процессе (для тестов)."""
+    return WorkerPool(concurrency=1).drain()
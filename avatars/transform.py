@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from io import BytesIO
+
+from django.conf import settings
+
+from .formats import BASE_FORMAT
+from .utils import encode_image, prepare_image
+
+
+def snap_size(size):
+    """
+    Ближайший разрешенный размер из IMAGE_SERVE_SIZES, не меньше запрошенного
+    (или наибольший). Набор размеров ограничен, чтобы произвольные ?size=
+    не размножали варианты в кэше.
+    """
+    allowed = sorted(settings.IMAGE_SERVE_SIZES)
+    for value in allowed:
+        if value >= size:
+            return value
+    return allowed[-1]
+
+
+def pick_source(name, renditions, size):
+    """
+    Наименьший из готовых файлов, которого хватает для размера `size`:
+    уменьшенная копия, если она не меньше нужной, иначе основной файл.
+    Декодировать маленькую копию быстрее, чем полноразмерный файл.
+    """
+    suitable = [int(key) for key in renditions if int(key) >= size]
+    if suitable:
+        return renditions[str(min(suitable))]
+    return name
+
+
+def get_transform_key(kind, name, size, image_format):
+    """
+    Ключ результата. Имя исходника строится по хэшу содержимого, поэтому
+    новый файл получает новый ключ и старые результаты не нужно удалять.
+    Параметры кодировщика входят в ключ: после их изменения результаты
+    строятся заново.
+    """
+    preset = json.dumps(settings.IMAGE_ENCODER_PRESETS.get(image_format, {}), sort_keys=True)
+    content = f'{kind}:{name}:{size}:{image_format}:{preset}'
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def transform_image(data, size, square=False, image_format=BASE_FORMAT):
+    """
+    Уменьшает изображение до `size` по длинной стороне (аватар - до квадрата)
+    и кодирует его в `image_format`.
+
+    :return: Байты результата или None, если Pillow не смог открыть файл.
+    """
+    prepared = prepare_image(BytesIO(data), (), size, square=square)
+    if prepared is None:
+        return None
+    pil_img, _ = prepared
+    return encode_image(pil_img, target_format=image_format).getvalue()
+
+
+class KeyedLock:
+    """
+    Блокировка по ключу: одновременные запросы одного и того же результата
+    ждут первого, а разные ключи не мешают друг другу. Блокировки удаляются,
+    когда их никто не держит.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.locks = {}
+
+    @contextmanager
+    def __call__(self, key):
+        with self.lock:
+            entry = self.locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self.lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self.locks[key]
+
+
+class DiskLRUCache:
+    """
+    Ограниченный по объему кэш файлов на локальном диске с вытеснением
+    давно не использованных (LRU).
+
+    Порядок использования хранится в памяти процесса и при запуске
+    восстанавливается по времени изменения файлов. Процессы с общим
+    каталогом видят файлы друг друга, но каждый вытесняет только известные
+    ему. Запись идет через временный файл, поэтому читатель не увидит
+    недописанный результат.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = None  # ключ -> размер в байтах, от давних к свежим
+        self.total = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for filename in files:
+                if filename.startswith('.'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, filename))
+                except FileNotFoundError:
+                    continue
+                found.append((stat.st_mtime, filename, stat.st_size))
+        found.sort()
+        self.entries = OrderedDict((key, size) for _, key, size in found)
+        self.total = sum(self.entries.values())
+
+    def get(self, key):
+        """Содержимое файла или None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            data = None
+        with self.lock:
+            self._load()
+            if data is None:
+                # Файл вытеснил другой процесс
+                self.total -= self.entries.pop(key, 0)
+                self.stats['misses'] += 1
+                return None
+            if key not in self.entries:
+                # Файл записал другой процесс
+                self.entries[key] = len(data)
+                self.total += len(data)
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+        # Время изменения - порядок использования после перезапуска
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return data
+
+    def set(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self._load()
+            self.total += len(data) - self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            evicted = []
+            while self.total > self.max_bytes and len(self.entries) > 1:
+                old_key, size = self.entries.popitem(last=False)
+                self.total -= size
+                evicted.append(old_key)
+            self.stats['evictions'] += len(evicted)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except FileNotFoundError:
+                pass
+
+    def get_stats(self):
+        with self.lock:
+            self._load()
+            return {
+                **self.stats,
+                'files': len(self.entries),
+                'bytes': self.total,
+                'max_bytes': self.max_bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+locks = KeyedLock()
+
+
+def get_transform_cache():
+    """Кэш результатов по настройкам IMAGE_SERVE_CACHE_DIR и IMAGE_SERVE_CACHE_MAX_BYTES."""
+    global _cache
+    directory = settings.IMAGE_SERVE_CACHE_DIR
+    max_bytes = settings.IMAGE_SERVE_CACHE_MAX_BYTES
+    with _cache_lock:
+        if _cache is None or (_cache.directory, _cache.max_bytes) != (directory, max_bytes):
+            _cache = DiskLRUCache(directory, max_bytes)
+        return _cache
+
+
+def get_or_transform(key, transform):
+    """
+    Результат из дискового кэша; при промахе строится через transform()
+    под блокировкой ключа, так что одинаковые одновременные запросы
+    выполняют преобразование один раз.
+
+    :return: Байты результата или None, если transform() вернул None.
+    """
+    cache = get_transform_cache()
+    with locks(key):
+        data = cache.get(key)
+        if data is None:
+            data = transform()
+            if data is not None:
+                cache.set(key, data)
+    return data
@@ -0,0 +1,72 @@
+import hashlib
+
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+from django.http.multipartparser import MultiPartParserError
+
+from .validators import MAX_FILE_SIZE_MB
+
+
+class FileSizeLimitUploadHandler(FileUploadHandler):
+    """
+    Прерывает прием файла, как только он превысил MAX_FILE_SIZE_MB.
+    Стоит первым в FILE_UPLOAD_HANDLERS: слишком большой файл не дочитывается
+    до конца и не занимает место во временном файле или в памяти.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.limit_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > self.limit_bytes:
+            raise MultiPartParserError(
+                f'Максимальный размер файла не должен превышать {MAX_FILE_SIZE_MB}МБ.'
+            )
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class HashingMemoryFileUploadHandler(MemoryFileUploadHandler):
+    """
+    Загрузка в память с подсчетом SHA-256 по мере приема данных.
+    Хэш доступен в атрибуте `sha256` загруженного файла.
+    """
+
+    def new_file(self, *args, **kwargs):
+        # Родительский new_file может прервать цепочку через StopFutureHandlers
+        self.digest = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.activated:
+            self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.digest.hexdigest()
+        return file
+
+
+class HashingTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Загрузка во временный файл с подсчетом SHA-256 по мере приема данных."""
+
+    def new_file(self, *args, **kwargs):
+        self.digest = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        file.sha256 = self.digest.hexdigest()
+        return file
@@ -1,7 +1,15 @@
-from django.urls import include, path
+from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
-from .views import ProfileViewSet, SharedImageViewSet
+from . import async_views
+from .views import (
+    ImageTransformStatsView,
+    ImageTransformView,
+    MetricsView,
+    ProfileViewSet,
+    SharedImageViewSet,
+    UserImportView,
+)
 
 router = DefaultRouter()
 router.register(r'profiles', ProfileViewSet, basename='profile')
@@ -9,4 +17,26 @@ router.register(r'shared_images', SharedImageViewSet, basename='sharedimage')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('users/import/', UserImportView.as_view(), name='user-import'),
+    path('images/cache-stats/', ImageTransformStatsView.as_view(), name='image-cache-stats'),
+    re_path(
+        r'^images/(?P<kind>avatar|shared_image)/(?P<pk>\d+)/$',
+        ImageTransformView.as_view(),
+        name='image-transform'
+    ),
+
+    # Асинхронные (ASGI) варианты загрузки и чтения
+    path('async/profiles/<int:pk>/', async_views.ProfileDetailView.as_view(), name='async-profile-detail'),
+    path('async/shared_images/', async_views.SharedImageCreateView.as_view(), name='async-sharedimage-create'),
+    path(
+        'async/shared_images/<int:pk>/',
+        async_views.SharedImageDetailView.as_view(),
+        name='async-sharedimage-detail'
+    ),
+    re_path(
+        r'^async/images/(?P<kind>avatar|shared_image)/(?P<pk>\d+)/$',
+        async_views.ImageTransformView.as_view(),
+        name='async-image-transform'
+    ),
 ]
@@ -0,0 +1,290 @@
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import User
+from django.core.exceptions import SuspiciousFileOperation, ValidationError
+from django.core.files import File
+from django.core.validators import validate_email
+from django.db import IntegrityError, connections, transaction
+from django.utils._os import safe_join
+
+from .models import Profile
+from .signals import rows_updated
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('csv', 'jsonl')
+FIELDS = ('username', 'email', 'password', 'password_hash', 'name', 'avatar')
+
+
+def get_file_format(name):
+    """Формат файла импорта по расширению: csv или jsonl."""
+    extension = os.path.splitext(name)[1].lower().lstrip('.')
+    return 'jsonl' if extension in ('jsonl', 'ndjson', 'json') else 'csv'
+
+
+def read_records(fp, file_format):
+    """
+    Читает записи из текстового файла потоком, не загружая его целиком.
+    CSV - с заголовком (username,email,password,password_hash,name,avatar),
+    JSONL - по объекту на строку.
+
+    :return: Итератор пар (номер строки, словарь или None, если строку не разобрать).
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(fp)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield line_number, record if isinstance(record, dict) else None
+
+
+class UserImporter:
+    """
+    Массовое создание пользователей с профилями.
+
+    Регистрация через /api/register/ на каждого пользователя выполняет
+    create_user (хэширование пароля) и сигнал post_save, создающий профиль
+    отдельным INSERT. Здесь записи читаются потоком и обрабатываются
+    партиями: существующие имена проверяются одним запросом на партию,
+    пароли хэшируются в пуле процессов, пользователи и профили создаются
+    двумя bulk_create в одной транзакции (сигналы при этом не вызываются).
+    Аватары из каталога `avatar_dir` загружаются после партии в пуле потоков
+    и проходят обычную обработку (очередь ImageTask).
+
+    Хэширование пароля намеренно дорогое (PBKDF2) и ограничивает скорость
+    импорта числом ядер. Записи с готовым хэшем (password_hash, формат Django)
+    и без пароля (вход будет невозможен до сброса) хэширования не требуют.
+
+    :param processes: Размер пула процессов для хэширования; 0 - в текущем процессе.
+    :param hash_in_threads: Хэшировать в пуле из `processes` потоков, а не
+                            процессов (hashlib освобождает GIL). Для вызова
+                            из веб-запроса, где запуск процессов слишком дорог.
+    :param io_threads: Размер пула потоков для аватаров; 0 - без потоков.
+    """
+
+    def __init__(self, processes=None, io_threads=8, batch_size=1000, avatar_dir=None,
+                 dry_run=False, max_errors=100, report=None, hash_in_threads=False):
+        self.processes = os.cpu_count() if processes is None else processes
+        self.hash_in_threads = hash_in_threads
+        self.io_threads = io_threads
+        self.batch_size = batch_size
+        self.avatar_dir = avatar_dir
+        self.dry_run = dry_run
+        self.max_errors = max_errors
+        self.report = report or (lambda stats: None)
+        self.hash_pool = None
+        self.io_pool = None
+        self.seen = set()
+
+    def run(self, records):
+        """
+        Импортирует записи (см. read_records).
+
+        :return: Статистика: created, skipped (пользователь уже есть),
+                 failed, avatars, avatar_errors, errors (первые max_errors
+                 ошибок: {'line': номер строки, 'message': текст}) и elapsed.
+        """
+        stats = {
+            'created': 0, 'skipped': 0, 'failed': 0, 'avatars': 0, 'avatar_errors': 0,
+            'errors': [], 'started': time.monotonic(),
+        }
+        if self.io_threads and self.avatar_dir:
+            self.io_pool = ThreadPoolExecutor(self.io_threads)
+        try:
+            batch = []
+            for line_number, record in records:
+                try:
+                    batch.append(self.clean(line_number, record))
+                except ValidationError as exc:
+                    self.add_error(stats, line_number, exc)
+                if len(batch) >= self.batch_size:
+                    self.run_batch(batch, stats)
+                    batch = []
+            if batch:
+                self.run_batch(batch, stats)
+        finally:
+            if self.hash_pool:
+                self.hash_pool.shutdown()
+            if self.io_pool:
+                self.io_pool.shutdown()
+        stats['elapsed'] = time.monotonic() - stats.pop('started')
+        return stats
+
+    def add_error(self, stats, line_number, exc, counter='failed'):
+        stats[counter] += 1
+        if len(stats['errors']) < self.max_errors:
+            stats['errors'].append({'line': line_number, 'message': '; '.join(exc.messages)})
+
+    def clean(self, line_number, record):
+        """Проверяет запись и возвращает словарь полей нового пользователя."""
+        if record is None:
+            raise ValidationError('Не удалось разобрать строку.')
+        values = {
+            key: str(record[key]).strip() if record.get(key) is not None else ''
+            for key in FIELDS
+        }
+        username = values['username']
+        if not username:
+            raise ValidationError('Не указано имя пользователя.')
+        if len(username) > User._meta.get_field('username').max_length:
+            raise ValidationError('Слишком длинное имя пользователя.')
+        User.username_validator(username)
+        if username in self.seen:
+            raise ValidationError(f'Пользователь {username} уже есть в файле.')
+        self.seen.add(username)
+
+        if values['email']:
+            validate_email(values['email'])
+        if len(values['name']) > Profile._meta.get_field('name').max_length:
+            raise ValidationError('Слишком длинное имя профиля.')
+        if values['password_hash']:
+            try:
+                identify_hasher(values['password_hash'])
+            except ValueError:
+                raise ValidationError('Неизвестный формат хэша пароля.')
+        if values['avatar']:
+            if not self.avatar_dir:
+                raise ValidationError('Аватары не поддерживаются: не задан каталог файлов.')
+            try:
+                values['avatar'] = safe_join(self.avatar_dir, values['avatar'])
+            except SuspiciousFileOperation:
+                raise ValidationError('Путь к аватару вне каталога файлов.')
+        values['line'] = line_number
+        return values
+
+    def run_batch(self, batch, stats):
+        existing = set(
+            User.objects.filter(username__in=[row['username'] for row in batch])
+            .values_list('username', flat=True)
+        )
+        rows = [row for row in batch if row['username'] not in existing]
+        stats['skipped'] += len(batch) - len(rows)
+        if self.dry_run:
+            stats['created'] += len(rows)
+            self.report(stats)
+            return
+
+        passwords = self.hash_passwords([row['password'] for row in rows if not row['password_hash']])
+        for row in rows:
+            if not row['password_hash']:
+                row['password_hash'] = next(passwords)
+        try:
+            profiles = self.save_batch(rows)
+        except IntegrityError:
+            # Часть имен заняли параллельной регистрацией - повторяем без них
+            taken = set(
+                User.objects.filter(username__in=[row['username'] for row in rows])
+                .values_list('username', flat=True)
+            )
+            stats['skipped'] += len(taken)
+            rows = [row for row in rows if row['username'] not in taken]
+            profiles = self.save_batch(rows)
+        stats['created'] += len(rows)
+
+        avatars = [(profile, row) for profile, row in zip(profiles, rows) if row['avatar']]
+        if self.io_pool:
+            results = list(self.io_pool.map(lambda item: self._attach_avatar_in_thread(*item), avatars))
+        else:
+            results = [self.attach_avatar(profile, row) for profile, row in avatars]
+        for (_, row), error in zip(avatars, results):
+            if error is None:
+                stats['avatars'] += 1
+            else:
+                # Пользователь создан, не загрузился только аватар
+                self.add_error(stats, row['line'], error, counter='avatar_errors')
+        self.report(stats)
+
+    def hash_passwords(self, passwords):
+        """
+        Хэши паролей (пустой пароль - хэш, с которым вход невозможен).
+        Для нескольких паролей используется пул процессов (или потоков).
+
+        :return: Итератор хэшей в порядке паролей.
+        """
+        passwords = [password or None for password in passwords]
+        if not self.processes or len(passwords) < 2:
+            return iter([make_password(password) for password in passwords])
+        if self.hash_pool is None and self.hash_in_threads:
+            self.hash_pool = ThreadPoolExecutor(self.processes)
+        elif self.hash_pool is None:
+            # spawn: fork многопоточного процесса (веб-сервер) небезопасен;
+            # в дочернем процессе нужны настройки Django (для хэшера)
+            self.hash_pool = ProcessPoolExecutor(
+                self.processes,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup
+            )
+        chunksize = max(1, len(passwords) // (self.processes * 4))
+        return self.hash_pool.map(make_password, passwords, chunksize=chunksize)
+
+    def save_batch(self, rows):
+        """Создает пользователей и профили партии; возвращает профили в порядке записей."""
+        with transaction.atomic():
+            users = User.objects.bulk_create([
+                User(username=row['username'], email=row['email'], password=row['password_hash'])
+                for row in rows
+            ], batch_size=self.batch_size)
+            if users and users[0].pk is None:
+                # БД не возвращает ID из bulk_create
+                ids = dict(
+                    User.objects.filter(username__in=[user.username for user in users])
+                    .values_list('username', 'pk')
+                )
+                for user in users:
+                    user.pk = ids[user.username]
+            profiles = Profile.objects.bulk_create([
+                Profile(user=user, name=row['name'] or user.username)
+                for user, row in zip(users, rows)
+            ], batch_size=self.batch_size)
+        for profile in profiles:
+            # Профиль считается загруженным: при загрузке аватара запишутся только измененные поля
+            profile._snapshot_loaded_values()
+        # bulk_create не вызывает сигналы: сбрасываем кэш списка профилей сами
+        rows_updated.send(sender=Profile, pks=[profile.pk for profile in profiles])
+        return profiles
+
+    def _attach_avatar_in_thread(self, profile, row):
+        try:
+            return self.attach_avatar(profile, row)
+        finally:
+            # У каждого потока свое соединение с БД, закрываем его сами
+            connections.close_all()
+
+    def attach_avatar(self, profile, row):
+        """
+        Загружает аватар из файла с теми же проверками, что при загрузке через
+        API, и ставит его в очередь обработки.
+
+        :return: None или ValidationError.
+        """
+        field = Profile._meta.get_field('avatar')
+        try:
+            with open(row['avatar'], 'rb') as f:
+                upload = File(f, name=os.path.basename(row['avatar']))
+                field.run_validators(upload)
+                profile.avatar = upload
+                profile.save()
+        except OSError as exc:
+            return ValidationError(f'Не удалось прочитать аватар: {exc.strerror}')
+        except ValidationError as exc:
+            return exc
+        except Exception:
+            logger.exception('Ошибка загрузки аватара пользователя %s', row['username'])
+            return ValidationError('Не удалось загрузить аватар.')
+        return None
@@ -1,50 +1,227 @@
+import hashlib
+import math
+import time
 from io import BytesIO
 
 from django.conf import settings
-from PIL import Image
+from PIL import ExifTags, Image, ImageOps
 
+from . import metrics
+from .formats import ALPHA_FORMATS
 
-def process_image(image_file, quality=85, target_format='JPEG'):
-    """
-    Принимает файловый объект изображения, выполняет обработку и возвращает
-    обработанное изображение в виде BytesIO-буфера.
 
-    :param image_file: Входной файловый объект (из ImageField).
-    :param quality: Качество сжатия для JPEG (по умолчанию 85).
-    :param target_format: Целевой формат ('JPEG', 'PNG').
-    :return: BytesIO-буфер с обработанным изображением.
+def get_file_sha256(file):
     """
-    try:
-        pil_img = Image.open(image_file)
-    except Exception as e:
-        # Если Pillow не может открыть файл, возвращаем None или возбуждаем ошибку
-        # Это дополнительная защита от некорректных файлов, прошедших валидацию
-        return None
+    SHA-256 содержимого файла. Для загрузок хэш уже посчитан обработчиком
+    загрузки (см. avatars.uploadhandlers) по мере приема данных.
+    """
+    sha256 = getattr(file, 'sha256', None)
+    if sha256:
+        return sha256
+    digest = hashlib.sha256()
+    file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def get_square_box(size):
+    """Координаты квадрата по центру изображения размера `size`."""
+    width, height = size
+    min_dim = min(width, height)
+    left = (width - min_dim) // 2
+    top = (height - min_dim) // 2
+    return (left, top, left + min_dim, top + min_dim)
+
 
-    # --- 1. Обрезка до квадрата ---
+def crop_to_square(pil_img):
+    """Обрезает изображение до квадрата по центру."""
     width, height = pil_img.size
-    if width != height:
-        min_dim = min(width, height)
-        left = (width - min_dim) // 2
-        top = (height - min_dim) // 2
-        right = (width + min_dim) // 2
-        bottom = (height + min_dim) // 2
-        pil_img = pil_img.crop((left, top, right, bottom))
-
-    # --- 2. Конвертация и сжатие ---
-    # Конвертируем в RGB, чтобы избавиться от проблем с прозрачностью (альфа-канал)
-    # и другими цветовыми режимами (например, палитра 'P').
+    if width == height:
+        return pil_img
+    return pil_img.crop(get_square_box(pil_img.size))
+
+
+def decode_image(image_file, target_size=None, square=False):
+    """
+    Декодирует изображение сразу в уменьшенном виде, если полный размер не нужен.
+
+    Для JPEG декодеру передается draft(): он выполняет масштабирование на этапе
+    DCT (1/2, 1/4, 1/8) и не создает полноразмерный bitmap. Выбирается
+    ближайший масштаб, при котором результат не меньше `target_size`.
+    Для остальных форматов обрезка и целочисленное уменьшение выполняются
+    одним проходом reduce(box=...), без промежуточной полноразмерной копии.
+
+    :param image_file: Входной файловый объект.
+    :param target_size: Нужная сторона результата (для квадрата) или
+                        длинная сторона; None - декодировать как есть.
+    :param square: Обрезать ли до квадрата по центру.
+    :return: Декодированное изображение; сторона (или длинная сторона)
+             не меньше target_size, если исходник был больше.
+    """
+    started = time.perf_counter()
+    pil_img = Image.open(image_file)
+    source_size, source_format = pil_img.size, pil_img.format
+
+    if target_size and pil_img.format == 'JPEG':
+        width, height = pil_img.size
+        base = min(width, height) if square else max(width, height)
+        if base > target_size:
+            ratio = target_size / base
+            pil_img.draft(None, (math.ceil(width * ratio), math.ceil(height * ratio)))
+
+    pil_img = normalize_mode(pil_img)
+    box = get_square_box(pil_img.size) if square else (0, 0, *pil_img.size)
+    box_width, box_height = box[2] - box[0], box[3] - box[1]
+    factor = max(box_width, box_height) // target_size if target_size else 1
+    # Оставляем запас в 2 раза, чтобы финальный resize сгладил изображение
+    factor //= 2
+    if factor > 1:
+        pil_img = pil_img.reduce(factor, box=box)
+    elif box != (0, 0, *pil_img.size):
+        pil_img = pil_img.crop(box)
+    else:
+        pil_img.load()
+    pil_img = apply_exif_orientation(pil_img)
+    metrics.observe_image_stage('decode', source_size, time.perf_counter() - started, source_format)
+    return pil_img
+
+
+def apply_exif_orientation(pil_img):
+    """
+    Поворачивает изображение согласно EXIF-тегу Orientation (снимки с телефона).
+    Метаданные при кодировании не сохраняются, поэтому поворот нужно
+    применить к пикселям заранее. Центральный квадрат при повороте
+    не меняется, так что порядок относительно обрезки не важен.
+    """
+    if pil_img.getexif().get(ExifTags.Base.Orientation, 1) == 1:
+        return pil_img
+    return ImageOps.exif_transpose(pil_img)
+
+
+def fit_to_size(pil_img, max_size):
+    """Уменьшает изображение так, чтобы длинная сторона не превышала max_size."""
+    if not max_size or max(pil_img.size) <= max_size:
+        return pil_img
+    ratio = max_size / max(pil_img.size)
+    new_size = (max(1, round(pil_img.width * ratio)), max(1, round(pil_img.height * ratio)))
+    return pil_img.resize(new_size, Image.LANCZOS)
+
+
+def convert_to_rgb(pil_img):
+    """
+    Конвертирует в RGB, чтобы избавиться от проблем с прозрачностью (альфа-канал)
+    и другими цветовыми режимами (например, палитра 'P').
+    """
     if pil_img.mode in ('RGBA', 'P', 'LA'):
-        pil_img = pil_img.convert('RGB')
+        with metrics.image_stage('convert', pil_img.size):
+            return pil_img.convert('RGB')
+    return pil_img
+
+
+def normalize_mode(pil_img):
+    """
+    Приводит изображение к RGB, а изображения с прозрачностью - к RGBA:
+    альфа-канал сохраняется в WebP/AVIF и отбрасывается только при записи JPEG.
+    """
+    if pil_img.mode in ('RGB', 'RGBA', 'L'):
+        return pil_img
+    if pil_img.mode in ('LA', 'PA') or 'transparency' in pil_img.info:
+        return pil_img.convert('RGBA')
+    return pil_img.convert('RGB')
 
+
+def write_image(pil_img, fp, quality=None, target_format='JPEG'):
+    """
+    Кодирует изображение и пишет результат в файлоподобный объект `fp`.
+    Параметры кодировщика берутся из IMAGE_ENCODER_PRESETS[target_format];
+    `quality` переопределяет качество из пресета.
+    """
+    options = dict(settings.IMAGE_ENCODER_PRESETS.get(target_format, {}))
+    if quality is not None:
+        options['quality'] = quality
+    if target_format not in ALPHA_FORMATS:
+        pil_img = convert_to_rgb(pil_img)
+    with metrics.image_stage('encode', pil_img.size, target_format):
+        pil_img.save(fp, format=target_format, **options)
+
+
+def encode_image(pil_img, quality=None, target_format='JPEG'):
+    """Кодирует изображение и возвращает BytesIO-буфер, готовый к чтению."""
     buffer = BytesIO()
-    pil_img.save(
-        buffer,
-        format=target_format,
-        quality=quality,
-        optimize=True
-    )
+    write_image(pil_img, buffer, quality=quality, target_format=target_format)
     # Возвращаем курсор в начало буфера, чтобы Django мог его прочитать
     buffer.seek(0)
-
     return buffer
+
+
+def render_renditions(pil_img, sizes):
+    """
+    Строит набор уменьшенных копий изображения, размер задает длинную сторону
+    (для квадратного аватара - обе). Копии получаются последовательным
+    уменьшением: каждая следующая строится из предыдущей, а не из
+    полноразмерного оригинала.
+
+    :param pil_img: Уже декодированное изображение.
+    :param sizes: Длинные стороны копий в пикселях.
+    :return: Словарь {размер: изображение}.
+    """
+    renditions = {}
+    current = pil_img
+    for size in sorted(set(sizes), reverse=True):
+        current = fit_to_size(current, size)
+        renditions[size] = current
+    return renditions
+
+
+def prepare_image(image_file, sizes, max_size, square=False):
+    """
+    Декодирует изображение один раз и готовит основное изображение и
+    уменьшенные копии. Кодирование оставлено вызывающему коду, чтобы
+    результат можно было писать во временный файл и хранилище потоком
+    (см. avatars.storage.spool_output и save_file).
+
+    :param image_file: Входной файловый объект (из ImageField).
+    :param sizes: Длинные стороны уменьшенных копий.
+    :param max_size: Максимальная длинная сторона основного файла.
+    :param square: Обрезать ли до квадрата по центру.
+    :return: Кортеж (основное изображение, {размер: изображение}) или None,
+             если Pillow не смог открыть файл.
+    """
+    try:
+        pil_img = decode_image(image_file, target_size=max((max_size, *sizes)), square=square)
+    except Exception:
+        return None
+
+    with metrics.image_stage('resize', pil_img.size):
+        pil_img = fit_to_size(pil_img, max_size)
+        renditions = render_renditions(pil_img, sizes)
+    return pil_img, renditions
+
+
+def prepare_avatar(image_file, sizes=None, max_size=None):
+    """
+    Готовит квадратный аватар и его копии (см. prepare_image).
+    По умолчанию используются IMAGE_RENDITION_SIZES['avatar'] и
+    IMAGE_MAX_DIMENSIONS['avatar'].
+    """
+    if sizes is None:
+        sizes = settings.IMAGE_RENDITION_SIZES['avatar']
+    if max_size is None:
+        max_size = settings.IMAGE_MAX_DIMENSIONS['avatar']
+    return prepare_image(image_file, sizes, max_size, square=True)
+
+
+def prepare_shared_image(image_file, sizes=None, max_size=None):
+    """
+    Готовит общее изображение: без обрезки, длинная сторона ограничена,
+    плюс превью (см. prepare_image). По умолчанию используются
+    IMAGE_RENDITION_SIZES['shared_image'] и IMAGE_MAX_DIMENSIONS['shared_image'].
+    """
+    if sizes is None:
+        sizes = settings.IMAGE_RENDITION_SIZES['shared_image']
+    if max_size is None:
+        max_size = settings.IMAGE_MAX_DIMENSIONS['shared_image']
+    return prepare_image(image_file, sizes, max_size)
+
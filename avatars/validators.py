@@ -1,10 +1,25 @@
 import os
+from collections import namedtuple
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
+from PIL import Image
 
 # Максимальный размер файла в мегабайтах
 MAX_FILE_SIZE_MB = 5
 
+# Сигнатуры (magic bytes) поддерживаемых форматов
+IMAGE_SIGNATURES = {
+    'JPEG': b'\xff\xd8\xff',
+    'PNG': b'\x89PNG\r\n\x1a\n',
+}
+
+# Форматы Pillow, которые являются разновидностью поддерживаемых: MPO -
+# JPEG с дополнительными снимками (так сохраняют фото многие камеры телефонов)
+FORMAT_ALIASES = {'MPO': 'JPEG'}
+
+ImageHeader = namedtuple('ImageHeader', ['format', 'width', 'height', 'mode', 'frames'])
+
 
 def validate_image_file_extension(value):
     """
@@ -24,3 +39,73 @@ def validate_image_size(value):
     limit_bytes = MAX_FILE_SIZE_MB * 1024 * 1024
     if filesize > limit_bytes:
         raise ValidationError(f"Максимальный размер файла не должен превышать {MAX_FILE_SIZE_MB}МБ.")
+
+
+def sniff_image_format(file):
+    """
+    Определяет реальный формат файла по первым байтам, а не по имени.
+    Возвращает 'JPEG', 'PNG' или None.
+    """
+    file.seek(0)
+    head = file.read(16)
+    file.seek(0)
+    for image_format, signature in IMAGE_SIGNATURES.items():
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+def read_image_header(file):
+    """
+    Читает только заголовок изображения: формат, размеры, режим и число кадров.
+    Image.open() не декодирует пиксели, пока не вызван load().
+    """
+    file.seek(0)
+    try:
+        with Image.open(file) as pil_img:
+            return ImageHeader(
+                format=pil_img.format,
+                width=pil_img.width,
+                height=pil_img.height,
+                mode=pil_img.mode,
+                frames=getattr(pil_img, 'n_frames', 1)
+            )
+    except Image.DecompressionBombError:
+        raise ValidationError('Слишком большое разрешение изображения.')
+    except Exception:
+        raise ValidationError('Файл поврежден или не является изображением.')
+    finally:
+        file.seek(0)
+
+
+def validate_image_header(value):
+    """
+    Проверяет заголовок изображения до декодирования пикселей: реальный формат
+    по сигнатуре, разрешение и число кадров. Отсекает "декомпрессионные бомбы" -
+    маленькие файлы, объявляющие огромное разрешение.
+    """
+    # Уже сохраненный файл был проверен при загрузке
+    if getattr(value, '_committed', False):
+        return
+
+    sniffed_format = sniff_image_format(value)
+    if sniffed_format is None:
+        raise ValidationError(
+            f'Содержимое файла не является изображением {" или ".join(IMAGE_SIGNATURES)}.'
+        )
+
+    header = read_image_header(value)
+    if FORMAT_ALIASES.get(header.format, header.format) != sniffed_format:
+        raise ValidationError('Содержимое файла не соответствует формату изображения.')
+    if max(header.width, header.height) > settings.IMAGE_MAX_DIMENSION:
+        raise ValidationError(
+            f'Сторона изображения не должна превышать {settings.IMAGE_MAX_DIMENSION} пикселей.'
+        )
+    if header.width * header.height > settings.IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            f'Разрешение изображения не должно превышать {settings.IMAGE_MAX_PIXELS} пикселей.'
+        )
+    # Из MPO декодируется только первый снимок, остальные кадрами не считаются
+    frames = 1 if header.format == 'MPO' else header.frames
+    if frames > settings.IMAGE_MAX_FRAMES:
+        raise ValidationError('Анимированные изображения не поддерживаются.')
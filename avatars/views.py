@@ -1,28 +1,226 @@
-from rest_framework import generics, permissions, viewsets
+import io
+from calendar import timegm
+from itertools import islice
 
-from .models import Profile, SharedImage
-from .permissions import CanViewOrOwnerCanModify, IsOwnerOrReadOnly
-from .serializers import ProfileSerializer, SharedImageSerializer, UserCreateSerializer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Prefetch
+from django.http import HttpResponse, HttpResponseRedirect
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import generics, permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.parsers import FormParser, MultiPartParser
+from rest_framework.response import Response
+
+from . import cache, metrics, transform, user_import
+from .access import can_view_image
+from .formats import (
+    BASE_FORMAT,
+    FORMAT_MIME_TYPES,
+    get_output_formats,
+    get_variant_path,
+    negotiate_format,
+)
+from .models import (
+    ImageKind,
+    ProcessingStatus,
+    Profile,
+    SharedImage,
+    SharedImageRecipient,
+)
+from .pagination import ProfileCursorPagination, SharedImageCursorPagination
+from .permissions import CanViewOrOwnerCanModify, HasMetricsToken, IsOwnerOrReadOnly
+from .serializers import (
+    BulkShareSerializer,
+    ProfileListSerializer,
+    ProfileSerializer,
+    SharedImageListSerializer,
+    SharedImageSerializer,
+    UserCreateSerializer,
+)
+from .storage import PrivateS3Storage
+
+
+def get_expand(request):
+    """Множество вложенных объектов, запрошенных через ?expand=a,b."""
+    value = request.query_params.get('expand', '')
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+class IgnoreClientContentNegotiation(BaseContentNegotiation):
+    """
+    Для редиректа на файл заголовок Accept выбирает формат изображения,
+    а не рендерер ответа: иначе Accept: image/webp приводил бы к 406.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return (renderers[0], renderers[0].media_type)
+
+
+def redirect_to_image(request, file, renditions, formats):
+    """
+    Редирект на лучший для клиента вариант файла: размер - из ?size=
+    (одна из уменьшенных копий), формат - по заголовку Accept.
+    """
+    size = request.query_params.get('size')
+    if size is None:
+        name = file.name
+    elif size in renditions:
+        name = renditions[size]
+    else:
+        available = ', '.join(sorted(renditions, key=int)) or 'нет'
+        raise ValidationError({'size': f'Доступные размеры: {available}.'})
+    if not name:
+        raise NotFound('Изображение не загружено.')
+
+    image_format = negotiate_format(request.META.get('HTTP_ACCEPT'), formats)
+    if image_format != BASE_FORMAT:
+        name = get_variant_path(name, image_format)
+    response = HttpResponseRedirect(file.storage.url(name))
+    # Кэши должны различать ответы для клиентов с разным Accept
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def get_timestamp(value):
+    """Unix timestamp времени изменения для Last-Modified (с точностью до секунды)."""
+    return timegm(value.utctimetuple())
+
+
+def conditional_response(request, etag, last_modified, get_data):
+    """
+    Ответ с заголовками ETag и Last-Modified. Если копия клиента актуальна
+    (If-None-Match / If-Modified-Since), возвращается 304 и данные
+    не строятся вовсе.
+    """
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = Response(get_data())
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def get_shared_image_validators(request, instance):
+    """
+    ETag и Last-Modified (или None) изображения для условного GET.
+
+    Ссылки на закрытые файлы в ответе подписаны и меняются с каждым окном
+    подписи (см. SignedURLCache), поэтому в ETag входит номер окна, а
+    Last-Modified не отдается: по нему клиент получил бы 304 и продолжил
+    пользоваться истекшими ссылками.
+    """
+    # Получателей видит только владелец, поэтому представление зависит и от пользователя
+    parts = [
+        instance.pk,
+        instance.updated_at.isoformat(),
+        instance.owner_id == request.user.pk,
+        request.build_absolute_uri('/'),
+    ]
+    storage = instance.image.storage
+    if isinstance(storage, PrivateS3Storage):
+        window, _ = storage.signed_urls.get_window()
+        return cache.make_etag(*parts, window), None
+    return cache.make_etag(*parts), get_timestamp(instance.updated_at)
 
 
 class ProfileViewSet(viewsets.ModelViewSet):
     """
     ViewSet для просмотра и редактирования профилей пользователей.
-    - list:     GET /api/profiles/
+    - list:     GET /api/profiles/ (курсорная пагинация, ?expand=user)
     - retrieve: GET /api/profiles/{id}/
     - update:   PUT /api/profiles/{id}/
     - partial_update: PATCH /api/profiles/{id}/
+    - avatar:   GET /api/profiles/{id}/avatar/?size=64 - редирект на файл
+                в лучшем для клиента формате (по заголовку Accept)
+
+    - cache_stats: GET /api/profiles/cache-stats/ - счетчики кэша (только администраторы)
+
+    Новый аватар обрабатывается в фоне: пока обработка не завершена,
+    ответ приходит со статусом 202 и avatar_status="pending".
+
+    Ответы list и retrieve кэшируются (см. avatars.cache) и отдаются с ETag;
+    при совпадении If-None-Match возвращается 304 без обращения к БД.
     """
     queryset = Profile.objects.select_related('user').all()
     serializer_class = ProfileSerializer
     permission_classes = [IsOwnerOrReadOnly]
+    pagination_class = ProfileCursorPagination
+
+    def get_queryset(self):
+        # В облегченном списке пользователь не нужен - обходимся без JOIN
+        if self.action == 'list' and 'user' not in get_expand(self.request):
+            return Profile.objects.all()
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ProfileListSerializer
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = get_expand(self.request)
+        return context
 
     # Переопределяем права доступа для list/retrieve, чтобы их могли видеть все
     def get_permissions(self):
-        if self.action in ['list', 'retrieve']:
+        if self.action in ['list', 'retrieve', 'avatar']:
             return [permissions.AllowAny()]
         return super().get_permissions()
 
+    def list(self, request, *args, **kwargs):
+        key = cache.get_list_key(request.build_absolute_uri())
+        entry = cache.get_list(key)
+        if entry is None:
+            response = super().list(request, *args, **kwargs)
+            entry = cache.set_list(key, response.data)
+        return self.cached_response(request, entry)
+
+    def retrieve(self, request, *args, **kwargs):
+        pk = kwargs[self.lookup_url_kwarg or self.lookup_field]
+        base_url = request.build_absolute_uri('/')
+        key = cache.get_detail_key(pk)
+        entry = cache.get_detail(key, base_url)
+        if entry is None:
+            instance = self.get_object()
+            entry = cache.set_detail(
+                key,
+                base_url,
+                self.get_serializer(instance).data,
+                last_modified=get_timestamp(instance.updated_at)
+            )
+        return self.cached_response(request, entry)
+
+    def cached_response(self, request, entry):
+        return conditional_response(
+            request, entry['etag'], entry['last_modified'], lambda: entry['data']
+        )
+
+    @action(detail=False, url_path='cache-stats', permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        return Response(cache.get_stats())
+
+    def update(self, request, *args, **kwargs):
+        response = super().update(request, *args, **kwargs)
+        if response.data.get('avatar_status') == ProcessingStatus.PENDING:
+            response.status_code = status.HTTP_202_ACCEPTED
+        return response
+
+    @action(detail=True, content_negotiation_class=IgnoreClientContentNegotiation)
+    def avatar(self, request, pk=None):
+        profile = self.get_object()
+        return redirect_to_image(
+            request, profile.avatar, profile.avatar_renditions, profile.avatar_formats
+        )
+
 
 class UserCreateAPIView(generics.CreateAPIView):
     """Эндпоинт для регистрации новых пользователей."""
@@ -30,29 +228,250 @@ class UserCreateAPIView(generics.CreateAPIView):
     permission_classes = [permissions.AllowAny]  # Разрешаем доступ всем
 
 
+class UserImportView(generics.GenericAPIView):
+    """
+    POST /api/users/import/ - массовое создание пользователей из файла CSV
+    или JSONL (поле file, формат - по расширению или полю format; только
+    администраторы). Принимается не больше USER_IMPORT_API_MAX_ROWS строк,
+    большие файлы импортируются командой import_users. Аватары через API
+    не загружаются.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            raise ValidationError({'file': 'Файл не передан.'})
+        file_format = request.data.get('format') or user_import.get_file_format(upload.name)
+        if file_format not in user_import.FORMATS:
+            raise ValidationError({'format': f'Поддерживаются форматы: {", ".join(user_import.FORMATS)}.'})
+
+        max_rows = settings.USER_IMPORT_API_MAX_ROWS
+        text = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+        try:
+            # Файл проверяется до создания первых пользователей
+            records = list(islice(user_import.read_records(text, file_format), max_rows + 1))
+        except UnicodeDecodeError:
+            raise ValidationError({'file': 'Файл должен быть в кодировке UTF-8.'})
+        if len(records) > max_rows:
+            raise ValidationError(
+                {'file': f'Не больше {max_rows} строк, для больших файлов используйте import_users.'}
+            )
+
+        importer = user_import.UserImporter(
+            processes=settings.USER_IMPORT_API_THREADS, hash_in_threads=True, io_threads=0
+        )
+        stats = importer.run(records)
+        return Response(stats, status=status.HTTP_201_CREATED if stats['created'] else status.HTTP_200_OK)
+
+
 class SharedImageViewSet(viewsets.ModelViewSet):
     """
     ViewSet для обмена изображениями.
     - list:     GET /api/shared_images/ - получить список изображений, которыми поделились с вами
+                (курсорная пагинация, ?expand=owner,shared_with, ?scope=owned|received)
     - create:   POST /api/shared_images/ - загрузить и поделиться новым изображением
     - retrieve: GET /api/shared_images/{id}/ - посмотреть конкретное изображение
     - destroy:  DELETE /api/shared_images/{id}/ - удалить свое изображение
+    - image:    GET /api/shared_images/{id}/image/?size=320 - редирект на файл
+                в лучшем для клиента формате (по заголовку Accept)
+    - share:    POST /api/shared_images/share/ {"images": [...], "users": [...]} -
+                поделиться несколькими своими изображениями с несколькими пользователями
+    - unshare:  POST /api/shared_images/unshare/ - отозвать такой доступ
     """
     serializer_class = SharedImageSerializer
     permission_classes = [permissions.IsAuthenticated, CanViewOrOwnerCanModify]
+    pagination_class = SharedImageCursorPagination
     # Запрещаем методы PUT и PATCH
     http_method_names = ['get', 'post', 'delete', 'head', 'options']
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return SharedImageListSerializer
+        return super().get_serializer_class()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['expand'] = get_expand(self.request)
+        return context
+
+    SCOPES = ('owned', 'received')
+
     def get_queryset(self):
         """
         Этот метод определяет, какие объекты будут видны пользователю.
         Пользователь видит:
         1. Изображения, которыми он владеет.
         2. Изображения, которыми с ним поделились.
+        Параметр ?scope=owned|received оставляет только одну из групп.
+
+        Вместо OR по JOIN с промежуточной таблицей и DISTINCT каждая группа
+        выбирается по своему индексу (owner и (user, sharedimage)), а для всех
+        изображений ID групп объединяются через UNION ALL внутри IN.
         """
         user = self.request.user
-        # Используем Q-объекты для сложной фильтрации (OR)
-        from django.db.models import Q
-        return SharedImage.objects.filter(
-            Q(owner=user) | Q(shared_with=user)
-        ).distinct().select_related('owner').prefetch_related('shared_with')
+        scope = self.request.query_params.get('scope') if self.action == 'list' else None
+        if scope is not None and scope not in self.SCOPES:
+            raise ValidationError({'scope': f'Допустимые значения: {", ".join(self.SCOPES)}.'})
+
+        received = SharedImageRecipient.objects.filter(user=user)
+        if scope == 'owned':
+            queryset = SharedImage.objects.filter(owner=user)
+        elif scope == 'received':
+            queryset = SharedImage.objects.filter(pk__in=received.values('sharedimage_id'))
+        else:
+            owned_ids = SharedImage.objects.filter(owner=user).values('pk')
+            received_ids = received.values('sharedimage_id')
+            queryset = SharedImage.objects.filter(
+                pk__in=owned_ids.union(received_ids, all=True)
+            )
+
+        # В облегченном списке вложенные объекты загружаются только по запросу.
+        # Получатели одного объекта загружаются сериализатором и только для владельца
+        expand = get_expand(self.request) if self.action == 'list' else {'owner'}
+        if 'owner' in expand:
+            queryset = queryset.select_related('owner')
+        if 'shared_with' in expand:
+            queryset = queryset.prefetch_related(
+                Prefetch('shared_with', queryset=User.objects.only('id'))
+            )
+        return queryset
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag, last_modified = get_shared_image_validators(request, instance)
+        return conditional_response(
+            request, etag, last_modified, lambda: self.get_serializer(instance).data
+        )
+
+    @action(detail=True, content_negotiation_class=IgnoreClientContentNegotiation)
+    def image(self, request, pk=None):
+        shared_image = self.get_object()
+        return redirect_to_image(
+            request, shared_image.image, shared_image.image_renditions, shared_image.image_formats
+        )
+
+    @action(detail=False, methods=['post'], serializer_class=BulkShareSerializer)
+    def share(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'shared': serializer.share()})
+
+    @action(detail=False, methods=['post'], serializer_class=BulkShareSerializer)
+    def unshare(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'unshared': serializer.unshare()})
+
+
+def get_transform_size(query_params):
+    """Размер из ?size=, округленный до одного из IMAGE_SERVE_SIZES."""
+    try:
+        size = int(query_params['size'])
+    except (KeyError, ValueError):
+        size = 0
+    if size < 1:
+        raise ValidationError({'size': 'Укажите размер в пикселях.'})
+    return transform.snap_size(size)
+
+
+def get_transform_source(request, kind, pk):
+    """Кортеж (файл, копии) готового изображения, доступного пользователю запроса."""
+    if kind == ImageKind.AVATAR:
+        fields = ('avatar', 'avatar_renditions', 'avatar_status')
+        obj = Profile.objects.filter(pk=pk).only(*fields).first()
+    else:
+        fields = ('image', 'image_renditions', 'image_status', 'owner_id')
+        obj = SharedImage.objects.filter(pk=pk).only(*fields).first()
+        if obj is not None and not can_view_image(request, obj):
+            obj = None
+    if obj is None:
+        raise NotFound()
+    file, renditions, image_status = (getattr(obj, field) for field in fields[:3])
+    if not file:
+        raise NotFound('Изображение не загружено.')
+    if image_status != ProcessingStatus.READY:
+        raise NotFound('Изображение еще обрабатывается.')
+    return file, renditions
+
+
+def render_transform(key, kind, file, renditions, size, image_format):
+    """Байты результата из дискового кэша или построенные заново (блокирующий вызов)."""
+    source = transform.pick_source(file.name, renditions, size)
+
+    def render():
+        with file.storage.open(source) as f:
+            data = f.read()
+        return transform.transform_image(
+            data, size, square=kind == ImageKind.AVATAR, image_format=image_format
+        )
+
+    data = transform.get_or_transform(key, render)
+    if data is None:
+        raise NotFound('Не удалось открыть изображение.')
+    return data
+
+
+def set_transform_headers(response, kind, etag):
+    response['ETag'] = etag
+    visibility = 'public' if kind == ImageKind.AVATAR else 'private'
+    response['Cache-Control'] = f'{visibility}, max-age={settings.IMAGE_SERVE_MAX_AGE}'
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+class ImageTransformView(generics.GenericAPIView):
+    """
+    Изображение произвольного размера, построенное на лету.
+    - GET /api/images/avatar/{id}/?size=72 - аватар профиля (доступен всем)
+    - GET /api/images/shared_image/{id}/?size=500 - общее изображение
+      (владельцу и получателям)
+
+    Размер округляется вверх до одного из IMAGE_SERVE_SIZES, формат
+    выбирается по заголовку Accept. Результат строится из наименьшего
+    подходящего готового файла и хранится в дисковом кэше
+    (см. avatars.transform).
+    """
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get_permissions(self):
+        if self.kwargs['kind'] == ImageKind.AVATAR:
+            return [permissions.AllowAny()]
+        return [permissions.IsAuthenticated()]
+
+    def get(self, request, kind, pk):
+        size = get_transform_size(request.query_params)
+        file, renditions = get_transform_source(request, kind, pk)
+        image_format = negotiate_format(request.META.get('HTTP_ACCEPT'), get_output_formats())
+        key = transform.get_transform_key(kind, file.name, size, image_format)
+        etag = f'"{key}"'
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            data = render_transform(key, kind, file, renditions, size, image_format)
+            response = HttpResponse(data, content_type=FORMAT_MIME_TYPES[image_format])
+        return set_transform_headers(response, kind, etag)
+
+
+class ImageTransformStatsView(generics.GenericAPIView):
+    """GET /api/images/cache-stats/ - счетчики дискового кэша изображений (только администраторы)."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(transform.get_transform_cache().get_stats())
+
+
+class MetricsView(generics.GenericAPIView):
+    """
+    GET /api/metrics/ - метрики в текстовом формате Prometheus: текущего
+    процесса и, если задан PROMETHEUS_MULTIPROC_DIR, остальных процессов
+    хоста (см. avatars.metrics). Доступ по заголовку Authorization: Bearer METRICS_TOKEN.
+    """
+    # Сборщик передает статический токен, а не JWT
+    authentication_classes = []
+    permission_classes = [HasMetricsToken]
+    content_negotiation_class = IgnoreClientContentNegotiation
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,45 @@
+"""Общие помощники бенчмарков, которым нужна настроенная Django и БД."""
+import contextlib
+import os
+import statistics
+import time
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database():
+    """
+    Создает отдельную тестовую БД (как manage.py test) и удаляет ее по выходу,
+    чтобы засев данных не затрагивал рабочую базу.
+    """
+    from django.test.runner import DiscoverRunner
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0, interactive=False)
+    old_config = runner.setup_databases()
+    try:
+        yield
+    finally:
+        runner.teardown_databases(old_config)
+        teardown_test_environment()
+
+
+def measure(func, repeat=20):
+    """Запускает func несколько раз и возвращает медиану и p95 в миллисекундах."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[max(0, int(len(timings) * 0.95) - 1)],
+    }
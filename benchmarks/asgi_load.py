@@ -0,0 +1,161 @@
+"""
+Нагрузочный тест: медленные клиенты загружают изображения (или читают профиль)
+одновременно. Сравнивает пропускную способность WSGI- и ASGI-развертывания.
+
+Клиент написан на asyncio без сторонних библиотек: каждое соединение
+отправляет тело запроса частями с паузами, как клиент на медленной сети.
+
+Серверы запускаются отдельно, например:
+    gunicorn project.wsgi --workers 4 --threads 8 --bind :8000
+    uvicorn project.asgi:application --workers 4 --port 8001
+
+Запуск (синхронные эндпоинты DRF против асинхронных):
+    python -m benchmarks.asgi_load --username bench --password bench \\
+        --target wsgi=http://localhost:8000/api/shared_images/ \\
+        --target asgi=http://localhost:8001/api/async/shared_images/ \\
+        [--clients 1000 --upload-kb 256 --chunk-kb 16 --delay 0.05]
+
+С --mode read клиенты выполняют GET (например, /api/profiles/1/ и /api/async/profiles/1/).
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import urllib.request
+import uuid
+from io import BytesIO
+from urllib.parse import urlsplit
+
+
+def make_jpeg(size_kb):
+    """JPEG с шумом примерно нужного размера."""
+    from PIL import Image
+
+    side = 64
+    while True:
+        buffer = BytesIO()
+        Image.effect_noise((side, side), 64).convert('RGB').save(buffer, format='JPEG', quality=90)
+        if buffer.tell() >= size_kb * 1024 or side >= 4096:
+            return buffer.getvalue()
+        side *= 2
+
+
+def get_token(base_url, username, password):
+    request = urllib.request.Request(
+        f'{base_url}/api/token/',
+        data=json.dumps({'username': username, 'password': password}).encode(),
+        headers={'Content-Type': 'application/json'}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)['access']
+
+
+def build_upload(image):
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        b'Content-Disposition: form-data; name="caption"\r\n\r\nbench\r\n',
+        f'--{boundary}\r\n'.encode(),
+        b'Content-Disposition: form-data; name="image"; filename="bench.jpg"\r\n',
+        b'Content-Type: image/jpeg\r\n\r\n',
+        image,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return f'multipart/form-data; boundary={boundary}', body
+
+
+async def send_request(url, method, headers, body, chunk_size, delay):
+    """Отправляет запрос частями с паузами; возвращает код ответа."""
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    try:
+        target = f'{parts.path}?{parts.query}' if parts.query else parts.path
+        head = [f'{method} {target} HTTP/1.1', f'Host: {parts.netloc}',
+                f'Content-Length: {len(body)}', 'Connection: close']
+        head += [f'{name}: {value}' for name, value in headers.items()]
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode())
+        for start in range(0, len(body), chunk_size):
+            writer.write(body[start:start + chunk_size])
+            await writer.drain()
+            if delay:
+                await asyncio.sleep(delay)
+        status_line = await reader.readline()
+        await reader.read()
+        return int(status_line.split()[1])
+    finally:
+        writer.close()
+
+
+async def run_target(url, args, headers, body):
+    semaphore = asyncio.Semaphore(args.clients)
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                status = await send_request(
+                    url, args.method, headers, body, args.chunk_kb * 1024, args.delay
+                )
+            except (OSError, asyncio.IncompleteReadError, IndexError, ValueError):
+                status = 0
+            if 200 <= status < 400:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'ok': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed,
+        'median_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p95_ms': latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000 if latencies else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--target', action='append', required=True,
+                        help='Имя и URL эндпоинта: wsgi=http://localhost:8000/api/shared_images/')
+    parser.add_argument('--mode', choices=('upload', 'read'), default='upload')
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--clients', type=int, default=1000, help='Одновременных соединений.')
+    parser.add_argument('--requests', type=int, default=None, help='Всего запросов (по умолчанию = --clients).')
+    parser.add_argument('--upload-kb', type=int, default=256)
+    parser.add_argument('--chunk-kb', type=int, default=16)
+    parser.add_argument('--delay', type=float, default=0.05, help='Пауза между частями тела, секунды.')
+    args = parser.parse_args()
+    args.requests = args.requests or args.clients
+
+    targets = [target.split('=', 1) for target in args.target]
+    headers = {}
+    if args.username:
+        parts = urlsplit(targets[0][1])
+        token = get_token(f'{parts.scheme}://{parts.netloc}', args.username, args.password)
+        headers['Authorization'] = f'Bearer {token}'
+
+    if args.mode == 'upload':
+        args.method = 'POST'
+        content_type, body = build_upload(make_jpeg(args.upload_kb))
+        headers['Content-Type'] = content_type
+    else:
+        args.method, body = 'GET', b''
+
+    print(f'{args.requests} запросов {args.method}, {args.clients} одновременно, '
+          f'тело {len(body) // 1024} КБ частями по {args.chunk_kb} КБ раз в {args.delay} с')
+    for name, url in targets:
+        result = asyncio.run(run_target(url, args, headers, body))
+        print(f'{name:>8}: {result["rps"]:8.1f} запр./с, медиана {result["median_ms"]:8.1f} мс, '
+              f'p95 {result["p95_ms"]:8.1f} мс, успешно {result["ok"]}, ошибок {result["errors"]}')
+
+
+if __name__ == '__main__':
+    main()
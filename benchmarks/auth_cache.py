@@ -0,0 +1,81 @@
+"""
+Бенчмарк аутентификации по JWT с кэшем пользователей.
+
+Сравнивает GET /api/shared_images/ (list) и GET /api/shared_images/{id}/
+(retrieve) с JWTAuthentication (пользователь загружается из БД на каждый
+запрос) и CachedJWTAuthentication (пользователь из кэша): количество
+запросов к БД на запрос (по счетчикам MetricsMiddleware) и время ответа. Запросы идут с настоящим токеном
+в заголовке Authorization. Данные создаются в отдельной тестовой БД.
+
+Запуск:
+    python -m benchmarks.auth_cache [--images 20 --repeat 200]
+"""
+import argparse
+
+from benchmarks._django import measure, setup_django, test_database
+
+
+def seed(images_count):
+    from django.contrib.auth.models import User
+
+    from avatars.models import SharedImage
+
+    user = User.objects.create_user(username='bench', password='bench')
+    SharedImage.objects.bulk_create(
+        [SharedImage(owner=user, image=f'shared/bench/{i}.jpg') for i in range(images_count)],
+        batch_size=1000
+    )
+    return user
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--images', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    setup_django()
+    from unittest import mock
+
+    from django.conf import settings
+    from django.core.cache import caches
+    from rest_framework.test import APIClient
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+
+    from avatars import metrics
+    from avatars.authentication import CachedJWTAuthentication
+    from avatars.models import SharedImage
+    from avatars.views import SharedImageViewSet
+
+    with test_database():
+        user = seed(args.images)
+        image = SharedImage.objects.filter(owner=user).first()
+        client = APIClient()
+        response = client.post('/api/token/', {'username': 'bench', 'password': 'bench'}, format='json')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access"]}')
+        print(f'Кэш пользователей: {caches[settings.AUTH_USER_CACHE_ALIAS].__class__.__name__}')
+
+        cases = (
+            ('list', 'sharedimage-list', '/api/shared_images/'),
+            ('retrieve', 'sharedimage-detail', f'/api/shared_images/{image.pk}/'),
+        )
+        for action, endpoint, url in cases:
+            def get():
+                response = client.get(url)
+                assert response.status_code == 200, response.status_code
+
+            for label, authentication in (('JWT', JWTAuthentication), ('JWT + кэш', CachedJWTAuthentication)):
+                with mock.patch.object(SharedImageViewSet, 'authentication_classes', [authentication]):
+                    get()  # прогрев: соединение с БД, запись в кэше
+                    # Запросы к БД считает MetricsMiddleware (по маршруту)
+                    metrics.clear()
+                    result = measure(get, repeat=args.repeat)
+                queries = metrics.registry.get_sample_value(
+                    'avatars_db_queries_per_request_sum', {'endpoint': endpoint}
+                ) / args.repeat
+                print(f'{action:>8}, {label:>9}: {queries:.1f} запросов к БД, '
+                      f'медиана {result["median_ms"]:6.2f} мс, p95 {result["p95_ms"]:6.2f} мс')
+
+
+if __name__ == '__main__':
+    main()
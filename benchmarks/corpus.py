@@ -0,0 +1,93 @@
+"""
+Детерминированный набор тестовых изображений для бенчмарков.
+
+Изображение строится из псевдослучайного шума (random.Random с фиксированным
+зерном), растянутого до нужного размера и смешанного с градиентом: получается
+картинка с плавными переходами и деталями, похожая на фото, и одинаковая
+при каждом запуске. Байты файлов совпадают, пока не меняется сборка
+Pillow (libjpeg, zlib), поэтому в результаты пишется их SHA-256.
+"""
+import hashlib
+import os
+import random
+from io import BytesIO
+
+from PIL import Image
+
+SIZES = (64, 256, 1024, 2048, 4000, 8000)
+# jpeg - фото; png - RGB без прозрачности; palette - PNG с палитрой (режим P);
+# rgba - PNG с альфа-каналом; exif - портретный JPEG, повернутый тегом Orientation
+KINDS = ('jpeg', 'png', 'palette', 'rgba', 'exif')
+
+_TILE = 64
+_EXIF_ORIENTATION = 0x0112
+
+
+def get_dimensions(size):
+    """Ширина и высота кадра 4:3 с длинной стороной `size`."""
+    return size, max(1, size * 3 // 4)
+
+
+def make_pixels(size, seed=0, mode='RGB'):
+    width, height = get_dimensions(size)
+    rng = random.Random(f'{seed}:{size}:{mode}')
+    channels = len(mode)
+    tile = Image.frombytes(mode, (_TILE, _TILE), rng.randbytes(_TILE * _TILE * channels))
+    noise = tile.resize((width, height), Image.BICUBIC)
+    gradient = Image.linear_gradient('L').resize((width, height)).convert(mode)
+    return Image.blend(noise, gradient, 0.4)
+
+
+def make_image(kind, size, seed=0):
+    """
+    Файл вида `kind` (см. KINDS) с длинной стороной `size`.
+
+    :return: Байты файла.
+    """
+    buffer = BytesIO()
+    if kind == 'jpeg':
+        make_pixels(size, seed).save(buffer, format='JPEG', quality=90)
+    elif kind == 'png':
+        make_pixels(size, seed).save(buffer, format='PNG', compress_level=1)
+    elif kind == 'palette':
+        make_pixels(size, seed).quantize(colors=64, method=Image.Quantize.FASTOCTREE).save(buffer, format='PNG', compress_level=1)
+    elif kind == 'rgba':
+        make_pixels(size, seed, mode='RGBA').save(buffer, format='PNG', compress_level=1)
+    elif kind == 'exif':
+        # Пиксели лежат "на боку", как у снимка с телефона: 6 - повернуть на 90° по часовой
+        pil_img = make_pixels(size, seed).transpose(Image.Transpose.ROTATE_90)
+        exif = Image.Exif()
+        exif[_EXIF_ORIENTATION] = 6
+        pil_img.save(buffer, format='JPEG', quality=90, exif=exif.tobytes())
+    else:
+        raise ValueError(f'Неизвестный вид изображения: {kind}')
+    return buffer.getvalue()
+
+
+def get_case_name(kind, size):
+    return f'{kind}-{size}'
+
+
+def write_corpus(directory, sizes=SIZES, kinds=KINDS, seed=0):
+    """
+    Записывает набор в каталог `directory`.
+
+    :return: Список словарей с полями name, kind, size, path, bytes, sha256.
+    """
+    cases = []
+    for size in sizes:
+        for kind in kinds:
+            data = make_image(kind, size, seed)
+            name = get_case_name(kind, size)
+            path = os.path.join(directory, name)
+            with open(path, 'wb') as f:
+                f.write(data)
+            cases.append({
+                'name': name,
+                'kind': kind,
+                'size': size,
+                'path': path,
+                'bytes': len(data),
+                'sha256': hashlib.sha256(data).hexdigest(),
+            })
+    return cases
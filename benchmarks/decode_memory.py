@@ -0,0 +1,107 @@
+"""
+Бенчмарк памяти и CPU при обработке крупного аватара.
+
+Сравнивает полное декодирование (прежний конвейер: Image.open -> crop ->
+encode полноразмерного квадрата) с уменьшенным декодированием prepare_avatar
+(draft/reduce) и кодированием основного файла и копий, как в воркере. Каждый вариант запускается в отдельном процессе, чтобы пиковый
+RSS одного не влиял на другой.
+
+Запуск:
+    python -m benchmarks.decode_memory [--width 6000 --height 4000 --max-size 1024]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+
+def make_source(path, width, height):
+    """Создает детерминированный JPEG с шумом, похожий на фото с камеры."""
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    gradient = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    Image.blend(noise, gradient, 0.7).save(path, format='JPEG', quality=85)
+
+
+def run_mode(mode, path, max_size):
+    """Выполняет обработку в текущем процессе и возвращает метрики."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    from avatars.utils import (
+        convert_to_rgb,
+        crop_to_square,
+        encode_image,
+        prepare_avatar,
+    )
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cpu_before = time.process_time()
+    with open(path, 'rb') as f:
+        if mode == 'full':
+            pil_img = convert_to_rgb(crop_to_square(Image.open(f)))
+            encode_image(pil_img)
+        else:
+            pil_img, renditions = prepare_avatar(f, sizes=(32, 64, 128, 256, 512), max_size=max_size)
+            for image in (pil_img, *renditions.values()):
+                encode_image(convert_to_rgb(image))
+    return {
+        'mode': mode,
+        # ru_maxrss в Linux измеряется в килобайтах
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'rss_growth_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024,
+        'cpu_seconds': time.process_time() - cpu_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--width', type=int, default=6000)
+    parser.add_argument('--height', type=int, default=4000)
+    parser.add_argument('--max-size', type=int, default=1024, help='Максимальная сторона аватара.')
+    parser.add_argument('--child', choices=['make', 'full', 'draft'], help=argparse.SUPPRESS)
+    parser.add_argument('--source', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'make':
+        make_source(args.source, args.width, args.height)
+        return
+    if args.child:
+        print(json.dumps(run_mode(args.child, args.source, args.max_size)))
+        return
+
+    command = [sys.executable, '-m', 'benchmarks.decode_memory']
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source.jpg')
+        # Исходник тоже создается в дочернем процессе: пиковый RSS наследуется
+        # при fork, и генерация не должна искажать замеры
+        subprocess.check_call(
+            command + ['--child', 'make', '--source', source,
+                       '--width', str(args.width), '--height', str(args.height)]
+        )
+        print(f'Исходник: {args.width}x{args.height}, {os.path.getsize(source) / 1024 / 1024:.1f} МБ')
+
+        results = []
+        for mode in ('full', 'draft'):
+            output = subprocess.check_output(
+                command + ['--child', mode, '--source', source, '--max-size', str(args.max_size)]
+            )
+            results.append(json.loads(output))
+
+    for result in results:
+        print(
+            f"{result['mode']:>6}: прирост RSS {result['rss_growth_mb']:7.1f} МБ, "
+            f"пик {result['peak_rss_mb']:7.1f} МБ, CPU {result['cpu_seconds']:.2f} с"
+        )
+    full, draft = results
+    print(
+        f"Экономия: память x{full['rss_growth_mb'] / max(draft['rss_growth_mb'], 0.1):.1f}, "
+        f"CPU x{full['cpu_seconds'] / max(draft['cpu_seconds'], 0.001):.1f}"
+    )
+
+
+if __name__ == '__main__':
+    main()
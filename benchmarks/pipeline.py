@@ -0,0 +1,365 @@
+"""
+Бенчмарк конвейера обработки изображений на детерминированном наборе
+(benchmarks.corpus): размеры от 64 до 8000 px, JPEG, PNG, PNG с палитрой,
+RGBA и JPEG с поворотом по EXIF.
+
+Что измеряется:
+- время этапов (медиана по --repeat запускам) прежнего конвейера
+  (decode, crop, convert, encode) и текущего prepare_avatar
+  (decode с обрезкой через draft/reduce, resize копий, convert, encode
+  в основной формат);
+- прирост пикового RSS: каждый случай выполняется в отдельном процессе,
+  как в benchmarks.decode_memory;
+- время и размер результата для вариантов кодировщика: JPEG с optimize=True
+  против обычного и прогрессивного, PNG с optimize против compress_level,
+  WebP с method 4 и 6;
+- пропускная способность API через тестовый клиент Django: загрузка
+  POST /api/shared_images/, обработка очереди и чтение
+  GET /api/shared_images/{id}/ (отдельная тестовая БД, файлы во временном каталоге).
+
+Результаты пишутся в JSON (--output). С --baseline они сравниваются с
+сохраненными: при ухудшении больше --tolerance команда завершается с кодом 1.
+
+Запуск:
+    python -m benchmarks.pipeline --output results.json \\
+        [--sizes 64 1024 8000 --kinds jpeg rgba --repeat 5 --api-requests 50]
+    python -m benchmarks.pipeline --baseline baseline.json --output results.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from io import BytesIO
+
+from PIL import Image
+
+from benchmarks import corpus
+
+ENCODER_VARIANTS = (
+    ('JPEG', 'baseline', {'quality': 85}),
+    ('JPEG', 'optimize', {'quality': 85, 'optimize': True}),
+    ('JPEG', 'progressive', {'quality': 85, 'progressive': True}),
+    ('JPEG', 'optimize+progressive', {'quality': 85, 'optimize': True, 'progressive': True}),
+    ('PNG', 'compress_level=6', {'compress_level': 6}),
+    ('PNG', 'optimize', {'optimize': True}),
+    ('WEBP', 'method=4', {'quality': 80, 'method': 4}),
+    ('WEBP', 'method=6', {'quality': 80, 'method': 6}),
+)
+
+# Изменения меньше этих абсолютных величин не считаются ухудшением:
+# время маленьких изображений измеряется долями миллисекунды и шумит
+NOISE_FLOOR = {'_ms': 1.0, '_mb': 2.0, '_bytes': 64}
+
+
+class StageTimer:
+    """Накапливает время этапов по запускам."""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+
+    @contextmanager
+    def __call__(self, stage):
+        started = time.perf_counter()
+        yield
+        self.timings[stage].append((time.perf_counter() - started) * 1000)
+
+    def get_results(self):
+        results = {f'{stage}_ms': statistics.median(values) for stage, values in self.timings.items()}
+        results['total_ms'] = statistics.median(map(sum, zip(*self.timings.values())))
+        return results
+
+
+def get_peak_rss_mb():
+    # ru_maxrss в Linux - в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_legacy(path, timer):
+    """Прежний конвейер: полное декодирование, обрезка, конвертация, JPEG."""
+    from avatars.utils import convert_to_rgb, crop_to_square, encode_image
+
+    with open(path, 'rb') as f:
+        with timer('decode'):
+            pil_img = Image.open(f)
+            pil_img.load()
+        with timer('crop'):
+            pil_img = crop_to_square(pil_img)
+        with timer('convert'):
+            pil_img = convert_to_rgb(pil_img)
+        with timer('encode'):
+            encode_image(pil_img)
+
+
+def run_current(path, timer):
+    """
+    Текущий конвейер (prepare_avatar и кодирование) по этапам. Обрезка выполняется при декодировании
+    (draft/reduce по области квадрата), поэтому отдельного этапа crop нет.
+
+    :return: Основное изображение до конвертации (для сравнения кодировщиков).
+    """
+    from django.conf import settings
+
+    from avatars.utils import (
+        convert_to_rgb,
+        decode_image,
+        encode_image,
+        fit_to_size,
+        render_renditions,
+    )
+
+    sizes = settings.IMAGE_RENDITION_SIZES['avatar']
+    max_size = settings.IMAGE_MAX_DIMENSIONS['avatar']
+    with open(path, 'rb') as f:
+        with timer('decode'):
+            pil_img = decode_image(f, target_size=max((max_size, *sizes)), square=True)
+        with timer('resize'):
+            pil_img = fit_to_size(pil_img, max_size)
+            renditions = render_renditions(pil_img, sizes)
+        with timer('convert'):
+            images = [convert_to_rgb(image) for image in (pil_img, *renditions.values())]
+        with timer('encode'):
+            for image in images:
+                encode_image(image)
+    return pil_img
+
+
+def compare_encoders(pil_img, repeat):
+    """Время и размер результата для каждого варианта из ENCODER_VARIANTS."""
+    from avatars.formats import ALPHA_FORMATS
+    from avatars.utils import convert_to_rgb
+
+    Image.init()
+    results = {}
+    for image_format, label, options in ENCODER_VARIANTS:
+        if image_format not in Image.SAVE:
+            continue
+        image = pil_img if image_format in ALPHA_FORMATS else convert_to_rgb(pil_img)
+        timings = []
+        for _ in range(repeat):
+            buffer = BytesIO()
+            started = time.perf_counter()
+            image.save(buffer, format=image_format, **options)
+            timings.append((time.perf_counter() - started) * 1000)
+        results[f'{image_format}.{label}'] = {
+            'ms': statistics.median(timings),
+            'bytes': buffer.tell(),
+        }
+    return results
+
+
+def run_case(path, pipeline, repeat):
+    """Выполняется в дочернем процессе: замеры одного файла одним конвейером."""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    # Модули загружаются до замера памяти
+    importlib.import_module('avatars.utils')
+
+    rss_before = get_peak_rss_mb()
+    timer = StageTimer()
+    for _ in range(repeat):
+        if pipeline == 'legacy':
+            run_legacy(path, timer)
+        else:
+            pil_img = run_current(path, timer)
+    result = {**timer.get_results(), 'peak_rss_mb': get_peak_rss_mb() - rss_before}
+    if pipeline == 'current':
+        result['encoders'] = compare_encoders(pil_img, repeat)
+    return result
+
+
+def run_api(data, requests_count):
+    """
+    Пропускная способность API через тестовый клиент Django в отдельной
+    тестовой БД; хранилище полей подменяется каталогом во временной папке,
+    чтобы результат не зависел от S3.
+    """
+    from benchmarks._django import setup_django, test_database
+
+    setup_django()
+    from unittest import mock
+
+    from django.contrib.auth.models import User
+    from django.core.files.storage import FileSystemStorage
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from rest_framework.test import APIClient
+
+    from avatars.models import Profile, SharedImage
+    from avatars.tasks import run_pending_tasks
+
+    with ExitStack() as stack:
+        media = stack.enter_context(tempfile.TemporaryDirectory())
+        storage = FileSystemStorage(location=media)
+        for model, field_name in ((Profile, 'avatar'), (SharedImage, 'image')):
+            stack.enter_context(mock.patch.object(model._meta.get_field(field_name), 'storage', storage))
+        stack.enter_context(test_database())
+
+        user = User.objects.create_user(username='bench', password='bench')
+        client = APIClient()
+        client.force_authenticate(user)
+
+        def upload(number):
+            # Хвост после конца JPEG Pillow не читает, а SHA-256 файла меняется:
+            # иначе повторные загрузки совпали бы с первой и не обрабатывались (дедупликация)
+            image = SimpleUploadedFile('bench.jpg', data + str(number).encode(), content_type='image/jpeg')
+            response = client.post('/api/shared_images/', {'image': image, 'caption': 'bench'}, format='multipart')
+            assert response.status_code == 201, response.status_code
+            return response.data['id']
+
+        started = time.perf_counter()
+        ids = [upload(number) for number in range(requests_count)]
+        upload_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        processed = run_pending_tasks()
+        process_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for pk in ids:
+            response = client.get(f'/api/shared_images/{pk}/')
+            assert response.status_code == 200, response.status_code
+        read_seconds = time.perf_counter() - started
+
+    return {
+        'api.upload_rps': requests_count / upload_seconds,
+        # При IMAGE_TASKS_EAGER файлы обработаны при загрузке и очередь пуста
+        'api.process_rps': processed / process_seconds if processed else 0,
+        'api.read_rps': requests_count / read_seconds,
+    }
+
+
+def get_environment():
+    from PIL import features
+
+    return {
+        'python': platform.python_version(),
+        'pillow': Image.__version__,
+        'libjpeg': features.version('jpg'),
+        'zlib': features.version('zlib'),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def compare_results(baseline, current, tolerance):
+    """
+    Метрики, ухудшившиеся больше чем на долю `tolerance`: для времени,
+    памяти и размера - рост, для пропускной способности (_rps) - падение.
+    Изменения меньше NOISE_FLOOR не учитываются.
+
+    :return: Список кортежей (метрика, было, стало).
+    """
+    regressions = []
+    for name, old in baseline['metrics'].items():
+        new = current['metrics'].get(name)
+        if new is None or not old:
+            continue
+        floor = next((value for suffix, value in NOISE_FLOOR.items() if name.endswith(suffix)), 0)
+        if abs(new - old) < floor:
+            continue
+        change = (new - old) / old
+        if name.endswith('_rps'):
+            change = -change
+        if change > tolerance:
+            regressions.append((name, old, new))
+    return regressions
+
+
+def collect_metrics(cases, args):
+    command = [sys.executable, '-m', 'benchmarks.pipeline', '--repeat', str(args.repeat)]
+    metrics = {}
+    for case in cases:
+        line = [f'{case["name"]:>13}']
+        for pipeline in ('legacy', 'current'):
+            output = subprocess.check_output(
+                command + ['--child', pipeline, '--source', case['path']]
+            )
+            result = json.loads(output)
+            for name, value in result.pop('encoders', {}).items():
+                metrics[f'encode.{case["name"]}.{name}_ms'] = value['ms']
+                metrics[f'encode.{case["name"]}.{name}_bytes'] = value['bytes']
+            for name, value in result.items():
+                metrics[f'pipeline.{pipeline}.{case["name"]}.{name}'] = value
+            stages = ' '.join(
+                f'{name[:-3]} {value:.1f}' for name, value in result.items()
+                if name.endswith('_ms') and name != 'total_ms'
+            )
+            line.append(
+                f'{pipeline}: {result["total_ms"]:8.1f} мс ({stages}), RSS +{result["peak_rss_mb"]:.0f} МБ'
+            )
+        print(' | '.join(line))
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=corpus.SIZES)
+    parser.add_argument('--kinds', nargs='+', choices=corpus.KINDS, default=corpus.KINDS)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--api-requests', type=int, default=50, help='0 - не измерять API.')
+    parser.add_argument('--api-size', type=int, default=1024, help='Длинная сторона JPEG для API.')
+    parser.add_argument('--output', help='Файл для результатов в JSON.')
+    parser.add_argument('--baseline', help='JSON предыдущего запуска для сравнения.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Допустимое ухудшение, доля.')
+    parser.add_argument('--child', choices=('make', 'legacy', 'current'), help=argparse.SUPPRESS)
+    parser.add_argument('--source', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == 'make':
+        print(json.dumps(corpus.write_corpus(args.source, args.sizes, args.kinds, args.seed)))
+        return
+    if args.child:
+        print(json.dumps(run_case(args.source, args.child, args.repeat)))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Набор создается в дочернем процессе: пиковый RSS наследуется
+        # дочерними процессами и исказил бы замеры памяти
+        output = subprocess.check_output(
+            [sys.executable, '-m', 'benchmarks.pipeline', '--child', 'make', '--source', tmp,
+             '--seed', str(args.seed), '--sizes', *map(str, args.sizes), '--kinds', *args.kinds]
+        )
+        cases = json.loads(output)
+        print(f'Набор: {len(cases)} файлов, {sum(case["bytes"] for case in cases) / 1024 / 1024:.1f} МБ')
+        metrics = collect_metrics(cases, args)
+
+    if args.api_requests:
+        api = run_api(corpus.make_image('jpeg', args.api_size, args.seed), args.api_requests)
+        print('API: ' + ', '.join(f'{name[4:-4]} {value:.1f} запр./с' for name, value in api.items()))
+        metrics.update(api)
+
+    results = {
+        'environment': get_environment(),
+        'corpus': {case['name']: case['sha256'] for case in cases},
+        'metrics': metrics,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        changed = [name for name, sha256 in baseline.get('corpus', {}).items()
+                   if results['corpus'].get(name, sha256) != sha256]
+        if changed:
+            print(f'Внимание: файлы набора отличаются от базовых ({", ".join(changed)}), '
+                  f'проверьте версии Pillow и libjpeg')
+        regressions = compare_results(baseline, results, args.tolerance)
+        for name, old, new in regressions:
+            print(f'Ухудшение {name}: {old:.2f} -> {new:.2f}')
+        if regressions:
+            sys.exit(1)
+        print(f'Ухудшений больше {args.tolerance:.0%} нет')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Бенчмарк списка общих изображений в закрытом хранилище.
+
+Сравнивает время ответа GET /api/shared_images/ при подписи каждой ссылки
+(S3Boto3Storage с querystring_auth) и с кэшем подписей PrivateS3Storage:
+первый запрос в окне (подписи в кэше нет) и повторные. Подпись считается
+локально, обращений к S3 нет. Данные создаются в отдельной тестовой БД.
+
+Запуск:
+    python -m benchmarks.signed_urls [--images 200 --renditions 2 --page-size 100]
+"""
+import argparse
+
+from benchmarks._django import measure, setup_django, test_database
+
+CREDENTIALS = {
+    'access_key': 'bench',
+    'secret_key': 'bench',
+    'bucket_name': 'bench',
+    'region_name': 'us-east-1',
+}
+
+
+def seed(images_count, renditions):
+    from django.contrib.auth.models import User
+
+    from avatars.models import SharedImage
+
+    user = User.objects.create_user(username='bench', password='bench')
+    sizes = [str(320 * (i + 1)) for i in range(renditions)]
+    SharedImage.objects.bulk_create(
+        [
+            SharedImage(
+                owner=user,
+                image=f'shared/bench/{i}.jpg',
+                image_renditions={size: f'shared/bench/{i}_{size}.jpg' for size in sizes}
+            )
+            for i in range(images_count)
+        ],
+        batch_size=1000
+    )
+    return user
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--renditions', type=int, default=2, help='Превью на изображение.')
+    parser.add_argument('--page-size', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+
+    setup_django()
+    from unittest import mock
+
+    from django.conf import settings
+    from django.core.cache import caches
+    from rest_framework.test import APIClient
+    from storages.backends.s3boto3 import S3Boto3Storage
+
+    from avatars.models import SharedImage
+    from avatars.storage import PrivateS3Storage
+
+    field = SharedImage._meta.get_field('image')
+    shared_cache = caches[settings.SIGNED_URL_CACHE_ALIAS]
+
+    with test_database():
+        user = seed(args.images, args.renditions)
+        client = APIClient()
+        client.force_authenticate(user)
+        urls_per_page = min(args.images, args.page_size) * (args.renditions + 1)
+        print(f'Страница: {args.page_size} изображений, {urls_per_page} ссылок '
+              f'(общий кэш: {shared_cache.__class__.__name__})')
+
+        def get_page():
+            response = client.get('/api/shared_images/', {'page_size': args.page_size})
+            assert response.status_code == 200, response.status_code
+
+        uncached = S3Boto3Storage(querystring_auth=True, **CREDENTIALS)
+        cached = PrivateS3Storage(**CREDENTIALS)
+
+        def cold_page():
+            # Новое окно: подписи нет ни в памяти процесса, ни в общем кэше
+            cached.signed_urls.clear()
+            shared_cache.clear()
+            get_page()
+
+        cases = (
+            ('без кэша', uncached, get_page),
+            ('кэш, новое окно', cached, cold_page),
+            ('кэш, повторно', cached, get_page),
+        )
+        for label, storage, func in cases:
+            with mock.patch.object(field, 'storage', storage):
+                get_page()  # прогрев: клиент boto3, соединение с БД
+                result = measure(func, repeat=args.repeat)
+            print(f'{label:>16}: медиана {result["median_ms"]:7.2f} мс, '
+                  f'p95 {result["p95_ms"]:7.2f} мс на страницу')
+        print(f'Подписано кэшем: {cached.signed_urls.stats}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""
+Бенчмарк запроса видимости SharedImageViewSet на засеянных данных.
+
+Сравнивает прежний запрос (OR по JOIN с промежуточной таблицей + DISTINCT)
+с текущим get_queryset (UNION ALL по индексам внутри IN) для первой страницы
+списка. Данные создаются в отдельной тестовой БД.
+
+Запуск:
+    python -m benchmarks.visibility_query [--users 2000 --images 50000 --shares 20]
+"""
+import argparse
+import random
+
+from benchmarks._django import measure, setup_django, test_database
+
+
+def seed(users_count, images_count, shares_per_image):
+    from django.contrib.auth.models import User
+
+    from avatars.models import SharedImage, SharedImageRecipient
+
+    rng = random.Random(42)
+    User.objects.bulk_create(
+        [User(username=f'bench{i}', password='!') for i in range(users_count)],
+        batch_size=1000
+    )
+    user_ids = list(User.objects.values_list('id', flat=True))
+    SharedImage.objects.bulk_create(
+        [
+            SharedImage(owner_id=rng.choice(user_ids), image=f'shared/bench/{i}.jpg')
+            for i in range(images_count)
+        ],
+        batch_size=1000
+    )
+    image_ids = SharedImage.objects.values_list('id', flat=True).iterator()
+    rows = []
+    for image_id in image_ids:
+        for user_id in rng.sample(user_ids, shares_per_image):
+            rows.append(SharedImageRecipient(sharedimage_id=image_id, user_id=user_id))
+        if len(rows) >= 10000:
+            SharedImageRecipient.objects.bulk_create(rows, ignore_conflicts=True)
+            rows = []
+    SharedImageRecipient.objects.bulk_create(rows, ignore_conflicts=True)
+    return user_ids
+
+
+def legacy_queryset(user):
+    from django.db.models import Q
+
+    from avatars.models import SharedImage
+
+    return SharedImage.objects.filter(Q(owner=user) | Q(shared_with=user)).distinct()
+
+
+def current_queryset(user):
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from avatars.views import SharedImageViewSet
+
+    view = SharedImageViewSet(action='list', format_kwarg=None)
+    view.request = Request(APIRequestFactory().get('/api/shared_images/'))
+    view.request.user = user
+    return view.get_queryset()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--images', type=int, default=50000)
+    parser.add_argument('--shares', type=int, default=20, help='Получателей на изображение.')
+    parser.add_argument('--page-size', type=int, default=50)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.db import connection
+
+    with test_database():
+        print(f'Засев: {args.users} пользователей, {args.images} изображений, '
+              f'{args.images * args.shares} связей ({connection.vendor})...')
+        user_ids = seed(args.users, args.images, args.shares)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        users = list(User.objects.filter(id__in=random.Random(7).sample(user_ids, 10)))
+
+        for label, build in (('OR + DISTINCT', legacy_queryset), ('UNION ALL', current_queryset)):
+            def first_pages():
+                for user in users:
+                    list(build(user).order_by('-created_at', '-id')[:args.page_size])
+
+            result = measure(first_pages, repeat=10)
+            print(f'{label:>14}: медиана {result["median_ms"] / len(users):7.2f} мс, '
+                  f'p95 {result["p95_ms"] / len(users):7.2f} мс на запрос')
+
+        print('\nПлан текущего запроса:')
+        print(current_queryset(users[0]).order_by('-created_at', '-id')[:args.page_size].explain())
+
+
+if __name__ == '__main__':
+    main()
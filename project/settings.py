@@ -44,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'avatars.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -77,7 +78,7 @@ WSGI_APPLICATION = 'project.wsgi.application'
 # Конфигурация для Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'avatars.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -89,8 +90,132 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=60),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    # В токен кладется версия (хэш пароля): после смены пароля старые токены
+    # отклоняются, по ней же проверяются записи кэша пользователей
+    "CHECK_REVOKE_TOKEN": True,
+    "TOKEN_OBTAIN_SERIALIZER": "avatars.authentication.TokenObtainPairSerializer",
 }
 
+# Обработчики загрузки ограничивают размер файла и считают SHA-256
+# по мере приема данных (используется для дедупликации изображений)
+FILE_UPLOAD_HANDLERS = [
+    'avatars.uploadhandlers.FileSizeLimitUploadHandler',
+    'avatars.uploadhandlers.HashingMemoryFileUploadHandler',
+    'avatars.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+# Файлы больше этого размера сразу пишутся во временный файл на диске
+FILE_UPLOAD_MAX_MEMORY_SIZE = 256 * 1024
+
+# Запись обработанных изображений в хранилище: размер части multipart-загрузки
+# в S3 и объем, который держится в памяти для остальных хранилищ
+IMAGE_UPLOAD_PART_SIZE = 8 * 1024 * 1024
+IMAGE_STREAM_SPOOL_SIZE = 1024 * 1024
+
+# Фоновая обработка изображений (очередь ImageTask)
+# В режиме EAGER задачи выполняются сразу в процессе, без отдельного воркера
+IMAGE_TASKS_EAGER = bool(int(os.environ.get('IMAGE_TASKS_EAGER', default=0)))
+IMAGE_TASKS_CONCURRENCY = int(os.environ.get('IMAGE_TASKS_CONCURRENCY', default=4))
+IMAGE_TASKS_MAX_ATTEMPTS = 3
+IMAGE_TASKS_RETRY_DELAY = 30  # секунды, удваивается с каждой попыткой
+# Задача, которая числится выполняемой дольше этого (в секундах), считается
+# брошенной упавшим воркером и возвращается в очередь. Должно быть больше
+# времени обработки самого большого изображения.
+IMAGE_TASKS_LEASE_TIMEOUT = int(os.environ.get('IMAGE_TASKS_LEASE_TIMEOUT', default=600))
+
+# Размеры (длинная сторона в пикселях) уменьшенных копий для каждого вида изображений
+IMAGE_RENDITION_SIZES = {
+    'avatar': (32, 64, 128, 256, 512),
+    'shared_image': (320, 1280),
+}
+# Максимальная сторона основного обработанного файла: исходники большего
+# размера декодируются сразу в уменьшенном виде
+IMAGE_MAX_DIMENSIONS = {
+    'avatar': 1024,
+    'shared_image': 2560,
+}
+
+# Параметры кодировщиков для каждого формата: качество и затраты CPU
+# против размера файла (WebP method 0-6 и AVIF speed 0-10 - чем медленнее,
+# тем меньше файл)
+IMAGE_ENCODER_PRESETS = {
+    'JPEG': {'quality': 85, 'optimize': True},
+    'WEBP': {'quality': 80, 'method': 4},
+    'AVIF': {'quality': 60, 'speed': 6},
+}
+# Форматы, которые сохраняются рядом с основным JPEG. AVIF кодируется,
+# только если его поддерживает сборка Pillow
+IMAGE_EXTRA_FORMATS = ('WEBP', 'AVIF')
+
+# Изображения произвольного размера (/api/images/...): запрошенный размер
+# округляется вверх до одного из этих, результаты хранятся в дисковом кэше
+IMAGE_SERVE_SIZES = (32, 48, 64, 72, 96, 128, 160, 192, 256, 320, 384, 512, 640, 768, 1024, 1280)
+IMAGE_SERVE_CACHE_DIR = os.environ.get('IMAGE_SERVE_CACHE_DIR', os.path.join(BASE_DIR, 'var', 'image-cache'))
+IMAGE_SERVE_CACHE_MAX_BYTES = int(os.environ.get('IMAGE_SERVE_CACHE_MAX_BYTES', default=512 * 1024 * 1024))
+IMAGE_SERVE_MAX_AGE = 3600  # секунды, Cache-Control ответов
+
+# Асинхронные представления (avatars.async_views): размер пула потоков для
+# обращений к хранилищу, Pillow и разбора загрузок
+ASYNC_IO_THREADS = int(os.environ.get('ASYNC_IO_THREADS', default=32))
+
+# Массовое создание пользователей через /api/users/import/: импорт идет
+# внутри запроса, поэтому строк немного, а пароли хэшируются в потоках
+# (большие файлы - командой import_users с пулом процессов)
+USER_IMPORT_API_MAX_ROWS = 200
+USER_IMPORT_API_THREADS = int(os.environ.get('USER_IMPORT_API_THREADS', default=os.cpu_count() or 1))
+
+# Метрики Prometheus (/api/metrics/, avatars.metrics): замеры этапов обработки,
+# хранилища и запросов к БД. Без METRICS_TOKEN метрики доступны только при DEBUG
+METRICS_ENABLED = bool(int(os.environ.get('METRICS_ENABLED', default=1)))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Несколько процессов на хосте (gunicorn/uvicorn с --workers): задайте
+# переменную окружения PROMETHEUS_MULTIPROC_DIR (до запуска процессов),
+# иначе каждый процесс отдает только свои значения. Каталог нужно очищать
+# при запуске сервера
+
+# Массовое предоставление доступа (/api/shared_images/share/): максимум пар
+# "изображение - получатель" в одном запросе и размер пачки INSERT
+SHARED_IMAGE_BULK_MAX_PAIRS = 100_000
+SHARED_IMAGE_BULK_BATCH_SIZE = 1000
+
+# Ограничения для загружаемых изображений, проверяются по заголовку файла
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_MAX_DIMENSION = 10_000
+IMAGE_MAX_FRAMES = 1
+
+# Кэш: Redis (или совместимый сервер) по REDIS_URL, без него - память процесса
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Кэш готовых ответов API профилей (см. avatars.cache)
+PROFILE_CACHE_ALIAS = 'default'
+PROFILE_CACHE_TIMEOUT = 300  # секунды
+# Доля запросов, учитываемых в статистике попаданий (/api/profiles/cache-stats/); 0 - не считать
+PROFILE_CACHE_STATS_SAMPLE_RATE = float(os.environ.get('PROFILE_CACHE_STATS_SAMPLE_RATE', default=0.01))
+
+# Кэш пользователей для аутентификации по JWT (avatars.authentication)
+AUTH_USER_CACHE_ALIAS = 'default'
+AUTH_USER_CACHE_TIMEOUT = 60  # секунды
+
+# Подписанные ссылки на закрытые файлы (avatars.storage.PrivateS3Storage).
+# Ссылка подписывается один раз на окно и действует до его конца плюс
+# AWS_QUERYSTRING_EXPIRE секунд
+AWS_QUERYSTRING_EXPIRE = 3600
+SIGNED_URL_CACHE_WINDOW = 600
+SIGNED_URL_CACHE_ALIAS = 'default'
+SIGNED_URL_LOCAL_CACHE_SIZE = 10_000
+
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
@@ -113,14 +238,23 @@ if USE_S3:
     AWS_SECRET_ACCESS_KEY = os.environ.get('AWS_SECRET_ACCESS_KEY')
     AWS_STORAGE_BUCKET_NAME = os.environ.get('AWS_STORAGE_BUCKET_NAME')
     AWS_S3_ENDPOINT_URL = os.environ.get('AWS_S3_ENDPOINT_URL')
-    AWS_S3_OBJECT_PARAMETERS = {'CacheControl': 'max-age=86400'}
+    # Файлы в хранилище не перезаписываются: обработанные называются по хэшу
+    # содержимого, исходники - случайным UUID. Поэтому их можно кэшировать навсегда
+    AWS_S3_OBJECT_PARAMETERS = {'CacheControl': 'public, max-age=31536000, immutable'}
     AWS_LOCATION = 'static' # Префикс для статики (если нужно)
     AWS_DEFAULT_ACL = 'public-read'
 
     # Указываем, что для медиа файлов нужно использовать S3
     STORAGES = {
         "default": {
-            "BACKEND": "storages.backends.s3boto3.S3Boto3Storage",
+            "BACKEND": "avatars.storage.S3Storage",
+        },
+        # Общие изображения: закрытые объекты, доступ по подписанным ссылкам
+        "private": {
+            "BACKEND": "avatars.storage.PrivateS3Storage",
+            "OPTIONS": {
+                "object_parameters": {'CacheControl': 'private, max-age=31536000, immutable'},
+            },
         },
         "staticfiles": {
             "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
@@ -130,6 +264,14 @@ else:
     # Обычные настройки для локальной разработки без S3
     MEDIA_URL = '/media/'
     MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+    STORAGES = {
+        "default": {
+            "BACKEND": "avatars.storage.LocalStorage",
+        },
+        "staticfiles": {
+            "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
+        },
+    }
 
 
 # Password validation
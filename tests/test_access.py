@@ -0,0 +1,65 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from avatars.access import can_view_image
+from avatars.models import SharedImage
+from avatars.permissions import CanViewOrOwnerCanModify
+
+
+class ImageAccessTestCase(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='p')
+        self.recipient = User.objects.create_user(username='recipient', password='p')
+        self.stranger = User.objects.create_user(username='stranger', password='p')
+        self.image = SharedImage.objects.create(owner=self.owner, image='shared/a.jpg')
+        self.image.shared_with.add(self.recipient)
+
+    def make_request(self, user, method='get'):
+        request = Request(getattr(APIRequestFactory(), method)('/api/shared_images/'))
+        request.user = user
+        return request
+
+    def test_owner_short_circuits_without_queries(self):
+        permission = CanViewOrOwnerCanModify()
+        with self.assertNumQueries(0):
+            self.assertTrue(permission.has_object_permission(self.make_request(self.owner), None, self.image))
+            self.assertTrue(permission.has_object_permission(
+                self.make_request(self.owner, 'delete'), None, self.image
+            ))
+
+    def test_recipient_check_is_single_exists_and_memoized(self):
+        request = self.make_request(self.recipient)
+        with self.assertNumQueries(1):
+            self.assertTrue(can_view_image(request, self.image))
+            self.assertTrue(can_view_image(request, self.image))
+
+    def test_stranger_is_denied(self):
+        self.assertFalse(can_view_image(self.make_request(self.stranger), self.image))
+        self.assertFalse(CanViewOrOwnerCanModify().has_object_permission(
+            self.make_request(self.recipient, 'delete'), None, self.image
+        ))
+
+    def test_retrieve_cost_does_not_depend_on_recipient_count(self):
+        client = APIClient()
+        client.force_authenticate(self.recipient)
+
+        with self.assertNumQueries(2) as context:
+            client.get(f'/api/shared_images/{self.image.pk}/')
+        queries_with_one = len(context.captured_queries)
+
+        extra = [User(username=f'extra{i}', password='!') for i in range(50)]
+        User.objects.bulk_create(extra)
+        self.image.shared_with.add(*User.objects.filter(username__startswith='extra'))
+
+        with self.assertNumQueries(queries_with_one):
+            response = client.get(f'/api/shared_images/{self.image.pk}/')
+        # Список получателей раскрывается только владельцу
+        self.assertNotIn('shared_with', response.data)
+
+    def test_owner_sees_recipients(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.get(f'/api/shared_images/{self.image.pk}/')
+        self.assertEqual(response.data['shared_with'], [self.recipient.pk])
@@ -0,0 +1,64 @@
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from avatars.models import Profile, SharedImage
+
+
+class AdminChangeListTestCase(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='p')
+        self.client.force_login(self.admin)
+        self.recipient = User.objects.create_user(username='recipient', password='p')
+
+    def create_images(self, count):
+        for _ in range(count):
+            user = User.objects.create_user(username=f'owner{User.objects.count()}', password='p')
+            image = SharedImage.objects.create(
+                owner=user,
+                image=f'shared/{user.pk}/image.jpg',
+                image_renditions={'320': f'shared/{user.pk}/image_320.jpg'}
+            )
+            image.shared_with.set([self.recipient, self.admin])
+            Profile.objects.filter(user=user).update(
+                avatar=f'avatars/{user.pk}/avatar.jpg',
+                avatar_renditions={'32': f'avatars/{user.pk}/avatar_32.jpg', '64': f'avatars/{user.pk}/avatar_64.jpg'}
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        for url in ('/admin/avatars/sharedimage/', '/admin/avatars/profile/'):
+            with self.subTest(url=url):
+                self.create_images(2)
+                small, _ = self.count_queries(url)
+                self.create_images(8)
+                large, _ = self.count_queries(url)
+                SharedImage.objects.all().delete()
+                self.assertEqual(small, large)
+
+    def test_share_counts_and_thumbnails(self):
+        self.create_images(1)
+        _, response = self.count_queries('/admin/avatars/sharedimage/')
+        content = response.content.decode()
+
+        self.assertIn('<td class="field-share_count">2</td>', content)
+        self.assertIn('image_320.jpg', content)
+        self.assertNotIn('image.jpg"', content)
+
+        _, response = self.count_queries('/admin/avatars/profile/')
+        self.assertIn('avatar_64.jpg', response.content.decode())
+
+    def test_str_does_not_query(self):
+        self.create_images(1)
+        image = SharedImage.objects.get()
+        with self.assertNumQueries(0):
+            self.assertEqual(str(image), f'Image {image.pk} by #{image.owner_id}')
+        image = SharedImage.objects.select_related('owner').get()
+        with self.assertNumQueries(0):
+            self.assertEqual(str(image), f'Image {image.pk} by {image.owner.username}')
@@ -7,7 +7,8 @@ from PIL import Image
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from avatars.models import Profile
+from avatars.models import ProcessingStatus, Profile
+from avatars.tasks import run_pending_tasks
 
 
 class ProfileAPITestCase(TestCase):
@@ -41,7 +42,32 @@ class ProfileAPITestCase(TestCase):
         """Анонимный пользователь может просматривать список профилей."""
         response = self.client.get('/api/profiles/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_list_profiles_cursor_pagination(self):
+        """Список отдается страницами, переход - по курсору из ссылки next."""
+        for i in range(3, 6):
+            User.objects.create_user(username=f'user{i}', password='password123')
+
+        response = self.client.get('/api/profiles/', {'page_size': 2})
+        first_page = [item['id'] for item in response.data['results']]
+        self.assertEqual(len(first_page), 2)
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get(response.data['next'])
+        second_page = [item['id'] for item in response.data['results']]
+        self.assertEqual(len(second_page), 2)
+        self.assertLess(max(first_page), min(second_page))
+
+    def test_list_profiles_is_slim_unless_expanded(self):
+        """В списке пользователь отдается по ID, вложенный объект - по ?expand=user."""
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/profiles/')
+        item = response.data['results'][0]
+        self.assertEqual(item['user'], self.user1.id)
+
+        response = self.client.get('/api/profiles/', {'expand': 'user'})
+        self.assertEqual(response.data['results'][0]['user']['username'], 'user1')
 
     def test_retrieve_profile_unauthenticated(self):
         """Анонимный пользователь может просматривать конкретный профиль."""
@@ -63,12 +89,17 @@ class ProfileAPITestCase(TestCase):
                                      data,
                                      format='multipart')
 
-        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Аватар принят и поставлен в очередь на обработку
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
         self.assertEqual(response.data['name'], 'New Name 1')
         self.assertIsNotNone(response.data['avatar'])
+        self.assertEqual(response.data['avatar_status'], ProcessingStatus.PENDING)
+
+        run_pending_tasks()
 
         # Проверяем, что аватар обработан и сохранен в папку пользователя
         profile = Profile.objects.get(id=profile1_id)
+        self.assertEqual(profile.avatar_status, ProcessingStatus.READY)
         self.assertIn(f'user_{self.user1.id}', profile.avatar.name)
 
         # Проверяем, что изображение стало квадратным
@@ -76,6 +107,20 @@ class ProfileAPITestCase(TestCase):
             img = Image.open(f)
             self.assertEqual(img.width, img.height)
 
+    def test_profile_exposes_rendition_urls(self):
+        """В ответе есть словарь {размер: URL} уменьшенных копий аватара."""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token1}')
+        profile1_id = self.user1.profile.id
+        self.client.patch(f'/api/profiles/{profile1_id}/',
+                          {'avatar': self.test_image},
+                          format='multipart')
+        run_pending_tasks()
+
+        response = self.client.get(f'/api/profiles/{profile1_id}/')
+        renditions = response.data['avatar_renditions']
+        self.assertIn('64', renditions)
+        self.assertTrue(renditions['64'].startswith('http'))
+
     def test_update_other_user_profile_forbidden(self):
         """Пользователь не может обновить чужой профиль."""
         self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token1}')
@@ -0,0 +1,138 @@
+import tempfile
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from avatars.models import ImageTask, ProcessingStatus, Profile, SharedImage
+from avatars.tasks import run_pending_tasks
+
+from .test_processing import make_upload
+
+
+def auth_headers(user):
+    return {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'}
+
+
+class AsyncProfileTestCase(TestCase):
+    def setUp(self):
+        self.client = AsyncClient()
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.other = User.objects.create_user(username='user2', password='p')
+        self.profile = self.user.profile
+        self.url = f'/api/async/profiles/{self.profile.pk}/'
+
+    async def patch_avatar(self, user, upload):
+        return await self.client.patch(
+            self.url,
+            encode_multipart(BOUNDARY, {'avatar': upload}),
+            content_type=MULTIPART_CONTENT,
+            headers=auth_headers(user)
+        )
+
+    async def test_detail_is_served_with_etag(self):
+        response = await self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'user1')
+        self.assertIn('Last-Modified', response)
+
+        response = await self.client.get(self.url, headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_avatar_upload_is_stored_and_queued(self):
+        response = await self.patch_avatar(self.user, make_upload())
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.json()['avatar_status'], ProcessingStatus.PENDING)
+        profile = await Profile.objects.aget(pk=self.profile.pk)
+        task = await ImageTask.objects.aget()
+        self.assertEqual(task.source_name, profile.avatar.name)
+        self.assertTrue(profile.avatar.storage.exists(profile.avatar.name))
+
+        self.assertEqual(await sync_to_async(run_pending_tasks)(), 1)
+        profile = await Profile.objects.aget(pk=self.profile.pk)
+        self.assertEqual(profile.avatar_status, ProcessingStatus.READY)
+
+    async def test_duplicate_upload_reuses_processed_file(self):
+        await self.patch_avatar(self.user, make_upload())
+        await sync_to_async(run_pending_tasks)()
+
+        other_profile = await Profile.objects.aget(user=self.other)
+        self.url = f'/api/async/profiles/{other_profile.pk}/'
+        response = await self.patch_avatar(self.other, make_upload())
+
+        self.assertEqual(response.status_code, 200)
+        other_profile = await Profile.objects.aget(pk=other_profile.pk)
+        profile = await Profile.objects.aget(pk=self.profile.pk)
+        self.assertEqual(other_profile.avatar.name, profile.avatar.name)
+        self.assertEqual(await ImageTask.objects.acount(), 1)
+
+    async def test_only_owner_can_upload(self):
+        response = await self.patch_avatar(self.other, make_upload())
+        self.assertEqual(response.status_code, 403)
+
+        response = await self.client.patch(self.url, {'name': 'x'}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('WWW-Authenticate', response)
+
+    async def test_invalid_file_is_rejected(self):
+        response = await self.patch_avatar(self.user, make_upload(name='avatar.txt'))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('avatar', response.json())
+
+
+class AsyncSharedImageTestCase(TestCase):
+    def setUp(self):
+        self.client = AsyncClient()
+        self.owner = User.objects.create_user(username='owner', password='p')
+        self.recipient = User.objects.create_user(username='recipient', password='p')
+        self.stranger = User.objects.create_user(username='stranger', password='p')
+
+    async def test_upload_and_read(self):
+        response = await self.client.post(
+            '/api/async/shared_images/',
+            {'image': make_upload(size=(800, 600)), 'caption': 'Фото', 'shared_with': [self.recipient.pk]},
+            headers=auth_headers(self.owner)
+        )
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['image_status'], ProcessingStatus.PENDING)
+        self.assertEqual(data['shared_with'], [self.recipient.pk])
+        await sync_to_async(run_pending_tasks)()
+
+        url = f'/api/async/shared_images/{data["id"]}/'
+        response = await self.client.get(url, headers=auth_headers(self.stranger))
+        self.assertEqual(response.status_code, 404)
+
+        response = await self.client.get(url, headers=auth_headers(self.recipient))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['image_status'], ProcessingStatus.READY)
+        self.assertNotIn('shared_with', response.json())
+
+        headers = {**auth_headers(self.recipient), 'If-None-Match': response['ETag']}
+        response = await self.client.get(url, headers=headers)
+        self.assertEqual(response.status_code, 304)
+
+    async def test_image_is_required(self):
+        response = await self.client.post(
+            '/api/async/shared_images/', {'caption': 'x'}, headers=auth_headers(self.owner)
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(await SharedImage.objects.acount(), 0)
+
+    @override_settings(IMAGE_SERVE_SIZES=(72,), IMAGE_SERVE_CACHE_DIR=tempfile.mkdtemp())
+    async def test_transform_runs_in_executor(self):
+        image = await sync_to_async(SharedImage.objects.create)(
+            owner=self.owner, image=make_upload(size=(400, 200))
+        )
+        await sync_to_async(run_pending_tasks)()
+
+        url = f'/api/async/images/shared_image/{image.pk}/'
+        response = await self.client.get(url, {'size': 50})
+        self.assertEqual(response.status_code, 401)
+
+        response = await self.client.get(url, {'size': 50}, headers=auth_headers(self.owner))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
@@ -0,0 +1,87 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from avatars import authentication, metrics
+from avatars.models import SharedImage
+
+from .test_metrics import get_sample
+
+
+class CachedJWTAuthenticationTestCase(TestCase):
+    url = '/api/shared_images/'
+
+    def setUp(self):
+        cache.clear()
+        metrics.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='password123')
+        self.image = SharedImage.objects.create(owner=self.user, image='shared/1.jpg')
+        self.login()
+
+    def login(self, password='password123'):
+        response = self.client.post('/api/token/', {
+            'username': 'user1',
+            'password': password}, format='json')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {response.data["access"]}')
+        return response
+
+    def get_user_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [query['sql'] for query in queries if 'FROM "auth_user" WHERE' in query['sql']]
+
+    def test_user_is_cached_on_login(self):
+        self.assertEqual(self.get_user_queries(self.url), [])
+        self.assertEqual(self.get_user_queries(f'{self.url}{self.image.pk}/'), [])
+        self.assertEqual(get_sample('avatars_auth_user_cache_total', result='hit'), 2)
+
+    def test_user_is_cached_after_miss(self):
+        cache.clear()
+        self.assertEqual(len(self.get_user_queries(self.url)), 1)
+        self.assertEqual(self.get_user_queries(self.url), [])
+
+    def test_password_change_revokes_tokens(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.set_password('new-password')
+            self.user.save()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        self.login('new-password')
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_200_OK)
+
+    def test_deactivated_user_is_rejected(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_user_changes_are_visible(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_staff = True
+            self.user.save()
+
+        response = self.client.get('/api/profiles/cache-stats/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_user_is_invalidated_after_commit(self):
+        """Данные, закэшированные до фиксации транзакции, не переживают ее."""
+        stale = User.objects.get(pk=self.user.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.user.is_active = False
+                self.user.save()
+                # Параллельный запрос видит еще не измененную запись и кэширует ее
+                authentication.cache_user(stale)
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
@@ -0,0 +1,47 @@
+from io import BytesIO
+
+from django.test import SimpleTestCase
+from PIL import Image, ImageOps
+
+from benchmarks.corpus import make_image
+from benchmarks.pipeline import compare_results
+
+
+class CorpusTestCase(SimpleTestCase):
+    def test_images_are_deterministic(self):
+        for kind in ('jpeg', 'png', 'palette', 'rgba', 'exif'):
+            self.assertEqual(make_image(kind, 64), make_image(kind, 64), kind)
+        self.assertNotEqual(make_image('jpeg', 64), make_image('jpeg', 64, seed=1))
+
+    def test_kinds_have_expected_modes(self):
+        modes = {kind: Image.open(BytesIO(make_image(kind, 64))).mode for kind in ('png', 'palette', 'rgba')}
+        self.assertEqual(modes, {'png': 'RGB', 'palette': 'P', 'rgba': 'RGBA'})
+
+        pil_img = Image.open(BytesIO(make_image('exif', 64)))
+        self.assertEqual(pil_img.size, (48, 64))
+        self.assertEqual(ImageOps.exif_transpose(pil_img).size, (64, 48))
+
+
+class CompareResultsTestCase(SimpleTestCase):
+    def test_regressions_respect_direction_and_noise(self):
+        baseline = {'metrics': {
+            'pipeline.current.jpeg-1024.total_ms': 100.0,
+            'pipeline.current.jpeg-64.total_ms': 0.5,
+            'encode.jpeg-1024.JPEG.optimize_bytes': 90000,
+            'api.upload_rps': 50.0,
+            'api.read_rps': 100.0,
+        }}
+        current = {'metrics': {
+            'pipeline.current.jpeg-1024.total_ms': 140.0,
+            'pipeline.current.jpeg-64.total_ms': 0.9,
+            'encode.jpeg-1024.JPEG.optimize_bytes': 90010,
+            'api.upload_rps': 30.0,
+            'api.read_rps': 200.0,
+        }}
+
+        regressions = compare_results(baseline, current, tolerance=0.25)
+
+        self.assertEqual(
+            [name for name, _, _ in regressions],
+            ['pipeline.current.jpeg-1024.total_ms', 'api.upload_rps']
+        )
@@ -0,0 +1,119 @@
+import hashlib
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from PIL import Image
+from rest_framework.test import APIClient
+
+from avatars.models import (
+    ImageBlob,
+    ImageKind,
+    ImageTask,
+    ProcessingStatus,
+    SharedImage,
+)
+from avatars.tasks import run_pending_tasks
+
+
+def image_bytes(color='blue', size=(120, 80)):
+    buffer = BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class AvatarDeduplicationTestCase(TestCase):
+    def setUp(self):
+        self.profile1 = User.objects.create_user(username='user1', password='p').profile
+        self.profile2 = User.objects.create_user(username='user2', password='p').profile
+        self.content = image_bytes()
+
+    def upload(self, profile, content=None):
+        profile.avatar = SimpleUploadedFile('avatar.jpg', content or self.content)
+        profile.save()
+
+    def test_known_upload_skips_processing_and_storage(self):
+        self.upload(self.profile1)
+        run_pending_tasks()
+        self.profile1.refresh_from_db()
+
+        self.upload(self.profile2)
+
+        self.assertEqual(self.profile2.avatar_status, ProcessingStatus.READY)
+        self.assertEqual(self.profile2.avatar.name, self.profile1.avatar.name)
+        self.assertEqual(self.profile2.avatar_renditions, self.profile1.avatar_renditions)
+        self.assertEqual(ImageTask.objects.filter(object_id=self.profile2.pk).count(), 0)
+        blob = ImageBlob.objects.get()
+        self.assertEqual(blob.ref_count, 2)
+        self.assertEqual(blob.source_sha256, hashlib.sha256(self.content).hexdigest())
+
+    def test_parallel_uploads_share_one_blob(self):
+        """Если один исходник обработан дважды, лишняя копия удаляется."""
+        self.upload(self.profile1)
+        self.upload(self.profile2)
+        run_pending_tasks()
+
+        self.profile1.refresh_from_db()
+        self.profile2.refresh_from_db()
+        self.assertEqual(self.profile1.avatar.name, self.profile2.avatar.name)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 2)
+
+    def test_replacing_avatar_releases_blob(self):
+        self.upload(self.profile1)
+        run_pending_tasks()
+        self.profile1.refresh_from_db()
+        blob = ImageBlob.objects.get()
+        storage = self.profile1.avatar.storage
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(self.profile1, image_bytes('red'))
+
+        self.assertFalse(ImageBlob.objects.filter(pk=blob.pk).exists())
+        self.assertFalse(storage.exists(blob.name))
+
+
+class SharedImageDeduplicationTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.client.force_authenticate(self.user)
+        self.content = image_bytes()
+
+    def post_image(self):
+        upload = SimpleUploadedFile('shared.jpg', self.content, 'image/jpeg')
+        response = self.client.post('/api/shared_images/', {'image': upload}, format='multipart')
+        return SharedImage.objects.get(pk=response.data['id'])
+
+    def test_same_image_is_stored_once(self):
+        first = self.post_image()
+        run_pending_tasks()
+        first.refresh_from_db()
+        second = self.post_image()
+
+        self.assertEqual(second.image_status, ProcessingStatus.READY)
+        self.assertEqual(second.image_renditions, first.image_renditions)
+        self.assertFalse(ImageTask.objects.filter(object_id=second.pk, kind=ImageKind.SHARED_IMAGE).exists())
+        self.assertEqual(first.image.name, second.image.name)
+        blob = ImageBlob.objects.get(kind=ImageKind.SHARED_IMAGE)
+        self.assertEqual(blob.ref_count, 2)
+        # Хэш посчитан обработчиком загрузки по мере приема данных
+        self.assertEqual(blob.source_sha256, hashlib.sha256(self.content).hexdigest())
+
+    def test_file_removed_when_last_reference_deleted(self):
+        first = self.post_image()
+        second = self.post_image()
+        run_pending_tasks()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        storage = first.image.storage
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/shared_images/{first.pk}/')
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+        self.assertTrue(storage.exists(second.image.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/shared_images/{second.pk}/')
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(storage.exists(second.image.name))
@@ -0,0 +1,75 @@
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from avatars.models import ImageTask, Profile, SharedImage
+
+
+class DirtyFieldsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='p')
+
+    def test_loaded_instance_is_clean(self):
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(profile.get_dirty_fields(), set())
+
+        profile.name = 'Changed'
+        profile.avatar_renditions['64'] = 'avatars/x_64.jpg'
+        self.assertEqual(profile.get_dirty_fields(), {'name', 'avatar_renditions'})
+
+    def test_new_upload_marks_file_dirty(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.avatar = SimpleUploadedFile('a.jpg', b'data')
+        self.assertTrue(profile.is_field_dirty('avatar'))
+
+    def test_unsaved_instance_is_dirty(self):
+        image = SharedImage(owner=self.user, image='shared/a.jpg')
+        self.assertIn('image', image.get_dirty_fields())
+
+    def test_save_writes_only_changed_columns(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.name = 'Only name'
+        with CaptureQueriesContext(connection) as context:
+            profile.save()
+
+        self.assertEqual(len(context.captured_queries), 1)
+        sql = context.captured_queries[0]['sql']
+        self.assertTrue(sql.startswith('UPDATE'))
+        self.assertIn('"name"', sql)
+        self.assertNotIn('"avatar"', sql)
+        self.assertEqual(profile.get_dirty_fields(), set())
+
+    def test_fields_outside_update_fields_stay_dirty(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.name = 'Not saved yet'
+        profile.save(update_fields=['avatar_status'])
+        self.assertEqual(profile.get_dirty_fields(), {'name'})
+
+        profile.save()
+        self.assertEqual(Profile.objects.get(pk=profile.pk).name, 'Not saved yet')
+
+    def test_unchanged_save_is_noop(self):
+        profile = Profile.objects.get(user=self.user)
+        with self.assertNumQueries(0):
+            profile.save()
+
+    def test_refresh_from_db_resets_snapshot(self):
+        profile = Profile.objects.get(user=self.user)
+        Profile.objects.filter(pk=profile.pk).update(name='From DB')
+        profile.refresh_from_db()
+        self.assertEqual(profile.get_dirty_fields(), set())
+
+    def test_name_only_patch_does_not_reread_profile(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with CaptureQueriesContext(connection) as context:
+            response = client.patch(f'/api/profiles/{self.user.profile.id}/', {'name': 'New'}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        selects = [q['sql'] for q in context.captured_queries if q['sql'].startswith('SELECT')]
+        # Единственный SELECT - загрузка профиля в get_object()
+        self.assertEqual(len(selects), 1)
+        self.assertFalse(ImageTask.objects.exists())
@@ -0,0 +1,103 @@
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from avatars.formats import get_variant_path, negotiate_format
+from avatars.models import SharedImage
+from avatars.tasks import run_pending_tasks
+from avatars.utils import encode_image
+
+
+def transparent_png(size=(200, 100)):
+    image_bytes = BytesIO()
+    Image.new('RGBA', size, (255, 0, 0, 0)).save(image_bytes, format='PNG')
+    return SimpleUploadedFile('logo.png', image_bytes.getvalue(), content_type='image/png')
+
+
+class NegotiateFormatTestCase(TestCase):
+    def test_picks_most_compact_accepted_format(self):
+        accept = 'image/avif,image/webp,image/apng,image/*,*/*;q=0.8'
+        self.assertEqual(negotiate_format(accept, ['WEBP', 'AVIF']), 'AVIF')
+        self.assertEqual(negotiate_format(accept, ['WEBP']), 'WEBP')
+
+    def test_wildcard_does_not_imply_modern_formats(self):
+        self.assertEqual(negotiate_format('image/*,*/*;q=0.8', ['WEBP']), 'JPEG')
+        self.assertEqual(negotiate_format('', ['WEBP']), 'JPEG')
+
+    def test_zero_quality_excludes_format(self):
+        self.assertEqual(negotiate_format('image/webp;q=0', ['WEBP']), 'JPEG')
+
+    def test_variant_path(self):
+        self.assertEqual(get_variant_path('avatars/user_1/abc_64.jpg', 'WEBP'), 'avatars/user_1/abc_64.webp')
+
+
+class EncoderPresetTestCase(TestCase):
+    def test_preset_quality_is_applied(self):
+        pil_img = Image.effect_noise((256, 256), 64).convert('RGB')
+        with override_settings(IMAGE_ENCODER_PRESETS={'WEBP': {'quality': 90}}):
+            high = encode_image(pil_img, target_format='WEBP').getbuffer().nbytes
+        with override_settings(IMAGE_ENCODER_PRESETS={'WEBP': {'quality': 30}}):
+            low = encode_image(pil_img, target_format='WEBP').getbuffer().nbytes
+        self.assertLess(low, high)
+
+
+@override_settings(
+    IMAGE_EXTRA_FORMATS=('WEBP',),
+    IMAGE_RENDITION_SIZES={'avatar': (64,), 'shared_image': (64,)}
+)
+class FormatVariantsTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.client.force_authenticate(self.user)
+
+    def upload_shared_image(self):
+        image = SharedImage.objects.create(owner=self.user, image=transparent_png())
+        run_pending_tasks()
+        image.refresh_from_db()
+        return image
+
+    def test_worker_writes_variants_with_transparency(self):
+        image = self.upload_shared_image()
+        storage = image.image.storage
+
+        self.assertEqual(image.image_formats, ['WEBP'])
+        for name in [image.image.name, *image.image_renditions.values()]:
+            with storage.open(get_variant_path(name, 'WEBP')) as f:
+                variant = Image.open(f)
+                self.assertEqual(variant.format, 'WEBP')
+                self.assertEqual(variant.mode, 'RGBA')
+        with storage.open(image.image.name) as f:
+            self.assertEqual(Image.open(f).mode, 'RGB')
+
+    def test_redirect_follows_accept_header(self):
+        image = self.upload_shared_image()
+        url = f'/api/shared_images/{image.pk}/image/'
+
+        response = self.client.get(url, HTTP_ACCEPT='image/webp,*/*')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('.webp'))
+        self.assertIn('Accept', response['Vary'])
+
+        response = self.client.get(url, {'size': '64'}, HTTP_ACCEPT='image/jpeg')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('_64.jpg'))
+
+    def test_unknown_size_is_rejected(self):
+        image = self.upload_shared_image()
+        response = self.client.get(f'/api/shared_images/{image.pk}/image/', {'size': '13'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_profile_avatar_redirect_is_public(self):
+        profile = self.user.profile
+        profile.avatar = transparent_png()
+        profile.save()
+        run_pending_tasks()
+
+        response = APIClient().get(f'/api/profiles/{profile.pk}/avatar/', HTTP_ACCEPT='image/webp')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('.webp'))
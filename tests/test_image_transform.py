@@ -0,0 +1,169 @@
+import tempfile
+import threading
+from io import BytesIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from avatars import transform
+from avatars.models import SharedImage
+from avatars.tasks import run_pending_tasks
+from avatars.transform import DiskLRUCache, KeyedLock, pick_source, snap_size
+
+from .test_processing import make_upload
+
+
+class SnapSizeTestCase(TestCase):
+    @override_settings(IMAGE_SERVE_SIZES=(64, 72, 128))
+    def test_size_is_rounded_up_to_allowed(self):
+        self.assertEqual(snap_size(10), 64)
+        self.assertEqual(snap_size(72), 72)
+        self.assertEqual(snap_size(100), 128)
+        self.assertEqual(snap_size(5000), 128)
+
+    def test_smallest_sufficient_rendition_is_decoded(self):
+        renditions = {'64': 'a_64.jpg', '256': 'a_256.jpg'}
+        self.assertEqual(pick_source('a.jpg', renditions, 72), 'a_256.jpg')
+        self.assertEqual(pick_source('a.jpg', renditions, 300), 'a.jpg')
+
+
+class DiskLRUCacheTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = DiskLRUCache(self.directory.name, max_bytes=25)
+        cache.set('aa1', b'x' * 10)
+        cache.set('bb2', b'y' * 10)
+        cache.get('aa1')
+        cache.set('cc3', b'z' * 10)
+
+        self.assertEqual(cache.get('aa1'), b'x' * 10)
+        self.assertIsNone(cache.get('bb2'))
+        stats = cache.get_stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['bytes'], 20)
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+    def test_index_is_restored_from_disk(self):
+        DiskLRUCache(self.directory.name, max_bytes=100).set('aa1', b'x' * 10)
+        cache = DiskLRUCache(self.directory.name, max_bytes=100)
+        self.assertEqual(cache.get_stats()['bytes'], 10)
+        self.assertEqual(cache.get('aa1'), b'x' * 10)
+
+
+class KeyedLockTestCase(TestCase):
+    def test_concurrent_requests_transform_once(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        started = threading.Event()
+        calls = []
+
+        def slow_transform():
+            calls.append(1)
+            started.wait(1)
+            return b'result'
+
+        with override_settings(IMAGE_SERVE_CACHE_DIR=directory.name):
+            threads = [
+                threading.Thread(target=transform.get_or_transform, args=('key', slow_transform))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            started.set()
+            for thread in threads:
+                thread.join()
+            stats = transform.get_transform_cache().get_stats()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual((stats['misses'], stats['hits']), (1, 3))
+
+    def test_unused_locks_are_released(self):
+        locks = KeyedLock()
+        with locks('a'):
+            self.assertIn('a', locks.locks)
+        self.assertEqual(locks.locks, {})
+
+
+@override_settings(
+    IMAGE_EXTRA_FORMATS=('WEBP',),
+    IMAGE_RENDITION_SIZES={'avatar': (64, 256), 'shared_image': (320,)},
+    IMAGE_SERVE_SIZES=(72, 500)
+)
+class ImageTransformViewTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings_override = override_settings(IMAGE_SERVE_CACHE_DIR=directory.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='p')
+        self.profile = self.owner.profile
+        self.profile.avatar = make_upload(size=(600, 400))
+        self.profile.save()
+        run_pending_tasks()
+
+    def get_avatar(self, size, **headers):
+        return self.client.get(f'/api/images/avatar/{self.profile.pk}/', {'size': size}, **headers)
+
+    def test_avatar_is_resized_to_snapped_size(self):
+        response = self.get_avatar(70)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('public', response['Cache-Control'])
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (72, 72))
+
+    def test_second_request_is_served_from_cache(self):
+        with mock.patch('avatars.transform.transform_image', wraps=transform.transform_image) as render:
+            self.get_avatar(72)
+            response = self.get_avatar(72)
+
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(response.status_code, 200)
+        stats = transform.get_transform_cache().get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_format_follows_accept_and_etag(self):
+        response = self.get_avatar(72, HTTP_ACCEPT='image/webp')
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('Accept', response['Vary'])
+
+        response = self.get_avatar(72, HTTP_ACCEPT='image/webp', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_size_is_required(self):
+        response = self.client.get(f'/api/images/avatar/{self.profile.pk}/')
+        self.assertEqual(response.status_code, 400)
+
+    def test_shared_image_requires_access(self):
+        image = SharedImage.objects.create(owner=self.owner, image=make_upload(size=(1000, 500)))
+        run_pending_tasks()
+        url = f'/api/images/shared_image/{image.pk}/'
+        stranger = User.objects.create_user(username='stranger', password='p')
+
+        self.client.force_authenticate(stranger)
+        self.assertEqual(self.client.get(url, {'size': 500}).status_code, 404)
+
+        self.client.force_authenticate(self.owner)
+        response = self.client.get(url, {'size': 500})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(Image.open(BytesIO(response.content)).size, (500, 250))
+
+    def test_stats_are_for_admins(self):
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.client.get('/api/images/cache-stats/').status_code, 403)
+
+        admin = User.objects.create_superuser(username='admin', password='p')
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/images/cache-stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('evictions', response.data)
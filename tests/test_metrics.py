@@ -0,0 +1,121 @@
+import os
+import subprocess
+import sys
+import tempfile
+import urllib.request
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import AsyncClient, SimpleTestCase, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from avatars import metrics
+from avatars.models import Profile
+from avatars.storage import LocalStorage
+from avatars.tasks import run_pending_tasks
+
+from .test_async_views import auth_headers
+from .test_processing import make_upload
+
+
+def get_sample(name, **labels):
+    """Значение ряда метрики в текущем процессе (0, если ряда еще нет)."""
+    return metrics.registry.get_sample_value(name, labels) or 0
+
+
+class SizeBucketTestCase(SimpleTestCase):
+    def test_size_bucket(self):
+        self.assertEqual(metrics.get_size_bucket((200, 100)), '256')
+        self.assertEqual(metrics.get_size_bucket((1000, 3000)), '4096')
+        self.assertEqual(metrics.get_size_bucket((8000, 6000)), '+Inf')
+
+
+@override_settings(METRICS_TOKEN='secret')
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        metrics.clear()
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.client = APIClient()
+
+    def test_request_and_queries_are_labeled_by_route(self):
+        self.client.force_authenticate(self.user)
+        self.client.get(f'/api/profiles/{self.user.profile.pk}/')
+        self.client.get(f'/api/profiles/{self.user.profile.pk}/')
+
+        self.assertEqual(get_sample(
+            'avatars_http_request_duration_seconds_count', endpoint='profile-detail', method='GET'
+        ), 2)
+        self.assertEqual(get_sample(
+            'avatars_http_requests_total', endpoint='profile-detail', method='GET', status='2xx'
+        ), 2)
+        self.assertGreater(get_sample('avatars_db_queries_per_request_sum', endpoint='profile-detail'), 0)
+
+    async def test_async_views_are_measured(self):
+        client = AsyncClient()
+        profile = await Profile.objects.aget(user__username='user1')
+        await client.get(f'/api/async/profiles/{profile.pk}/', headers=auth_headers(self.user))
+
+        self.assertEqual(get_sample(
+            'avatars_http_request_duration_seconds_count', endpoint='async-profile-detail', method='GET'
+        ), 1)
+        self.assertGreater(get_sample('avatars_db_queries_per_request_sum', endpoint='async-profile-detail'), 0)
+
+    def test_image_stages_and_storage_are_measured(self):
+        storage = LocalStorage(location=tempfile.mkdtemp())
+        with mock.patch.object(Profile._meta.get_field('avatar'), 'storage', storage):
+            profile = self.user.profile
+            profile.avatar = make_upload(size=(600, 400))
+            profile.save()
+            run_pending_tasks()
+
+        stage = 'avatars_image_stage_duration_seconds_count'
+        self.assertEqual(get_sample(stage, stage='decode', format='JPEG', size='1024', endpoint='task:avatar'), 1)
+        self.assertEqual(get_sample(stage, stage='resize', format='', size='1024', endpoint='task:avatar'), 1)
+        self.assertGreater(get_sample(stage, stage='encode', format='JPEG', size='256', endpoint='task:avatar'), 0)
+        storage = 'avatars_storage_duration_seconds_count'
+        self.assertEqual(get_sample(storage, operation='open', endpoint='task:avatar'), 1)
+        self.assertGreater(get_sample(storage, operation='save', endpoint='background'), 0)
+        self.assertEqual(get_sample('avatars_image_task_duration_seconds_count', kind='avatar', status='done'), 1)
+
+    def test_endpoint_requires_token(self):
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
+
+        self.client.force_authenticate(None)
+        response = self.client.get(
+            '/api/metrics/', HTTP_AUTHORIZATION='Bearer secret', HTTP_ACCEPT='application/openmetrics-text'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        self.assertIn('# TYPE avatars_http_request_duration_seconds histogram', response.content.decode())
+
+    def test_values_of_other_processes_are_summed(self):
+        """Значения воркеров (отдельных процессов) суммируются через PROMETHEUS_MULTIPROC_DIR."""
+        code = (
+            'import django; django.setup(); from avatars import metrics; '
+            "metrics.AUTH_USER_CACHE.labels(result='hit').inc(); "
+            "metrics.REQUEST_SECONDS.labels(endpoint='profile-list', method='GET').observe(0.2)"
+        )
+        with tempfile.TemporaryDirectory() as directory:
+            env = {**os.environ, 'PROMETHEUS_MULTIPROC_DIR': directory, 'PYTHONPATH': os.pathsep.join(sys.path)}
+            for _ in range(2):
+                subprocess.run([sys.executable, '-c', code], env=env, check=True)
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': directory}):
+                text = metrics.render().decode()
+
+        self.assertIn('avatars_auth_user_cache_total{result="hit"} 2.0\n', text)
+        self.assertIn(
+            'avatars_http_request_duration_seconds_count{endpoint="profile-list",method="GET"} 2.0\n', text
+        )
+
+    def test_worker_http_server(self):
+        server = metrics.start_http_server(0, '127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        request = urllib.request.Request(
+            f'http://127.0.0.1:{server.server_port}/metrics', headers={'Authorization': 'Bearer secret'}
+        )
+        with urllib.request.urlopen(request) as response:
+            self.assertIn('avatars_image_stage_duration_seconds', response.read().decode())
@@ -0,0 +1,189 @@
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from avatars.models import ImageBlob, ImageKind, ImageTask, Profile, SharedImage
+from avatars.orphans import OrphanCollector, get_main_candidates
+from avatars.storage import LocalStorage, delete_many, iter_file_pages
+from avatars.tasks import run_pending_tasks
+
+from .test_processing import make_upload
+from .test_storage import FakeS3Client
+
+OLD = time.time() - 3 * 24 * 3600
+
+
+class SupersededFilesTestCase(TestCase):
+    def setUp(self):
+        self.storage = LocalStorage(location=tempfile.mkdtemp())
+        for field in (Profile._meta.get_field('avatar'), SharedImage._meta.get_field('image')):
+            patcher = mock.patch.object(field, 'storage', self.storage)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='user1', password='p')
+
+    def test_replaced_pending_avatar_is_deleted_on_commit(self):
+        profile = self.user.profile
+        profile.avatar = make_upload(color='red')
+        profile.save()
+        source_name = profile.avatar.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.avatar = make_upload(color='green')
+            profile.save()
+
+        self.assertFalse(self.storage.exists(source_name))
+        self.assertTrue(self.storage.exists(profile.avatar.name))
+
+    def test_shared_file_is_kept_while_referenced(self):
+        profile = self.user.profile
+        profile.avatar = make_upload()
+        profile.save()
+        run_pending_tasks()
+        profile.refresh_from_db()
+        blob = ImageBlob.objects.get()
+        # Другой исходник с тем же результатом (см. ImageBlob.delete_files)
+        ImageBlob.objects.create(
+            kind=ImageKind.AVATAR, source_sha256='other', name=blob.name, ref_count=1
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.avatar = None
+            profile.save()
+
+        self.assertTrue(self.storage.exists(blob.name))
+
+    def test_deleted_image_without_blob_is_removed_on_commit(self):
+        name = self.storage.save('shared/owner_1/legacy.jpg', ContentFile(b'data'))
+        rendition = self.storage.save('shared/owner_1/legacy_320.jpg', ContentFile(b'data'))
+        image = SharedImage.objects.create(owner=self.user, image=name, image_renditions={'320': rendition})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+        self.assertFalse(self.storage.exists(name))
+        self.assertFalse(self.storage.exists(rendition))
+
+
+class OrphanCollectorTestCase(TestCase):
+    def setUp(self):
+        self.storage = LocalStorage(location=tempfile.mkdtemp())
+        patcher = mock.patch.object(Profile._meta.get_field('avatar'), 'storage', self.storage)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.profile = User.objects.create_user(username='user1', password='p').profile
+
+    def save(self, name, age=OLD):
+        name = self.storage.save(name, ContentFile(b'data'))
+        os.utime(self.storage.path(name), (age, age))
+        return name
+
+    def test_main_candidates(self):
+        self.assertEqual(
+            get_main_candidates('avatars/user_1/abc_64.webp'),
+            {'avatars/user_1/abc_64.webp', 'avatars/user_1/abc.jpg'}
+        )
+
+    def test_only_old_unreferenced_files_are_deleted(self):
+        referenced = [
+            self.save('avatars/user_1/abc.jpg'),
+            self.save('avatars/user_1/abc_64.jpg'),
+            self.save('avatars/user_1/abc_64.webp'),
+        ]
+        Profile.objects.filter(pk=self.profile.pk).update(
+            avatar=referenced[0], avatar_renditions={'64': referenced[1]}, avatar_formats=['WEBP']
+        )
+        queued = self.save('avatars/user_2/source.png')
+        ImageTask.objects.create(kind=ImageKind.AVATAR, object_id=0, source_name=queued)
+        orphans = [
+            self.save('avatars/user_1/old.jpg'),
+            self.save('avatars/user_1/old_64.jpg'),
+            # Копия, которой нет в записи (например, после смены размеров)
+            self.save('avatars/user_1/abc_128.jpg'),
+        ]
+        recent = self.save('avatars/user_3/uploading.jpg', age=time.time())
+
+        stats = OrphanCollector(page_size=2, chunk_size=2, dry_run=True).collect(ImageKind.AVATAR)
+        self.assertEqual((stats['listed'], stats['orphaned'], stats['deleted']), (8, 3, 0))
+        self.assertTrue(all(self.storage.exists(name) for name in orphans))
+
+        out = StringIO()
+        call_command('collect_orphan_files', '--kind', 'avatar', '--page-size', '2', stdout=out)
+
+        self.assertIn('удалено 3', out.getvalue())
+        self.assertFalse(any(self.storage.exists(name) for name in orphans))
+        self.assertTrue(all(self.storage.exists(name) for name in [*referenced, queued, recent]))
+
+
+class S3ListingTestCase(TestCase):
+    def setUp(self):
+        self.client = FakeS3Client()
+        modified = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        for i in range(5):
+            self.client.objects[f'media/avatars/{i}.jpg'] = (b'data', {})
+        self.client.objects['media/shared/0.jpg'] = (b'data', {'ACL': 'public-read'})
+        self.client.objects['media/shared/0.webp'] = (b'data', {'ACL': 'public-read'})
+
+        def list_objects_v2(Bucket, Prefix, MaxKeys, ContinuationToken=None):
+            keys = sorted(key for key in self.client.objects if key.startswith(Prefix))
+            start = int(ContinuationToken or 0)
+            page = keys[start:start + MaxKeys]
+            truncated = start + MaxKeys < len(keys)
+            return {
+                'Contents': [{'Key': key, 'LastModified': modified, 'Size': 4} for key in page],
+                'IsTruncated': truncated,
+                'NextContinuationToken': str(start + MaxKeys) if truncated else None,
+            }
+
+        def delete_objects(Bucket, Delete):
+            self.client.calls.append('delete_objects')
+            for item in Delete['Objects']:
+                self.client.objects.pop(item['Key'])
+            return {}
+
+        self.client.list_objects_v2 = list_objects_v2
+        self.client.delete_objects = delete_objects
+        self.storage = S3Boto3Storage(access_key='key', secret_key='secret', bucket_name='bucket', location='media')
+        bucket = SimpleNamespace(name='bucket', meta=SimpleNamespace(client=self.client))
+        patcher = mock.patch.object(S3Boto3Storage, 'bucket', new_callable=mock.PropertyMock, return_value=bucket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_listing_is_paginated(self):
+        pages = list(iter_file_pages(self.storage, 'avatars/', page_size=2))
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        self.assertEqual(pages[0][0][0], 'avatars/0.jpg')
+
+    def test_delete_many_uses_batches(self):
+        names = [f'avatars/{i}.jpg' for i in range(5)]
+        with mock.patch('avatars.storage.S3_MAX_DELETE_KEYS', 2):
+            self.assertEqual(delete_many(self.storage, names), [])
+
+        self.assertEqual(self.client.calls.count('delete_objects'), 3)
+        self.assertEqual(list(self.client.objects), ['media/shared/0.jpg', 'media/shared/0.webp'])
+
+    def test_make_shared_images_private(self):
+        out = StringIO()
+        with mock.patch(
+            'avatars.management.commands.make_shared_images_private.get_shared_image_storage',
+            return_value=self.storage
+        ):
+            call_command('make_shared_images_private', '--page-size', '1', stdout=out)
+
+        self.assertEqual(self.client.calls.count('put_object_acl'), 2)
+        for key in ('media/shared/0.jpg', 'media/shared/0.webp'):
+            self.assertEqual(self.client.objects[key][1], {'ACL': 'private'})
+        # Аватары остаются публичными
+        self.assertEqual(self.client.objects['media/avatars/0.jpg'][1], {})
+        self.assertIn('закрыто 2 файлов, ошибок 0', out.getvalue())
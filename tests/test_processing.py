@@ -0,0 +1,359 @@
+import os
+import signal
+from datetime import timedelta
+from io import BytesIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from avatars.models import (
+    ImageBlob,
+    ImageKind,
+    ImageTask,
+    ProcessingStatus,
+    SharedImage,
+    get_outputs_hash,
+)
+from avatars.tasks import WorkerPool, run_pending_tasks
+from avatars.utils import decode_image, prepare_avatar, prepare_shared_image
+
+
+def make_upload(name='avatar.jpg', size=(300, 200), color='green', format='JPEG'):
+    image_bytes = BytesIO()
+    Image.new('RGB', size, color).save(image_bytes, format=format)
+    return SimpleUploadedFile(name, image_bytes.getvalue(), content_type=f'image/{format.lower()}')
+
+
+class ImageTaskQueueTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.profile = self.user.profile
+
+    def test_avatar_upload_is_queued_not_processed_inline(self):
+        """Сохранение профиля только ставит задачу в очередь."""
+        self.profile.avatar = make_upload()
+        self.profile.save()
+
+        self.assertEqual(self.profile.avatar_status, ProcessingStatus.PENDING)
+        task = ImageTask.objects.get()
+        self.assertEqual(task.kind, ImageKind.AVATAR)
+        self.assertEqual(task.source_name, self.profile.avatar.name)
+
+    def test_worker_swaps_in_processed_file(self):
+        """Воркер обрабатывает файл, подменяет его и удаляет исходник."""
+        self.profile.avatar = make_upload()
+        self.profile.save()
+        raw_name = self.profile.avatar.name
+
+        self.assertEqual(run_pending_tasks(), 1)
+
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_status, ProcessingStatus.READY)
+        self.assertNotEqual(self.profile.avatar.name, raw_name)
+        self.assertFalse(self.profile.avatar.storage.exists(raw_name))
+        with self.profile.avatar.open() as f:
+            img = Image.open(f)
+            self.assertEqual(img.width, img.height)
+        self.assertEqual(ImageTask.objects.get().status, ImageTask.Status.DONE)
+
+    def test_name_only_save_does_not_enqueue(self):
+        self.profile.name = 'Another name'
+        self.profile.save()
+        self.assertFalse(ImageTask.objects.exists())
+
+    def test_new_upload_cancels_pending_task(self):
+        self.profile.avatar = make_upload()
+        self.profile.save()
+        self.profile.avatar = make_upload(color='red')
+        self.profile.save()
+
+        statuses = set(ImageTask.objects.values_list('status', flat=True))
+        self.assertEqual(statuses, {ImageTask.Status.CANCELLED, ImageTask.Status.PENDING})
+
+    def test_clearing_pending_avatar(self):
+        self.profile.avatar = make_upload()
+        self.profile.save()
+
+        self.profile.avatar = None
+        self.profile.save()
+
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_status, ProcessingStatus.READY)
+        self.assertFalse(self.profile.avatar)
+        self.assertEqual(ImageTask.objects.count(), 1)
+        run_pending_tasks()
+        self.profile.refresh_from_db()
+        self.assertFalse(self.profile.avatar)
+
+    def test_clearing_failed_avatar(self):
+        self.profile.avatar = SimpleUploadedFile('broken.jpg', b'not an image')
+        self.profile.save()
+        run_pending_tasks()
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_status, ProcessingStatus.FAILED)
+
+        self.profile.avatar = None
+        self.profile.save()
+
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_status, ProcessingStatus.READY)
+        self.assertEqual((self.profile.avatar_renditions, self.profile.avatar_formats), ({}, []))
+
+    def test_transient_error_is_retried_then_fails(self):
+        self.profile.avatar = make_upload()
+        self.profile.save()
+
+        with mock.patch('avatars.tasks.prepare_avatar', side_effect=OSError('S3 недоступен')):
+            run_pending_tasks()
+            task = ImageTask.objects.get()
+            self.assertEqual(task.status, ImageTask.Status.PENDING)
+            self.assertEqual(task.attempts, 1)
+            self.assertIn('S3 недоступен', task.last_error)
+
+            # Следующие попытки выполняем сразу, не дожидаясь задержки
+            for _ in range(task.max_attempts - 1):
+                ImageTask.objects.update(run_after=task.created_at)
+                WorkerPool(concurrency=1).run_once()
+
+        task.refresh_from_db()
+        self.profile.refresh_from_db()
+        self.assertEqual(task.status, ImageTask.Status.FAILED)
+        self.assertEqual(self.profile.avatar_status, ProcessingStatus.FAILED)
+
+    def test_broken_file_fails_without_retry(self):
+        self.profile.avatar = SimpleUploadedFile('broken.jpg', b'not an image')
+        self.profile.save()
+
+        run_pending_tasks()
+
+        task = ImageTask.objects.get()
+        self.assertEqual(task.status, ImageTask.Status.FAILED)
+        self.assertEqual(task.attempts, 1)
+
+    def expire_running(self, attempts):
+        ImageTask.objects.update(
+            status=ImageTask.Status.RUNNING,
+            attempts=attempts,
+            updated_at=timezone.now() - timedelta(seconds=settings.IMAGE_TASKS_LEASE_TIMEOUT + 1)
+        )
+
+    def test_task_of_crashed_worker_is_requeued(self):
+        self.profile.avatar = make_upload()
+        self.profile.save()
+        self.expire_running(attempts=1)
+
+        self.assertEqual(run_pending_tasks(), 1)
+
+        task = ImageTask.objects.get()
+        self.assertEqual((task.status, task.attempts), (ImageTask.Status.DONE, 2))
+
+    def test_expired_task_without_attempts_fails(self):
+        self.profile.avatar = make_upload()
+        self.profile.save()
+        self.expire_running(attempts=settings.IMAGE_TASKS_MAX_ATTEMPTS)
+
+        self.assertEqual(run_pending_tasks(), 0)
+
+        self.profile.refresh_from_db()
+        self.assertEqual(ImageTask.objects.get().status, ImageTask.Status.FAILED)
+        self.assertEqual(self.profile.avatar_status, ProcessingStatus.FAILED)
+
+    def test_sigterm_finishes_current_batch(self):
+        self.profile.avatar = make_upload()
+        self.profile.save()
+        pool = WorkerPool(concurrency=1)
+
+        def run_once():
+            os.kill(os.getpid(), signal.SIGTERM)
+            return WorkerPool.run_once(pool)
+
+        with mock.patch.object(pool, 'run_once', side_effect=run_once):
+            pool.run_forever(poll_interval=0)
+
+        self.assertEqual(ImageTask.objects.get().status, ImageTask.Status.DONE)
+        self.assertNotEqual(signal.getsignal(signal.SIGTERM), pool.stop)
+
+    @override_settings(IMAGE_TASKS_EAGER=True)
+    def test_eager_mode_processes_in_process(self):
+        self.profile.avatar = make_upload()
+        self.profile.save()
+
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_status, ProcessingStatus.READY)
+        self.assertEqual(ImageTask.objects.get().status, ImageTask.Status.DONE)
+
+
+class RenditionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.profile = self.user.profile
+
+    def test_prepare_avatar_decodes_once(self):
+        """Все копии строятся из одного декодирования исходника."""
+        with mock.patch('avatars.utils.Image.open', wraps=Image.open) as image_open:
+            pil_img, renditions = prepare_avatar(make_upload(size=(600, 400)), sizes=(32, 64, 256))
+
+        self.assertEqual(image_open.call_count, 1)
+        self.assertEqual(pil_img.size, (400, 400))
+        self.assertEqual(
+            {size: rendition.size for size, rendition in renditions.items()},
+            {32: (32, 32), 64: (64, 64), 256: (256, 256)}
+        )
+
+    @override_settings(IMAGE_RENDITION_SIZES={'avatar': (32, 128)})
+    def test_renditions_stored_next_to_avatar(self):
+        self.profile.avatar = make_upload(size=(600, 400))
+        self.profile.save()
+        run_pending_tasks()
+
+        self.profile.refresh_from_db()
+        self.assertEqual(set(self.profile.avatar_renditions), {'32', '128'})
+        avatar_root = self.profile.avatar.name.rsplit('.', 1)[0]
+        for size, name in self.profile.avatar_renditions.items():
+            self.assertEqual(name, f'{avatar_root}_{size}.jpg')
+            with self.profile.avatar.storage.open(name) as f:
+                self.assertEqual(Image.open(f).size, (int(size), int(size)))
+
+    def test_new_upload_clears_previous_renditions(self):
+        self.profile.avatar = make_upload()
+        self.profile.save()
+        run_pending_tasks()
+        self.profile.refresh_from_db()
+        self.assertTrue(self.profile.avatar_renditions)
+
+        self.profile.avatar = make_upload(color='red')
+        self.profile.save()
+        self.assertEqual(self.profile.avatar_renditions, {})
+
+
+class ReducedDecodeTestCase(TestCase):
+    def test_jpeg_uses_dct_scaling(self):
+        """JPEG декодируется в уменьшенном виде, но не меньше нужного размера."""
+        pil_img = decode_image(make_upload(size=(4000, 3000)), target_size=256, square=True)
+
+        # Масштаб 1/8 дает 500x375, квадрат 375 >= 256
+        self.assertEqual(pil_img.width, pil_img.height)
+        self.assertGreaterEqual(pil_img.width, 256)
+        self.assertEqual(pil_img.width, 3000 // 8)
+
+    def test_png_is_cropped_and_reduced_in_one_pass(self):
+        upload = make_upload(name='avatar.png', size=(3000, 2000), format='PNG')
+        pil_img = decode_image(upload, target_size=256, square=True)
+
+        self.assertEqual(pil_img.width, pil_img.height)
+        self.assertGreaterEqual(pil_img.width, 512)
+        self.assertLess(pil_img.width, 2000)
+
+    def test_small_image_is_not_upscaled(self):
+        pil_img = decode_image(make_upload(size=(300, 200)), target_size=1024, square=True)
+        self.assertEqual(pil_img.size, (200, 200))
+
+    def test_avatar_is_bounded_by_max_size(self):
+        pil_img, renditions = prepare_avatar(
+            make_upload(size=(3000, 2000)), sizes=(64,), max_size=512
+        )
+        self.assertEqual(pil_img.size, (512, 512))
+        self.assertEqual(renditions[64].size, (64, 64))
+
+
+def make_photo(size=(4000, 3000), orientation=6):
+    """JPEG "с камеры": EXIF с ориентацией и GPS-координатами."""
+    pil_img = Image.new('RGB', size, 'blue')
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    exif[0x010F] = 'Camera'
+    image_bytes = BytesIO()
+    pil_img.save(image_bytes, format='JPEG', exif=exif, quality=95)
+    return SimpleUploadedFile('photo.jpg', image_bytes.getvalue(), content_type='image/jpeg')
+
+
+@override_settings(
+    IMAGE_RENDITION_SIZES={'avatar': (64,), 'shared_image': (320,)},
+    IMAGE_MAX_DIMENSIONS={'avatar': 1024, 'shared_image': 1280}
+)
+class SharedImageProcessingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='p')
+
+    def test_upload_is_queued(self):
+        image = SharedImage.objects.create(owner=self.user, image=make_photo())
+
+        self.assertEqual(image.image_status, ProcessingStatus.PENDING)
+        task = ImageTask.objects.get()
+        self.assertEqual(task.kind, ImageKind.SHARED_IMAGE)
+        self.assertEqual(task.source_name, image.image.name)
+
+    def test_worker_bounds_size_and_strips_metadata(self):
+        """Длинная сторона ограничена без обрезки, EXIF применен и удален."""
+        image = SharedImage.objects.create(owner=self.user, image=make_photo())
+        raw_name = image.image.name
+        storage = image.image.storage
+        raw_size = storage.size(raw_name)
+        run_pending_tasks()
+
+        image.refresh_from_db()
+        self.assertEqual(image.image_status, ProcessingStatus.READY)
+        self.assertFalse(storage.exists(raw_name))
+        self.assertLess(storage.size(image.image.name), raw_size)
+        with storage.open(image.image.name) as f:
+            processed = Image.open(f)
+            # Ориентация 6 - поворот на 90 градусов: 4000x3000 -> 3000x4000
+            self.assertEqual(processed.size, (960, 1280))
+            self.assertEqual(len(processed.getexif()), 0)
+        with storage.open(image.image_renditions['320']) as f:
+            self.assertEqual(Image.open(f).size, (240, 320))
+
+    def test_failed_processing_marks_image(self):
+        image = SharedImage.objects.create(owner=self.user, image=make_photo())
+        with mock.patch('avatars.tasks.prepare_shared_image', return_value=None):
+            run_pending_tasks()
+
+        image.refresh_from_db()
+        self.assertEqual(image.image_status, ProcessingStatus.FAILED)
+        self.assertEqual(ImageTask.objects.get().status, ImageTask.Status.FAILED)
+
+    def test_small_image_is_not_upscaled(self):
+        pil_img, renditions = prepare_shared_image(make_upload(size=(300, 200)), sizes=(320, 100))
+        self.assertEqual(pil_img.size, (300, 200))
+        self.assertEqual(renditions[320].size, (300, 200))
+        self.assertEqual(renditions[100].size, (100, 67))
+
+
+class ContentHashedNamesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.profile = self.user.profile
+
+    @override_settings(IMAGE_EXTRA_FORMATS=(), IMAGE_RENDITION_SIZES={'avatar': (64,)})
+    def test_processed_files_are_named_by_content(self):
+        self.profile.avatar = make_upload()
+        self.profile.save()
+        run_pending_tasks()
+
+        self.profile.refresh_from_db()
+        folder, filename = self.profile.avatar.name.rsplit('/', 1)
+        self.assertEqual(folder, f'avatars/user_{self.user.pk}')
+        self.assertRegex(filename, r'^[0-9a-f]{32}\.jpg$')
+        self.assertEqual(self.profile.avatar_renditions, {'64': f'{folder}/{filename[:-4]}_64.jpg'})
+
+    def test_any_output_change_gives_new_hash(self):
+        digests = {(None, 'JPEG'): 'a', (64, 'JPEG'): 'b'}
+        self.assertEqual(get_outputs_hash(digests), get_outputs_hash(dict(reversed(digests.items()))))
+        self.assertNotEqual(get_outputs_hash(digests), get_outputs_hash({**digests, (64, 'JPEG'): 'c'}))
+        self.assertNotEqual(get_outputs_hash(digests), get_outputs_hash({**digests, (64, 'WEBP'): 'b'}))
+
+    def test_blob_files_shared_by_content_are_kept(self):
+        """Исходники, отличающиеся только метаданными, дают те же файлы."""
+        blob1 = ImageBlob.objects.create(kind=ImageKind.AVATAR, source_sha256='a', name='avatars/x.jpg', ref_count=1)
+        ImageBlob.objects.create(kind=ImageKind.AVATAR, source_sha256='b', name='avatars/x.jpg', ref_count=1)
+        storage = self.profile.avatar.storage
+        storage.save('avatars/x.jpg', make_upload())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ImageBlob.objects.release(blob1.pk)
+        self.assertTrue(storage.exists('avatars/x.jpg'))
@@ -0,0 +1,96 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from avatars import cache as profile_cache
+from avatars.tasks import run_pending_tasks
+from tests.test_processing import make_upload
+
+
+class ProfileCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.profile = self.user.profile
+        self.url = f'/api/profiles/{self.profile.pk}/'
+
+    def test_detail_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url)
+
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.profile.name = 'Новое имя'
+        self.profile.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['name'], 'Новое имя')
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_is_invalidated_by_version(self):
+        self.client.get('/api/profiles/')
+        User.objects.create_user(username='user2', password='p')
+
+        response = self.client.get('/api/profiles/')
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_user_change_invalidates_profile(self):
+        self.client.get(self.url)
+        self.user.email = 'new@example.com'
+        self.user.save()
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['user']['email'], 'new@example.com')
+
+    def test_worker_update_invalidates_profile(self):
+        """QuerySet.update() в воркере не вызывает post_save, кэш сбрасывается отдельным сигналом."""
+        self.profile.avatar = make_upload()
+        self.profile.save()
+        self.assertEqual(self.client.get(self.url).data['avatar_status'], 'pending')
+
+        run_pending_tasks()
+        self.assertEqual(self.client.get(self.url).data['avatar_status'], 'ready')
+
+    def test_entry_built_before_change_is_not_served(self):
+        """Ответ, построенный до изменения профиля, не попадает в кэш под новой версией."""
+        key = profile_cache.get_detail_key(self.profile.pk)
+        self.profile.name = 'Новое имя'
+        self.profile.save()
+        profile_cache.set_detail(key, 'http://testserver/', {'name': 'user1'})
+
+        self.assertEqual(self.client.get(self.url).data['name'], 'Новое имя')
+
+    @override_settings(PROFILE_CACHE_STATS_SAMPLE_RATE=1)
+    def test_stats_for_admin_only(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get('/api/profiles/cache-stats/').status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = User.objects.create_superuser(username='admin', password='p')
+        self.client.force_authenticate(admin)
+        response = self.client.get('/api/profiles/cache-stats/')
+        self.assertEqual(response.data, {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_detail_has_last_modified(self):
+        response = self.client.get(self.url)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertIn('ETag', response)
@@ -0,0 +1,148 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from avatars.formats import get_variant_path
+from avatars.models import ImageBlob, SharedImage, get_source_path
+from avatars.tasks import run_pending_tasks
+from tests.test_processing import make_upload
+
+
+def reprocess(*args, processes=0):
+    # Потоки не используются: в тестах данные видны только в соединении текущего потока
+    out = StringIO()
+    call_command(
+        'reprocess_images', '--processes', str(processes), '--io-threads', '0', *args, stdout=out
+    )
+    return out.getvalue()
+
+
+@override_settings(IMAGE_EXTRA_FORMATS=(), IMAGE_RENDITION_SIZES={'avatar': (64,), 'shared_image': (320,)})
+class ReprocessImagesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.profile = self.user.profile
+        self.profile.avatar = make_upload(size=(600, 400))
+        self.profile.save()
+        run_pending_tasks()
+        self.profile.refresh_from_db()
+
+    @override_settings(IMAGE_EXTRA_FORMATS=('WEBP',), IMAGE_RENDITION_SIZES={'avatar': (32, 128), 'shared_image': (320,)})
+    def test_regenerates_with_current_settings(self):
+        old_files = [self.profile.avatar.name, *self.profile.avatar_renditions.values()]
+        storage = self.profile.avatar.storage
+
+        with self.captureOnCommitCallbacks(execute=True):
+            output = reprocess('--kind', 'avatar')
+
+        self.assertIn('avatar: Перегенерировано 1', output)
+        self.profile.refresh_from_db()
+        self.assertEqual(set(self.profile.avatar_renditions), {'32', '128'})
+        self.assertEqual(self.profile.avatar_formats, ['WEBP'])
+        self.assertTrue(self.profile.avatar.name.startswith(f'avatars/user_{self.user.pk}/'))
+        with storage.open(get_variant_path(self.profile.avatar_renditions['32'], 'WEBP')) as f:
+            self.assertEqual(Image.open(f).size, (32, 32))
+        for name in old_files:
+            self.assertFalse(storage.exists(name))
+
+    @override_settings(IMAGE_EXTRA_FORMATS=(), IMAGE_RENDITION_SIZES={'avatar': (48,), 'shared_image': (320,)})
+    def test_encodes_in_process_pool(self):
+        name = self.profile.avatar.name
+        output = reprocess('--kind', 'avatar', processes=1)
+
+        self.assertIn('avatar: Перегенерировано 1', output)
+        self.profile.refresh_from_db()
+        self.assertNotEqual(self.profile.avatar.name, name)
+
+    def test_unchanged_settings_keep_files(self):
+        """Имена строятся по содержимому: те же настройки дают те же файлы."""
+        name = self.profile.avatar.name
+        with self.captureOnCommitCallbacks(execute=True):
+            reprocess('--kind', 'avatar')
+
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar.name, name)
+        self.assertTrue(self.profile.avatar.storage.exists(name))
+
+    def test_dry_run_changes_nothing(self):
+        name = self.profile.avatar.name
+        output = reprocess('--dry-run')
+
+        self.assertIn('avatar: Будет перегенерировано 1', output)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar.name, name)
+
+    def test_shared_blob_is_processed_once(self):
+        content = make_upload(size=(800, 600)).read()
+        for _ in range(2):
+            SharedImage.objects.create(owner=self.user, image=SimpleUploadedFile('a.jpg', content))
+        run_pending_tasks()
+
+        output = reprocess('--kind', 'shared_image')
+
+        self.assertIn('Перегенерировано 1, записей с общим файлом 1', output)
+        blob = ImageBlob.objects.get(kind='shared_image')
+        self.assertEqual(
+            set(SharedImage.objects.values_list('image', flat=True)), {blob.name}
+        )
+
+    def test_checkpoint_skips_done_items(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'checkpoint.json')
+            reprocess('--kind', 'avatar', '--checkpoint', path)
+            with open(path) as f:
+                self.assertEqual(
+                    json.load(f), {'positions': {'avatar': self.profile.pk}, 'failed': {'avatar': []}}
+                )
+
+            output = reprocess('--kind', 'avatar', '--checkpoint', path)
+        self.assertIn('Перегенерировано 0', output)
+
+    @override_settings(IMAGE_EXTRA_FORMATS=(), IMAGE_RENDITION_SIZES={'avatar': (48,), 'shared_image': (320,)})
+    def test_failed_items_are_retried(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'checkpoint.json')
+            with mock.patch('avatars.reprocess.render_image', side_effect=OSError('сбой')):
+                output = reprocess('--kind', 'avatar', '--checkpoint', path)
+            self.assertIn('ошибок 1', output)
+            with open(path) as f:
+                self.assertEqual(json.load(f)['failed'], {'avatar': [self.profile.pk]})
+
+            output = reprocess('--kind', 'avatar', '--checkpoint', path)
+            with open(path) as f:
+                self.assertEqual(json.load(f)['failed'], {'avatar': []})
+        self.assertIn('Перегенерировано 1', output)
+
+    def test_source_is_kept_and_used(self):
+        """Перегенерация идет с оригинала загрузки, а не со сжатого основного файла."""
+        storage = self.profile.avatar.storage
+        source_name = get_source_path(self.profile.avatar.name)
+        with storage.open(source_name) as f:
+            self.assertEqual(Image.open(f).size, (600, 400))
+
+        with override_settings(IMAGE_RENDITION_SIZES={'avatar': (48,), 'shared_image': (320,)}):
+            with self.captureOnCommitCallbacks(execute=True):
+                reprocess('--kind', 'avatar')
+
+        self.profile.refresh_from_db()
+        self.assertTrue(storage.exists(get_source_path(self.profile.avatar.name)))
+        self.assertFalse(storage.exists(source_name))
+
+    def test_items_without_source_are_skipped(self):
+        storage = self.profile.avatar.storage
+        name = self.profile.avatar.name
+        storage.delete(get_source_path(name))
+
+        output = reprocess('--kind', 'avatar')
+
+        self.assertIn('без оригинала 1', output)
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar.name, name)
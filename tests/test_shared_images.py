@@ -1,13 +1,17 @@
+from datetime import timedelta
 from io import BytesIO
 
 from django.contrib.auth.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from PIL import Image
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from avatars.models import SharedImage
+from avatars.models import SharedImage, SharedImageRecipient
+from avatars.serializers import SharedImageSerializer
 
 
 class SharedImageAPITestCase(TestCase):
@@ -45,6 +49,8 @@ class SharedImageAPITestCase(TestCase):
         self.assertEqual(SharedImage.objects.count(), 1)
         self.assertEqual(response.data['caption'], 'My first shared photo!')
         self.assertIn(self.user2.id, response.data['shared_with'])
+        # Уменьшение и перекодирование выполняются в фоне
+        self.assertEqual(response.data['image_status'], 'pending')
 
     def test_recipient_can_view_image(self):
         """Тест: user2 (получатель) может видеть изображение, которым с ним поделился user1."""
@@ -90,3 +96,164 @@ class SharedImageAPITestCase(TestCase):
         self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token2}')
         delete_response = self.client.delete(f'/api/shared_images/{image_id}/')
         self.assertEqual(delete_response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_list_is_paginated_and_slim(self):
+        """Список изображений: новые сначала, без вложенных объектов по умолчанию."""
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token1}')
+        for color in ('red', 'green', 'blue'):
+            img_bytes = BytesIO()
+            Image.new('RGB', (10, 10), color).save(img_bytes, format='JPEG')
+            upload = SimpleUploadedFile(f"{color}.jpg", img_bytes.getvalue(), "image/jpeg")
+            self.client.post('/api/shared_images/', {'image': upload, 'shared_with': [self.user2.id]}, format='multipart')
+
+        response = self.client.get('/api/shared_images/', {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual(len(results), 2)
+        self.assertGreater(results[0]['id'], results[1]['id'])
+        self.assertEqual(results[0]['owner'], self.user1.id)
+        self.assertNotIn('shared_with', results[0])
+        self.assertIsNotNone(response.data['next'])
+
+        response = self.client.get('/api/shared_images/', {'expand': 'owner,shared_with'})
+        item = response.data['results'][0]
+        self.assertEqual(item['owner']['username'], 'user1')
+        self.assertEqual(item['shared_with'], [self.user2.id])
+
+
+class BulkShareTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='p')
+        self.other = User.objects.create_user(username='other', password='p')
+        self.client.force_authenticate(self.owner)
+        self.images = [
+            SharedImage.objects.create(owner=self.owner, image=f'shared/owner_1/{i}.jpg')
+            for i in range(3)
+        ]
+        self.image_ids = [image.pk for image in self.images]
+
+    def make_users(self, count, prefix):
+        return User.objects.bulk_create(
+            [User(username=f'{prefix}{i}') for i in range(count)]
+        )
+
+    def share(self, users, images=None, action='share'):
+        return self.client.post(
+            f'/api/shared_images/{action}/',
+            {'images': images or self.image_ids, 'users': [user.pk for user in users]},
+            format='json'
+        )
+
+    def test_share_many_images_with_many_users(self):
+        users = self.make_users(5, 'r')
+        response = self.share(users)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'shared': 15})
+        self.assertEqual(SharedImageRecipient.objects.count(), 15)
+
+        # Повторное предоставление доступа не создает дубликатов
+        response = self.share(users)
+        self.assertEqual(response.data, {'shared': 0})
+        self.assertEqual(SharedImageRecipient.objects.count(), 15)
+
+    def test_share_counts_only_new_pairs(self):
+        users = self.make_users(2, 'r')
+        self.share(users[:1])
+
+        response = self.share(users)
+
+        self.assertEqual(response.data, {'shared': 3})
+        self.assertEqual(SharedImageRecipient.objects.count(), 6)
+
+    def test_query_count_does_not_grow_with_recipients(self):
+        few = self.make_users(2, 'a')
+        # 450 строк помещаются в одну пачку INSERT даже на SQLite
+        many = self.make_users(150, 'b')
+
+        with CaptureQueriesContext(connection) as few_queries:
+            self.share(few)
+        with CaptureQueriesContext(connection) as many_queries:
+            self.share(many)
+        self.assertEqual(len(few_queries), len(many_queries))
+
+    def test_cannot_share_foreign_image(self):
+        foreign = SharedImage.objects.create(owner=self.other, image='shared/owner_2/x.jpg')
+        response = self.share([self.other], images=[foreign.pk])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('images', response.data)
+        self.assertFalse(SharedImageRecipient.objects.exists())
+
+    def test_unknown_user_is_rejected(self):
+        response = self.client.post(
+            '/api/shared_images/share/',
+            {'images': self.image_ids, 'users': [self.other.pk, 999999]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('users', response.data)
+        self.assertFalse(SharedImageRecipient.objects.exists())
+
+    @override_settings(SHARED_IMAGE_BULK_MAX_PAIRS=5)
+    def test_pair_limit(self):
+        response = self.share(self.make_users(2, 'r'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_unshare(self):
+        users = self.make_users(3, 'r')
+        self.share(users)
+
+        response = self.share(users[:2], images=self.image_ids[:1], action='unshare')
+
+        self.assertEqual(response.data, {'unshared': 2})
+        self.assertEqual(SharedImageRecipient.objects.count(), 7)
+
+    def test_create_validates_recipients_in_one_query(self):
+        users = self.make_users(50, 'r')
+        field = SharedImageSerializer(context={'request': None}).fields['shared_with']
+
+        with CaptureQueriesContext(connection) as queries:
+            result = field.to_internal_value([user.pk for user in users])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual([user.pk for user in result], [user.pk for user in users])
+
+
+class SharedImageConditionalGetTestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.owner = User.objects.create_user(username='owner', password='p')
+        self.recipient = User.objects.create_user(username='recipient', password='p')
+        self.image = SharedImage.objects.create(owner=self.owner, image='shared/owner_1/a.jpg')
+        self.image.shared_with.add(self.recipient)
+        self.url = f'/api/shared_images/{self.image.pk}/'
+        self.client.force_authenticate(self.owner)
+
+    def test_detail_has_validators(self):
+        response = self.client.get(self.url)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_owner_and_recipient_get_different_etags(self):
+        """Получатели видны только владельцу - это разные представления."""
+        owner_etag = self.client.get(self.url)['ETag']
+        self.client.force_authenticate(self.recipient)
+        self.assertNotEqual(self.client.get(self.url)['ETag'], owner_etag)
+
+    def test_sharing_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        SharedImage.objects.filter(pk=self.image.pk).update(updated_at=self.image.updated_at - timedelta(seconds=5))
+        self.client.post(
+            '/api/shared_images/share/',
+            {'images': [self.image.pk], 'users': [self.owner.pk]},
+            format='json'
+        )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -0,0 +1,136 @@
+import time
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from avatars.models import SharedImage
+from avatars.signing import SignedURLCache
+from avatars.storage import PrivateS3Storage
+
+
+def make_storage():
+    return PrivateS3Storage(
+        access_key='key', secret_key='secret', bucket_name='bucket', region_name='us-east-1'
+    )
+
+
+@override_settings(SIGNED_URL_CACHE_WINDOW=600, AWS_QUERYSTRING_EXPIRE=3600)
+class SignedURLCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.signed = []
+
+    def sign(self, name, expire):
+        self.signed.append((name, expire))
+        return f'https://s3/{name}?sig={len(self.signed)}'
+
+    def test_signature_is_reused_within_window(self):
+        urls = SignedURLCache('test')
+        with mock.patch('avatars.signing.time.time', return_value=1200.0):
+            first = urls.get_many(['a.jpg', 'b.jpg'], self.sign, 3600)
+        with mock.patch('avatars.signing.time.time', return_value=1799.0):
+            second = urls.get_many(['a.jpg', 'b.jpg'], self.sign, 3600)
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.signed), 2)
+        self.assertEqual(urls.stats['local_hits'], 2)
+        # Ссылка действует до конца окна плюс expire
+        self.assertEqual(self.signed[0][1], 600 + 1 + 3600)
+
+    def test_new_window_signs_again(self):
+        urls = SignedURLCache('test')
+        with mock.patch('avatars.signing.time.time', return_value=1200.0):
+            first = urls.get_many(['a.jpg'], self.sign, 3600)
+        with mock.patch('avatars.signing.time.time', return_value=1800.0):
+            second = urls.get_many(['a.jpg'], self.sign, 3600)
+
+        self.assertNotEqual(first, second)
+        self.assertEqual(len(self.signed), 2)
+
+    def test_other_processes_reuse_shared_cache(self):
+        with mock.patch('avatars.signing.time.time', return_value=1200.0):
+            first = SignedURLCache('test').get_many(['a.jpg'], self.sign, 3600)
+            second = SignedURLCache('test').get_many(['a.jpg'], self.sign, 3600)
+
+        self.assertEqual(first, second)
+        self.assertEqual(len(self.signed), 1)
+
+    def test_local_cache_is_bounded(self):
+        urls = SignedURLCache('test', max_size=2)
+        urls.get_many(['a.jpg', 'b.jpg', 'c.jpg'], self.sign, 3600)
+        self.assertEqual(len(urls.local), 2)
+
+
+class PrivateS3StorageTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_url_is_presigned_once(self):
+        storage = make_storage()
+        with mock.patch.object(
+            storage.bucket.meta.client, 'generate_presigned_url',
+            wraps=storage.bucket.meta.client.generate_presigned_url
+        ) as sign:
+            first = storage.url('shared/a.jpg')
+            second = storage.url('shared/a.jpg')
+
+        self.assertEqual(first, second)
+        self.assertEqual(sign.call_count, 1)
+        query = parse_qs(urlparse(first).query)
+        self.assertIn('Signature', query)
+        self.assertGreaterEqual(int(query['Expires'][0]), time.time() + 3600)
+
+    def test_objects_are_private(self):
+        storage = make_storage()
+        self.assertEqual(storage._get_write_parameters('a.jpg')['ACL'], 'private')
+
+    def test_list_signs_page_in_one_batch(self):
+        user = User.objects.create_user(username='owner', password='p')
+        SharedImage.objects.bulk_create([
+            SharedImage(
+                owner=user,
+                image=f'shared/owner/{i}.jpg',
+                image_renditions={'320': f'shared/owner/{i}_320.jpg'}
+            )
+            for i in range(5)
+        ])
+        client = APIClient()
+        client.force_authenticate(user)
+        storage = make_storage()
+        field = SharedImage._meta.get_field('image')
+
+        with mock.patch.object(field, 'storage', storage), \
+                mock.patch.object(storage.signed_urls, 'get_many', wraps=storage.signed_urls.get_many) as get_many:
+            response = client.get('/api/shared_images/')
+
+        self.assertEqual(response.status_code, 200)
+        item = response.data['results'][0]
+        self.assertIn('Signature=', item['image'])
+        self.assertIn('Signature=', item['image_renditions']['320'])
+        # Первый вызов подписывает всю страницу, остальные берут ссылки из памяти
+        self.assertEqual(len(get_many.call_args_list[0].args[0]), 10)
+        self.assertEqual(storage.signed_urls.stats['signed'], 10)
+
+    def test_detail_etag_follows_signing_window(self):
+        """Ответ с закрытыми ссылками не отдается как 304 после смены окна подписи."""
+        user = User.objects.create_user(username='owner', password='p')
+        image = SharedImage.objects.create(owner=user, image='shared/owner/a.jpg')
+        client = APIClient()
+        client.force_authenticate(user)
+        url = f'/api/shared_images/{image.pk}/'
+
+        with mock.patch.object(SharedImage._meta.get_field('image'), 'storage', make_storage()):
+            with mock.patch('avatars.signing.time.time', return_value=1200.0):
+                response = client.get(url)
+                self.assertNotIn('Last-Modified', response)
+                etag = response['ETag']
+                self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            with mock.patch('avatars.signing.time.time', return_value=1800.0):
+                response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
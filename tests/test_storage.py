@@ -0,0 +1,160 @@
+import hashlib
+import io
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from avatars.storage import S3_MIN_PART_SIZE, S3MultipartWriter, save_file, spool_output
+
+
+class FakeS3Client:
+    """Минимальная замена boto3-клиента S3: хранит объекты в словаре."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.calls = []
+
+    def put_object(self, Bucket, Key, Body, **extra):
+        self.calls.append('put_object')
+        self.objects[Key] = (Body, extra)
+
+    def create_multipart_upload(self, Bucket, Key, **extra):
+        self.calls.append('create_multipart_upload')
+        upload_id = f'upload-{len(self.uploads) + 1}'
+        self.uploads[upload_id] = {'key': Key, 'parts': {}, 'extra': extra}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.calls.append('upload_part')
+        self.uploads[UploadId]['parts'][PartNumber] = Body
+        return {'ETag': f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.calls.append('complete_multipart_upload')
+        upload = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        self.objects[Key] = (b''.join(upload['parts'][n] for n in numbers), upload['extra'])
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.calls.append('abort_multipart_upload')
+        self.uploads.pop(UploadId)
+
+    def put_object_acl(self, Bucket, Key, ACL):
+        self.calls.append('put_object_acl')
+        body, extra = self.objects[Key]
+        self.objects[Key] = (body, {**extra, 'ACL': ACL})
+
+
+class S3MultipartWriterTestCase(TestCase):
+    def setUp(self):
+        self.client = FakeS3Client()
+
+    def test_streams_fixed_size_parts(self):
+        writer = S3MultipartWriter(self.client, 'bucket', 'key', part_size=10)
+        for chunk in (b'a' * 7, b'b' * 7, b'c' * 11):
+            writer.write(chunk)
+        # Полные части отправлены сразу, в буфере только остаток
+        self.assertEqual(len(writer.buffer), 5)
+        writer.close()
+
+        self.assertEqual(self.client.objects['key'][0], b'a' * 7 + b'b' * 7 + b'c' * 11)
+        self.assertEqual(self.client.calls.count('upload_part'), 3)
+
+    def test_small_file_uses_single_put(self):
+        writer = S3MultipartWriter(self.client, 'bucket', 'key', extra_args={'ACL': 'private'}, part_size=10)
+        writer.write(b'tiny')
+        writer.close()
+
+        self.assertEqual(self.client.calls, ['put_object'])
+        self.assertEqual(self.client.objects['key'], (b'tiny', {'ACL': 'private'}))
+
+    def test_abort_discards_parts(self):
+        writer = S3MultipartWriter(self.client, 'bucket', 'key', part_size=10)
+        writer.write(b'x' * 25)
+        writer.abort()
+
+        self.assertEqual(self.client.uploads, {})
+        self.assertNotIn('key', self.client.objects)
+
+    def test_part_size_is_not_below_s3_minimum(self):
+        with override_settings(IMAGE_UPLOAD_PART_SIZE=1024):
+            writer = S3MultipartWriter(self.client, 'bucket', 'key')
+        self.assertEqual(writer.part_size, S3_MIN_PART_SIZE)
+
+    @override_settings(IMAGE_UPLOAD_PART_SIZE=1024)
+    @mock.patch('avatars.storage.S3_MIN_PART_SIZE', 1024)
+    def test_pillow_encoder_output_is_uploaded_to_s3(self):
+        storage = S3Boto3Storage(access_key='key', secret_key='secret', bucket_name='bucket', location='media')
+        bucket = SimpleNamespace(name='bucket', meta=SimpleNamespace(client=self.client))
+        pil_img = Image.effect_noise((128, 128), 50).convert('RGB')
+
+        with mock.patch.object(S3Boto3Storage, 'bucket', new_callable=mock.PropertyMock, return_value=bucket):
+            with spool_output(lambda fp: pil_img.save(fp, format='JPEG')) as (spool, _):
+                name = save_file(storage, 'avatars/a.jpg', spool)
+
+        self.assertEqual(name, 'avatars/a.jpg')
+        body, extra = self.client.objects['media/avatars/a.jpg']
+        self.assertEqual(Image.open(io.BytesIO(body)).size, (128, 128))
+        self.assertEqual(extra['ContentType'], 'image/jpeg')
+        self.assertGreater(self.client.calls.count('upload_part'), 1)
+
+    @override_settings(IMAGE_UPLOAD_PART_SIZE=1024)
+    @mock.patch('avatars.storage.S3_MIN_PART_SIZE', 1024)
+    def test_failed_completion_aborts_upload(self):
+        storage = S3Boto3Storage(access_key='key', secret_key='secret', bucket_name='bucket')
+        bucket = SimpleNamespace(name='bucket', meta=SimpleNamespace(client=self.client))
+        self.client.complete_multipart_upload = mock.Mock(side_effect=OSError('S3 недоступен'))
+
+        with mock.patch.object(S3Boto3Storage, 'bucket', new_callable=mock.PropertyMock, return_value=bucket):
+            with self.assertRaises(OSError):
+                save_file(storage, 'a.jpg', io.BytesIO(b'x' * 3000))
+
+        self.assertIn('abort_multipart_upload', self.client.calls)
+        self.assertEqual((self.client.objects, self.client.uploads), ({}, {}))
+
+    @override_settings(IMAGE_UPLOAD_PART_SIZE=1024, IMAGE_STREAM_SPOOL_SIZE=512)
+    @mock.patch('avatars.storage.S3_MIN_PART_SIZE', 1024)
+    def test_spooled_output_is_hashed_and_uploaded_in_parts(self):
+        storage = S3Boto3Storage(access_key='key', secret_key='secret', bucket_name='bucket', location='media')
+        bucket = SimpleNamespace(name='bucket', meta=SimpleNamespace(client=self.client))
+        payload = b'x' * 3000
+
+        with mock.patch.object(S3Boto3Storage, 'bucket', new_callable=mock.PropertyMock, return_value=bucket):
+            with spool_output(lambda fp: fp.write(payload)) as (spool, digest):
+                save_file(storage, 'a.bin', spool)
+
+        self.assertEqual(digest, hashlib.sha256(payload).hexdigest())
+        self.assertEqual(self.client.objects['media/a.bin'][0], payload)
+        self.assertEqual(self.client.calls.count('upload_part'), 3)
+        # Параметры объектов (Cache-Control и т.п.) передаются и при multipart
+        self.assertIn('CacheControl', self.client.objects['media/a.bin'][1])
+
+    def test_other_storages_save_spooled_file(self):
+        with tempfile.TemporaryDirectory() as location:
+            storage = FileSystemStorage(location=location)
+            with spool_output(lambda fp: fp.write(b'payload')) as (spool, _):
+                name = save_file(storage, 'a/b.bin', spool)
+            with storage.open(name) as f:
+                self.assertEqual(f.read(), b'payload')
+
+
+class UploadSizeLimitTestCase(TestCase):
+    def test_oversized_upload_is_rejected_while_streaming(self):
+        client = APIClient()
+        user = User.objects.create_user(username='user1', password='p')
+        client.force_authenticate(user)
+        upload = SimpleUploadedFile('big.jpg', b'\xff\xd8\xff' + b'0' * (6 * 1024 * 1024), 'image/jpeg')
+
+        response = client.patch(f'/api/profiles/{user.profile.id}/', {'avatar': upload}, format='multipart')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
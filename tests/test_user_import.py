@@ -0,0 +1,152 @@
+import io
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from avatars import cache
+from avatars.models import ImageTask, ProcessingStatus, Profile
+from avatars.user_import import UserImporter, read_records
+
+from .test_processing import make_upload
+
+CSV = '''username,email,password,password_hash,name
+anna,anna@example.com,secret1,,Анна
+boris,,,,
+,nobody@example.com,x,,
+anna,dup@example.com,x,,
+petr,not-an-email,x,,
+olga,,,{hash},Ольга
+'''
+
+
+def run_import(text, file_format='csv', **kwargs):
+    kwargs.setdefault('processes', 0)
+    return UserImporter(**kwargs).run(read_records(io.StringIO(text), file_format))
+
+
+class UserImporterTestCase(TestCase):
+    def test_users_and_profiles_are_bulk_created(self):
+        text = CSV.format(hash=make_password('prehashed'))
+        with self.assertNumQueries(5):
+            # SELECT существующих, INSERT пользователей и профилей (+ точка сохранения)
+            stats = run_import(text)
+
+        self.assertEqual((stats['created'], stats['skipped'], stats['failed']), (3, 0, 3))
+        self.assertEqual([error['line'] for error in stats['errors']], [4, 5, 6])
+
+        anna = User.objects.get(username='anna')
+        self.assertTrue(anna.check_password('secret1'))
+        self.assertEqual(anna.email, 'anna@example.com')
+        self.assertEqual(anna.profile.name, 'Анна')
+        self.assertFalse(User.objects.get(username='boris').has_usable_password())
+        self.assertEqual(Profile.objects.get(user__username='boris').name, 'boris')
+        self.assertTrue(User.objects.get(username='olga').check_password('prehashed'))
+
+    def test_existing_users_are_skipped(self):
+        User.objects.create_user(username='anna', password='p')
+        stats = run_import('{"username": "anna"}\n{"username": "ivan"}\nnot json\n', 'jsonl', batch_size=1)
+
+        self.assertEqual((stats['created'], stats['skipped'], stats['failed']), (1, 1, 1))
+        self.assertEqual(stats['errors'][0]['line'], 3)
+        self.assertEqual(Profile.objects.count(), 2)
+
+    def test_unknown_hash_is_rejected(self):
+        stats = run_import('username,password_hash\nanna,plaintext\n')
+        self.assertEqual(stats['failed'], 1)
+        self.assertFalse(User.objects.exists())
+
+    def test_passwords_are_hashed_in_process_pool(self):
+        stats = run_import('username,password\na,pa\nb,pb\nc,pc\n', processes=2)
+        self.assertEqual(stats['created'], 3)
+        for username in 'abc':
+            self.assertTrue(User.objects.get(username=username).check_password(f'p{username}'))
+
+    def test_import_invalidates_profile_list_cache(self):
+        version = cache.get_cache().get(cache.LIST_VERSION_KEY)
+        run_import('username\nanna\n')
+        self.assertNotEqual(cache.get_cache().get(cache.LIST_VERSION_KEY), version)
+
+    def test_avatars_are_attached_from_directory(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with open(os.path.join(directory.name, 'anna.jpg'), 'wb') as f:
+            f.write(make_upload().read())
+        with open(os.path.join(directory.name, 'bad.txt'), 'w') as f:
+            f.write('not an image')
+
+        text = 'username,avatar\nanna,anna.jpg\nboris,bad.txt\nivan,../etc/passwd\n'
+        stats = run_import(text, avatar_dir=directory.name, io_threads=0)
+
+        self.assertEqual((stats['created'], stats['avatars'], stats['avatar_errors']), (2, 1, 1))
+        self.assertEqual(stats['failed'], 1)
+        profile = Profile.objects.get(user__username='anna')
+        self.assertEqual(profile.avatar_status, ProcessingStatus.PENDING)
+        self.assertEqual(ImageTask.objects.get().source_name, profile.avatar.name)
+        self.assertFalse(Profile.objects.get(user__username='boris').avatar)
+
+
+class ImportUsersCommandTestCase(TestCase):
+    def test_command_imports_file(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False) as f:
+            f.write(json.dumps({'username': 'anna', 'email': 'anna@example.com'}) + '\n')
+        self.addCleanup(os.remove, f.name)
+
+        out = StringIO()
+        call_command('import_users', f.name, '--processes', '0', stdout=out)
+
+        self.assertIn('Создано 1', out.getvalue())
+        self.assertTrue(Profile.objects.filter(user__username='anna').exists())
+
+    def test_dry_run_creates_nothing(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('username\nanna\n')
+        self.addCleanup(os.remove, f.name)
+
+        out = StringIO()
+        call_command('import_users', f.name, '--dry-run', stdout=out)
+
+        self.assertIn('Будет создано 1', out.getvalue())
+        self.assertFalse(User.objects.filter(username='anna').exists())
+
+
+@override_settings(USER_IMPORT_API_THREADS=2)
+class UserImportAPITestCase(TestCase):
+    url = '/api/users/import/'
+
+    def setUp(self):
+        self.client = APIClient()
+        self.admin = User.objects.create_superuser(username='admin', password='p')
+
+    def upload(self, content, name='users.csv'):
+        return self.client.post(
+            self.url, {'file': SimpleUploadedFile(name, content.encode())}, format='multipart'
+        )
+
+    def test_only_admins_can_import(self):
+        self.client.force_authenticate(User.objects.create_user(username='user', password='p'))
+        self.assertEqual(self.upload('username\nanna\n').status_code, 403)
+
+    def test_import(self):
+        self.client.force_authenticate(self.admin)
+        response = self.upload('{"username": "anna", "password": "p1"}\n{"username": ""}\n', 'users.jsonl')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+        self.assertEqual(response.data['errors'][0]['line'], 2)
+        self.assertTrue(User.objects.get(username='anna').check_password('p1'))
+
+    @override_settings(USER_IMPORT_API_MAX_ROWS=1)
+    def test_large_files_are_rejected_before_import(self):
+        self.client.force_authenticate(self.admin)
+        response = self.upload('username\nanna\nboris\n')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(User.objects.filter(username='anna').exists())
@@ -0,0 +1,104 @@
+import struct
+import warnings
+import zlib
+from io import BytesIO
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from avatars.models import SharedImage
+from avatars.validators import read_image_header, validate_image_header
+
+
+def png_header_only(width, height):
+    """
+    PNG-файл в несколько десятков байт, объявляющий произвольное разрешение
+    ("декомпрессионная бомба": пиксели почти не занимают места в файле).
+    """
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    idat = zlib.compress(b'\x00' * 16)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', ihdr) + chunk(b'IDAT', idat) + chunk(b'IEND', b'')
+
+
+def jpeg_bytes(size=(100, 100)):
+    buffer = BytesIO()
+    Image.new('RGB', size, 'red').save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def mpo_bytes(size=(100, 100)):
+    """Multi-picture JPEG (MPO), как у камер телефонов: основной снимок и еще один."""
+    buffer = BytesIO()
+    Image.new('RGB', size, 'red').save(
+        buffer, format='MPO', save_all=True, append_images=[Image.new('RGB', size, 'blue')]
+    )
+    return buffer.getvalue()
+
+
+class ImageHeaderValidatorTestCase(TestCase):
+    def test_reads_header_without_decoding(self):
+        header = read_image_header(SimpleUploadedFile('a.jpg', jpeg_bytes((120, 80))))
+        self.assertEqual((header.format, header.width, header.height), ('JPEG', 120, 80))
+        self.assertEqual(header.frames, 1)
+
+    def test_accepts_regular_image(self):
+        validate_image_header(SimpleUploadedFile('a.jpg', jpeg_bytes()))
+
+    def test_accepts_multi_picture_jpeg(self):
+        upload = SimpleUploadedFile('photo.jpg', mpo_bytes())
+        self.assertEqual(read_image_header(upload).format, 'MPO')
+        validate_image_header(upload)
+
+    def test_rejects_too_many_pixels(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with self.assertRaises(ValidationError):
+                validate_image_header(SimpleUploadedFile('bomb.png', png_header_only(7000, 7000)))
+
+    def test_rejects_decompression_bomb(self):
+        with self.assertRaises(ValidationError):
+            validate_image_header(SimpleUploadedFile('bomb.png', png_header_only(50000, 50000)))
+
+    def test_rejects_too_long_side(self):
+        with self.assertRaises(ValidationError):
+            validate_image_header(SimpleUploadedFile('strip.png', png_header_only(12000, 10)))
+
+    def test_format_is_sniffed_from_content(self):
+        """Файл с расширением .jpg, но не являющийся изображением, отклоняется."""
+        with self.assertRaises(ValidationError):
+            validate_image_header(SimpleUploadedFile('fake.jpg', b'GIF89a' + b'\x00' * 64))
+
+    def test_rejects_animated_png(self):
+        frames = [Image.new('RGB', (10, 10), color) for color in ('red', 'blue')]
+        buffer = BytesIO()
+        frames[0].save(buffer, format='PNG', save_all=True, append_images=frames[1:])
+        with self.assertRaises(ValidationError):
+            validate_image_header(SimpleUploadedFile('anim.png', buffer.getvalue()))
+
+
+class UploadValidationAPITestCase(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user1', password='p')
+        self.client.force_authenticate(self.user)
+
+    def test_profile_rejects_bomb(self):
+        upload = SimpleUploadedFile('bomb.png', png_header_only(50000, 50000), 'image/png')
+        response = self.client.patch(
+            f'/api/profiles/{self.user.profile.id}/', {'avatar': upload}, format='multipart'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_shared_image_rejects_oversized(self):
+        upload = SimpleUploadedFile('strip.png', png_header_only(12000, 10), 'image/png')
+        response = self.client.post('/api/shared_images/', {'image': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(SharedImage.objects.exists())
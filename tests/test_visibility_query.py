@@ -0,0 +1,66 @@
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.test import TestCase
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from avatars.models import SharedImage
+from avatars.views import SharedImageViewSet
+
+
+class VisibilityQueryTestCase(TestCase):
+    """
+    Регрессионный тест плана запроса видимости изображений: без JOIN
+    с промежуточной таблицей, без DISTINCT, с поиском по индексу получателя.
+    """
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='p')
+        self.recipient = User.objects.create_user(username='recipient', password='p')
+        self.stranger = User.objects.create_user(username='stranger', password='p')
+        self.owned = SharedImage.objects.create(owner=self.owner, image='shared/a.jpg')
+        self.received = SharedImage.objects.create(owner=self.recipient, image='shared/b.jpg')
+        self.received.shared_with.add(self.owner)
+        SharedImage.objects.create(owner=self.stranger, image='shared/c.jpg')
+
+    def get_queryset(self, user, **params):
+        view = SharedImageViewSet(action='list', format_kwarg=None)
+        view.request = Request(APIRequestFactory().get('/api/shared_images/', params))
+        view.request.user = user
+        return view.get_queryset()
+
+    def explain(self, queryset):
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # На маленьких таблицах планировщик предпочтет seq scan
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            return queryset.explain()
+
+    def test_query_has_no_join_or_distinct(self):
+        for scope in (None, 'owned', 'received'):
+            params = {'scope': scope} if scope else {}
+            sql = str(self.get_queryset(self.owner, **params).query).upper()
+            self.assertNotIn('DISTINCT', sql)
+            self.assertNotIn('JOIN', sql)
+
+    def test_received_lookup_uses_recipient_index(self):
+        for scope in (None, 'received'):
+            params = {'scope': scope} if scope else {}
+            plan = self.explain(self.get_queryset(self.owner, **params))
+            self.assertIn('recipient_user_image_idx', plan)
+
+    def test_scopes(self):
+        self.assertEqual(set(self.get_queryset(self.owner)), {self.owned, self.received})
+        self.assertEqual(list(self.get_queryset(self.owner, scope='owned')), [self.owned])
+        self.assertEqual(list(self.get_queryset(self.owner, scope='received')), [self.received])
+
+    def test_owner_sharing_with_self_is_listed_once(self):
+        self.owned.shared_with.add(self.owner)
+        self.assertEqual(self.get_queryset(self.owner).filter(pk=self.owned.pk).count(), 1)
+
+    def test_invalid_scope(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.get('/api/shared_images/', {'scope': 'everything'})
+        self.assertEqual(response.status_code, 400)